@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Seconds a finished artifact stays fetchable, and how many are kept at most
+ARTIFACT_TTL = float(os.getenv("ARTIFACT_TTL", 3600))
+ARTIFACT_MAX_ENTRIES = int(os.getenv("ARTIFACT_MAX_ENTRIES", 4096))
+
+
+def artifact_id(kind: str, source: str) -> str:
+    """Content address of an artifact: the same kind generated from the same input shares an id."""
+    return hashlib.sha256(f"{kind}\n{source}".encode("utf-8")).hexdigest()[:32]
+
+
+@dataclass
+class Artifact:
+    id: str
+    kind: str
+    task: asyncio.Future
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def status(self) -> str:
+        if not self.task.done():
+            return "pending"
+        return "failed" if self.task.cancelled() or self.task.exception() is not None else "ready"
+
+    def finish(self, task: asyncio.Future) -> None:
+        self.finished_at = time.time()
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Artifact {self.kind} {self.id} failed: {task.exception()}")
+
+    def snapshot(self, ttl: float) -> Dict[str, Any]:
+        status = self.status
+        snapshot = {"id": self.id, "kind": self.kind, "status": status, "data": None}
+        if status == "ready":
+            snapshot["data"] = self.task.result()
+        elif status == "failed":
+            snapshot["error"] = "cancelled" if self.task.cancelled() else str(self.task.exception())
+        if self.finished_at is not None:
+            snapshot["expires_at"] = self.finished_at + ttl
+        return snapshot
+
+
+class ArtifactStore:
+    """
+    Background jobs for derived artifacts (answer visualizations), fetched by id.
+
+    `submit` starts a job unless one for the same content is pending or still
+    fresh, so repeat views of an answer reuse the earlier result instead of
+    regenerating it. Finished artifacts expire `ttl` seconds after completion;
+    failed ones are retried on the next submit. Pending jobs are never evicted,
+    so the store can briefly hold more than `max_entries`.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl if ttl is not None else ARTIFACT_TTL
+        self.max_entries = max_entries or ARTIFACT_MAX_ENTRIES
+        self._artifacts: "OrderedDict[str, Artifact]" = OrderedDict()
+
+        # Counters
+        self.submitted = 0
+        self.reused = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def submit(self, kind: str, source: str, job: Callable[[], Awaitable[Any]]) -> str:
+        """Start job() for (kind, source) unless a usable artifact exists; returns the artifact id."""
+        self._expire()
+        key = artifact_id(kind, source)
+        artifact = self._artifacts.get(key)
+        if artifact is not None and artifact.status != "failed":
+            self._artifacts.move_to_end(key)
+            self.reused += 1
+            return key
+
+        artifact = Artifact(key, kind, asyncio.ensure_future(job()))
+        artifact.task.add_done_callback(artifact.finish)
+        self._artifacts[key] = artifact
+        self.submitted += 1
+        self._evict()
+        return key
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Status and (when ready) data of an artifact, or None if unknown or expired."""
+        self._expire()
+        artifact = self._artifacts.get(key)
+        return artifact.snapshot(self.ttl) if artifact is not None else None
+
+    async def result(self, key: str) -> Any:
+        """
+        Wait for an artifact's data, or None if it is unknown or has expired.
+        Cancelling the wait does not cancel the job.
+        """
+        self._expire()
+        artifact = self._artifacts.get(key)
+        if artifact is None:
+            return None
+        return await asyncio.shield(artifact.task)
+
+    def _evict(self) -> None:
+        """Drop the least recently used finished artifacts beyond max_entries; pending ones are kept."""
+        excess = len(self._artifacts) - self.max_entries
+        if excess <= 0:
+            return
+        finished = [key for key, a in self._artifacts.items() if a.task.done()][:excess]
+        for key in finished:
+            del self._artifacts[key]
+        self.evictions += len(finished)
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.ttl
+        stale = [key for key, a in self._artifacts.items() if a.finished_at is not None and a.finished_at <= cutoff]
+        for key in stale:
+            del self._artifacts[key]
+        self.expired += len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for artifact in self._artifacts.values():
+            statuses[artifact.status] = statuses.get(artifact.status, 0) + 1
+        return {
+            "entries": len(self._artifacts),
+            "by_status": statuses,
+            "ttl_seconds": self.ttl,
+            "submitted": self.submitted,
+            "reused": self.reused,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
+
+
+artifact_store = ArtifactStore()
@@ -0,0 +1,165 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from retrieval_executor import RetrievalOverloadedError
+from scoring import l2_normalize
+from single_flight import SingleFlight
+
+encode_flights = SingleFlight("query_encode")
+
+
+class BatchingEncoder:
+    """
+    Dynamic micro-batching front end for a SentenceTransformer.
+
+    Concurrent callers submit single queries; a background thread collects them
+    for up to `max_wait_ms` or until `max_batch_size` queries are waiting, runs a
+    single `model.encode` over the batch and fans the rows back out to each
+    caller's future. Under load this turns many 1-row matmuls into one batched one.
+
+    Every embedding it returns, batched or bulk, is L2-normalized float32, so
+    inner-product search over them is cosine similarity.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        max_pending: Optional[int] = None,
+    ):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size or int(os.getenv("ENCODER_MAX_BATCH", 32)))
+        if max_wait_ms is None:
+            max_wait_ms = float(os.getenv("ENCODER_MAX_WAIT_MS", 5))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_pending = max_pending or int(os.getenv("ENCODER_MAX_PENDING", 1024))
+
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        # Counters
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+        self.batch_size_counts: Dict[int, int] = {}
+        self.rejected = 0
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="batching-encoder", daemon=True)
+                self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue a single text for encoding; the future resolves to a 1-D float32 vector."""
+        if self._queue.qsize() >= self.max_pending:
+            with self._lock:
+                self.rejected += 1
+            raise RetrievalOverloadedError("Query encoder backlog is full; try again shortly")
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def encode(self, text: str) -> np.ndarray:
+        """Blocking single-query encode through the batcher."""
+        return self.submit(text).result()
+
+    async def encode_async(self, text: str) -> np.ndarray:
+        """Await a single-query encode without occupying an event-loop or pool thread."""
+        # Identical queries in flight at once share one row of the batch
+        return await encode_flights.do((id(self), text), lambda: asyncio.wrap_future(self.submit(text)))
+
+    def encode_batch(
+        self,
+        texts: List[str],
+        chunk_size: int = 256,
+        progress: Optional[Callable[[int, int], None]] = None,
+        **kwargs,
+    ) -> np.ndarray:
+        """Direct batched encode for bulk work such as index builds (bypasses the queue)."""
+        if progress is None:
+            return l2_normalize(self.model.encode(texts, convert_to_numpy=True, **kwargs))
+
+        # Encode in chunks so long builds can report how far along they are
+        parts = []
+        for start in range(0, len(texts), chunk_size):
+            chunk = texts[start:start + chunk_size]
+            parts.append(l2_normalize(self.model.encode(chunk, convert_to_numpy=True, **kwargs)))
+            progress(start + len(chunk), len(texts))
+        return np.vstack(parts) if parts else np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype='float32')
+
+    def _collect(self, first: Tuple[str, Future]) -> Tuple[List[Tuple[str, Future]], bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _worker(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, stop = self._collect(first)
+            # Drop callers that were cancelled while waiting
+            batch = [(text, fut) for text, fut in batch if fut.set_running_or_notify_cancel()]
+            if batch:
+                self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch: List[Tuple[str, Future]]) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            embeddings = l2_normalize(self.model.encode(texts, convert_to_numpy=True, batch_size=len(texts)))
+        except Exception as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+
+        size = len(batch)
+        with self._lock:
+            self.batches += 1
+            self.items += size
+            self.max_batch_seen = max(self.max_batch_seen, size)
+            self.batch_size_counts[size] = self.batch_size_counts.get(size, 0) + 1
+
+        for (_, fut), row in zip(batch, embeddings):
+            fut.set_result(row)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "max_batch_seen": self.max_batch_seen,
+                "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+                "pending": self._queue.qsize(),
+                "rejected": self.rejected,
+            }
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def completion_key(model: str, temperature: float, system: str, prompt: str) -> str:
+    """Content address of a chat completion request."""
+    payload = json.dumps([model, temperature, system, prompt], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Exact-match cache of LLM completions keyed by completion_key().
+
+    A bounded in-memory LRU (entry count and total characters) sits in front of
+    a SQLite file, so hits cost a dict lookup and completions survive restarts
+    and are shared by workers on the same host. Entries expire after `ttl`
+    seconds; the file is trimmed to `disk_max_entries`, oldest first.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        max_chars: Optional[int] = None,
+        disk_max_entries: Optional[int] = None,
+    ):
+        self.enabled = os.getenv("LLM_CACHE", "1").lower() not in ("0", "false", "no")
+        self.path = path if path is not None else os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3") or None
+        self.ttl = ttl if ttl is not None else float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", 4096))
+        self.max_chars = max_chars or int(os.getenv("LLM_CACHE_MAX_CHARS", 32 * 1024 * 1024))
+        self.disk_max_entries = disk_max_entries or int(os.getenv("LLM_CACHE_DISK_MAX_ENTRIES", 100000))
+
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+
+        # Counters
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """Memory, then the SQLite file (blocking: async callers use get_memory, then get_disk in a thread)."""
+        cached = self.get_memory(key)
+        return cached if cached is not None else self.get_disk(key)
+
+    def get_memory(self, key: str) -> Optional[str]:
+        """The in-memory entry only; never blocks on disk and does not count a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._evict(key)
+        return None
+
+    def get_disk(self, key: str) -> Optional[str]:
+        """The SQLite entry, promoted to memory on a hit (blocking)."""
+        now = time.time()
+        value = self._disk_get(key, now) if self.path else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value[0], value[1])
+        return value[0]
+
+    def put(self, key: str, completion: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, completion, now)
+            self.stores += 1
+        if self.path:
+            self._disk_put(key, completion, now)
+
+    def discard(self, key: str) -> None:
+        """Drop an entry, e.g. a completion that turned out to be unusable (blocking)."""
+        with self._lock:
+            if key in self._memory:
+                self._evict(key)
+        if self.path:
+            try:
+                conn = self._db()
+                with conn:
+                    conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            except sqlite3.Error as e:
+                print(f"LLM cache delete failed: {e}")
+
+    def _remember(self, key: str, completion: str, created_at: float) -> None:
+        if key in self._memory:
+            self._evict(key)
+        self._memory[key] = (completion, created_at)
+        self._chars += len(completion)
+        while self._memory and (len(self._memory) > self.max_entries or self._chars > self.max_chars):
+            self._evict(next(iter(self._memory)))
+            self.evictions += 1
+
+    def _evict(self, key: str) -> None:
+        self._chars -= len(self._memory.pop(key)[0])
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, completion TEXT, created_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS completions_created ON completions (created_at)")
+            self._local.conn = conn
+        return conn
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        try:
+            row = self._db().execute(
+                "SELECT completion, created_at FROM completions WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"LLM cache read failed: {e}")
+            return None
+        return (row[0], row[1]) if row else None
+
+    def _disk_put(self, key: str, completion: str, now: float) -> None:
+        try:
+            conn = self._db()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?)", (key, completion, now))
+                self._writes += 1
+                # Trim occasionally rather than on every write
+                if self._writes % 100 == 1:
+                    conn.execute("DELETE FROM completions WHERE created_at <= ?", (now - self.ttl,))
+                    conn.execute(
+                        "DELETE FROM completions WHERE key IN "
+                        "(SELECT key FROM completions ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                        (self.disk_max_entries,),
+                    )
+        except sqlite3.Error as e:
+            print(f"LLM cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "path": self.path,
+                "entries": len(self._memory),
+                "chars": self._chars,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
+
+
+completion_cache = CompletionCache()
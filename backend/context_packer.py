@@ -0,0 +1,186 @@
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Prompt tokens available for retrieved context, and how many candidates to retrieve before packing
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", 10))
+# Target passage size when splitting a source's text
+PASSAGE_TOKENS = int(os.getenv("PASSAGE_TOKENS", 200))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+WORD_RE = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=1)
+def _tiktoken_encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:  # not installed, or BPE file unavailable offline
+        print(f"tiktoken unavailable ({e}); estimating token counts")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count under the LLM's tokenizer, or a close estimate when tiktoken is unavailable."""
+    encoding = _tiktoken_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # ~4 characters per token for English prose, never fewer than one per word
+    return max(len(WORD_RE.findall(text)), (len(text) + 3) // 4)
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Cut text to at most `budget` tokens."""
+    if count_tokens(text) <= budget:
+        return text
+    encoding = _tiktoken_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:budget])
+    return text[:budget * 4]
+
+
+def split_passages(text: str, max_tokens: int = PASSAGE_TOKENS) -> List[str]:
+    """Split on blank lines, merging short paragraphs and hard-wrapping long ones to ~max_tokens."""
+    passages: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for paragraph in (p.strip() for p in re.split(r"\n\s*\n", text)):
+        if not paragraph:
+            continue
+        tokens = count_tokens(paragraph)
+        if tokens > max_tokens:
+            if current:
+                passages.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            passages.extend(_wrap(paragraph, max_tokens))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            passages.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        passages.append("\n\n".join(current))
+    return passages
+
+
+def _wrap(paragraph: str, max_tokens: int) -> List[str]:
+    """Break an over-long paragraph at sentence boundaries (or words, as a last resort)."""
+    pieces = re.split(r"(?<=[.!?;])\s+", paragraph)
+    if len(pieces) == 1:
+        pieces = paragraph.split(" ")
+    out, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece) + 1
+        if current and current_tokens + tokens > max_tokens:
+            out.append(" ".join(current))
+            current, current_tokens = [], 0
+        if tokens > max_tokens:
+            out.append(truncate_to_tokens(piece, max_tokens))
+            continue
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        out.append(" ".join(current))
+    return out
+
+
+def lexical_overlap(query_terms: set, text: str) -> float:
+    """Fraction of query terms that occur in the text."""
+    if not query_terms:
+        return 0.0
+    words = set(WORD_RE.findall(text.lower()))
+    return len(query_terms & words) / len(query_terms)
+
+
+@dataclass
+class PackedContext:
+    """Prompt context assembled within a token budget, with per-source token usage."""
+    text: str
+    tokens: int
+    budget: int
+    sources: List[Dict[str, Any]] = field(default_factory=list)
+    usage: List[Dict[str, Any]] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, Any]:
+        return {"tokens": self.tokens, "budget": self.budget, "sources": self.usage}
+
+
+def pack_context(
+    sources: List[Dict[str, Any]],
+    query: str,
+    header_of: Callable[[Dict[str, Any]], str],
+    text_of: Callable[[Dict[str, Any]], str] = lambda source: source.get("full_text", ""),
+    label_of: Callable[[Dict[str, Any]], str] = lambda source: source.get("heading", ""),
+    budget: Optional[int] = None,
+) -> PackedContext:
+    """
+    Greedily pack the most relevant passages of ranked `sources` into `budget` tokens.
+
+    Each source is split into passages; a passage is ranked by its source's
+    retrieval score, boosted by how many query terms it contains, so the middle
+    of a long decision can beat the opening of a weaker one. Passages are taken
+    best first while they fit (a source's header is charged with its first
+    passage), then rendered grouped by source in retrieval order and, within a
+    source, in document order. `sources` in the result are the sources that
+    contributed, each annotated with `context_tokens`.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    query_terms = set(WORD_RE.findall(query.lower()))
+
+    candidates: List[Tuple[float, int, int, str, int]] = []
+    passages_of: Dict[int, List[str]] = {}
+    for rank, source in enumerate(sources):
+        passages = split_passages(text_of(source))
+        passages_of[rank] = passages
+        score = float(source.get("score", 0.0))
+        for position, passage in enumerate(passages):
+            relevance = score * (0.5 + 0.5 * lexical_overlap(query_terms, passage))
+            # Ties go to the better-ranked source, then to earlier passages
+            candidates.append((relevance, -rank, -position, passage, count_tokens(passage)))
+    candidates.sort(reverse=True)
+
+    headers = {rank: header_of(source) for rank, source in enumerate(sources)}
+    chosen: Dict[int, List[int]] = {}
+    used = 0
+    for _, neg_rank, neg_position, _, tokens in candidates:
+        rank = -neg_rank
+        cost = tokens + (0 if rank in chosen else count_tokens(headers[rank]) + 4)
+        if used + cost > budget:
+            continue
+        chosen.setdefault(rank, []).append(-neg_position)
+        used += cost
+
+    blocks, packed_sources, usage = [], [], []
+    for rank in sorted(chosen):
+        positions = sorted(chosen[rank])
+        body = "\n\n".join(passages_of[rank][p] for p in positions)
+        block = f"{headers[rank]}\n{body}"
+        tokens = count_tokens(block)
+        blocks.append(block)
+        source = dict(sources[rank], context_tokens=tokens)
+        packed_sources.append(source)
+        usage.append({
+            "source": label_of(source),
+            "tokens": tokens,
+            "passages": len(positions),
+            "of_passages": len(passages_of[rank]),
+        })
+
+    text = "\n\n---\n\n".join(blocks)
+    return PackedContext(text=text, tokens=count_tokens(text), budget=budget, sources=packed_sources, usage=usage)
+
+
+def cpr_header(rule: Dict[str, Any]) -> str:
+    return f"### CPR {rule.get('rule_number', '')} - {rule.get('heading', '')} (Part {rule.get('part', '')}: {rule.get('part_title', '')})"
+
+
+def case_header(case: Dict[str, Any]) -> str:
+    return (
+        f"### {case.get('case_name', '')} ({case.get('citation', '')})\n"
+        f"Institution: {case.get('institution', '')} | Status: {case.get('status', '')}"
+    )
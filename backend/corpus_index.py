@@ -0,0 +1,440 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no multi-worker servers, so syncs need no lock
+    fcntl = None
+
+from index_bundle import IndexBundle, BundleMismatchError
+from index_factory import IndexConfig, build_index, set_search_params, supports_removal
+
+# Records per encode/append step during ingestion
+INGEST_CHUNK_RECORDS = int(os.getenv("INGEST_CHUNK_RECORDS", 512))
+
+
+@dataclass
+class ReindexReport:
+    """What an incremental re-index changed and how long it took."""
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: int = 0
+    resumed: int = 0
+    records_added: int = 0
+    records_removed: int = 0
+    total_records: int = 0
+    full_rebuild: bool = False
+    seconds: float = 0.0
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+    def summary(self) -> str:
+        kind = "full rebuild" if self.full_rebuild else "incremental"
+        resumed = f", {self.resumed} resumed from checkpoint" if self.resumed else ""
+        return (
+            f"{kind}: {len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed, "
+            f"{self.unchanged} unchanged files{resumed}; +{self.records_added}/-{self.records_removed} records "
+            f"({self.total_records} total) in {self.seconds:.2f}s"
+        )
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IngestCheckpoint:
+    """
+    Append-only scratch area next to a bundle that records every chunk of
+    parsed-and-embedded files as it completes, so an interrupted sync resumes
+    from the last finished chunk instead of starting over.
+
+    Layout: raw float32 rows (`embeddings.f32`), concatenated JSON records
+    (`records.bin`) with int64 end offsets (`offsets.i64`), and `state.json`,
+    which is rewritten last and is the source of truth for what is complete.
+    """
+
+    def __init__(self, path: Path, base: Dict[str, Any], dim: int):
+        self.path = path
+        self.base = base
+        self.dim = dim
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.rows = 0
+        self.bytes = 0
+        self.next_id = base["start_id"]
+        self._open()
+
+    def _open(self) -> None:
+        state_path = self.path / "state.json"
+        state = None
+        if state_path.exists():
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        if state is None or state.get("base") != self.base:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path.mkdir(parents=True)
+            for name in ("embeddings.f32", "records.bin", "offsets.i64"):
+                open(self.path / name, "wb").close()
+            self._save_state()
+            return
+
+        self.files = state["files"]
+        self.rows = state["rows"]
+        self.bytes = state["bytes"]
+        self.next_id = state["next_id"]
+        # Drop anything appended after the last committed state (crash mid-chunk)
+        for name, size in (("embeddings.f32", self.rows * self.dim * 4), ("records.bin", self.bytes), ("offsets.i64", self.rows * 8)):
+            with open(self.path / name, "r+b") as f:
+                f.truncate(size)
+
+    def _save_state(self) -> None:
+        tmp = self.path / "state.json.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "base": self.base, "files": self.files, "rows": self.rows,
+                "bytes": self.bytes, "next_id": self.next_id,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path / "state.json")
+
+    def append(self, parsed: List[Tuple[str, str, List[Dict[str, Any]]]], embeddings: np.ndarray) -> np.ndarray:
+        """Persist one chunk of (file name, sha256, records) with their embeddings; returns the new ids."""
+        first_id, first_row = self.next_id, self.rows
+        blobs = [
+            json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            for _, _, records in parsed for record in records
+        ]
+        ends = np.cumsum([len(blob) for blob in blobs], dtype=np.int64) + self.bytes
+        with open(self.path / "embeddings.f32", "ab") as f:
+            f.write(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+        with open(self.path / "records.bin", "ab") as f:
+            f.write(b"".join(blobs))
+        with open(self.path / "offsets.i64", "ab") as f:
+            f.write(ends.tobytes())
+
+        row, next_id = first_row, first_id
+        for name, sha, records in parsed:
+            self.files[name] = {"sha256": sha, "ids": [next_id, next_id + len(records)], "rows": [row, row + len(records)]}
+            row += len(records)
+            next_id += len(records)
+        self.rows, self.next_id = row, next_id
+        self.bytes = int(ends[-1]) if len(ends) else self.bytes
+        self._save_state()
+        return np.arange(first_id, next_id, dtype=np.int64)
+
+    def valid_rows(self, keep: Dict[str, str]) -> np.ndarray:
+        """Rows belonging to the latest entry of each file whose hash is still current."""
+        ranges = [
+            entry["rows"] for name, entry in self.files.items()
+            if keep.get(name) == entry["sha256"]
+        ]
+        if not ranges:
+            return np.zeros(0, dtype=np.int64)
+        return np.sort(np.concatenate([np.arange(lo, hi, dtype=np.int64) for lo, hi in ranges]))
+
+    def embeddings(self) -> np.ndarray:
+        if self.rows == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.memmap(self.path / "embeddings.f32", dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+
+    def ids_for_rows(self, rows: np.ndarray) -> np.ndarray:
+        ids = np.full(self.rows, -1, dtype=np.int64)
+        for entry in self.files.values():
+            lo, hi = entry["rows"]
+            ids[lo:hi] = np.arange(entry["ids"][0], entry["ids"][1], dtype=np.int64)
+        return ids[rows]
+
+    def raw_records(self, rows: np.ndarray) -> Iterator[bytes]:
+        if self.rows == 0:
+            return
+        ends = np.fromfile(self.path / "offsets.i64", dtype=np.int64, count=self.rows)
+        with open(self.path / "records.bin", "rb") as f:
+            for row in rows:
+                start = int(ends[row - 1]) if row > 0 else 0
+                f.seek(start)
+                yield f.read(int(ends[row]) - start)
+
+    def discard(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def _parse_with_hash(parse_file: Callable, path: Path, sha: str) -> Tuple[str, str, List[Dict[str, Any]]]:
+    return path.name, sha, parse_file(path)
+
+
+def iter_parsed(
+    paths: List[Path],
+    hashes: Dict[str, str],
+    parse_file: Callable[[Path], List[Dict[str, Any]]],
+    workers: int,
+) -> Iterator[Tuple[str, str, List[Dict[str, Any]]]]:
+    """
+    Parse files in submission order, on a process pool when workers > 1.
+
+    At most `workers * 4` files are in flight, so memory stays bounded no
+    matter how large the directory is. `parse_file` must be picklable
+    (a module-level function) when a pool is used.
+    """
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield _parse_with_hash(parse_file, path, hashes[path.name])
+        return
+
+    window = workers * 4
+    # spawn: the parent may already hold torch thread pools, which do not survive fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = []
+        remaining = iter(paths)
+        for path in remaining:
+            pending.append(pool.submit(_parse_with_hash, parse_file, path, hashes[path.name]))
+            if len(pending) >= window:
+                break
+        while pending:
+            result = pending.pop(0).result()
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append(pool.submit(_parse_with_hash, parse_file, next_path, hashes[next_path.name]))
+            yield result
+
+
+def sync_bundle(
+    bundle_dir: Path,
+    files: List[Path],
+    parse_file: Callable[[Path], List[Dict[str, Any]]],
+    text_of: Callable[[Dict[str, Any]], str],
+    encoder,
+    model_name: str,
+    corpus_hash: str,
+    index_config: IndexConfig,
+    full: bool = False,
+    workers: int = 1,
+    progress: Callable[[str, int, int], None] = lambda stage, done=0, total=0: None,
+) -> Tuple[IndexBundle, ReindexReport]:
+    """
+    Bring the index bundle at `bundle_dir` in line with `files`.
+
+    Files are compared by content hash against the bundle manifest; only added
+    and changed files are parsed and embedded, and records from changed or
+    removed files are dropped from the ID-mapped FAISS index in place. Parsed
+    files stream through the encoder in chunks of INGEST_CHUNK_RECORDS, each
+    chunk is appended to the index and checkpointed as it completes, and an
+    interrupted sync resumes from its checkpoint. Falls back to a full rebuild
+    when there is no usable bundle (or `full` is set).
+
+    The FAISS index is rebuilt from the stored embeddings, without re-embedding,
+    when it was built with a different `index_config`, when it cannot delete
+    stale vectors (HNSW), or when it needs training (IVF/PQ on a fresh build).
+
+    Syncs are serialised across processes (e.g. gunicorn workers starting
+    together) by an exclusive lock on `<bundle>.lock`; a process that waited
+    on the lock reuses the bundle the holder wrote when it is now current.
+    """
+    with bundle_lock(bundle_dir):
+        if not full:
+            current = load_if_current(bundle_dir, files, model_name, corpus_hash, index_config)
+            if current is not None:
+                return current
+        return _sync_bundle_locked(
+            bundle_dir, files, parse_file, text_of, encoder, model_name, corpus_hash, index_config,
+            full=full, workers=workers, progress=progress,
+        )
+
+
+@contextmanager
+def bundle_lock(bundle_dir: Path) -> Iterator[None]:
+    """Hold an exclusive inter-process lock on the bundle (and its .tmp/.partial siblings)."""
+    if fcntl is None:
+        yield
+        return
+    lock_path = bundle_dir.with_name(bundle_dir.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_if_current(
+    bundle_dir: Path, files: List[Path], model_name: str, corpus_hash: str, index_config: IndexConfig
+) -> Optional[Tuple[IndexBundle, ReindexReport]]:
+    """The bundle, if it already matches the corpus and index config (another process synced it)."""
+    try:
+        bundle = IndexBundle.load(bundle_dir, model_name=model_name, corpus_hash=corpus_hash)
+    except BundleMismatchError:
+        return None
+    if bundle.header.get("index_spec") != index_config.spec:
+        return None
+    set_search_params(bundle.index, index_config)
+    return bundle, ReindexReport(unchanged=len(files), total_records=len(bundle.ids))
+
+
+def _sync_bundle_locked(
+    bundle_dir: Path,
+    files: List[Path],
+    parse_file: Callable[[Path], List[Dict[str, Any]]],
+    text_of: Callable[[Dict[str, Any]], str],
+    encoder,
+    model_name: str,
+    corpus_hash: str,
+    index_config: IndexConfig,
+    full: bool,
+    workers: int,
+    progress: Callable[[str, int, int], None],
+) -> Tuple[IndexBundle, ReindexReport]:
+    started = time.perf_counter()
+    report = ReindexReport()
+    dim = encoder.model.get_sentence_embedding_dimension()
+
+    old: Optional[IndexBundle] = None
+    if not full:
+        try:
+            old = IndexBundle.load(bundle_dir, model_name=model_name, writable=True)
+        except BundleMismatchError as e:
+            print(f"No reusable bundle at {bundle_dir} ({e}); rebuilding from scratch")
+    report.full_rebuild = old is None
+    old_files: Dict[str, Dict[str, Any]] = old.manifest.get("files", {}) if old else {}
+
+    # Diff the corpus against the manifest by content hash
+    current: Dict[str, str] = {}
+    for i, path in enumerate(files, 1):
+        progress("hashing files", i, len(files))
+        current[path.name] = file_sha256(path)
+    to_parse = []
+    for path in files:
+        entry = old_files.get(path.name)
+        if entry is None:
+            report.added.append(path.name)
+            to_parse.append(path)
+        elif entry["sha256"] != current[path.name]:
+            report.changed.append(path.name)
+            to_parse.append(path)
+        else:
+            report.unchanged += 1
+    report.removed = sorted(name for name in old_files if name not in current)
+
+    # Ids of records whose source file changed or disappeared
+    stale_ranges = [old_files[name]["ids"] for name in report.changed + report.removed]
+    stale_ids = (
+        np.concatenate([np.arange(lo, hi, dtype=np.int64) for lo, hi in stale_ranges])
+        if stale_ranges else np.zeros(0, dtype=np.int64)
+    )
+
+    # Update the old index in place when possible, otherwise build a fresh one at the end
+    index = None
+    if old is not None:
+        if old.header.get("index_spec") == index_config.spec and (not len(stale_ids) or supports_removal(old.index)):
+            index = old.index
+            if len(stale_ids):
+                index.remove_ids(stale_ids)
+        keep_rows = np.flatnonzero(~np.isin(old.ids, stale_ids))
+        report.records_removed = len(old.ids) - len(keep_rows)
+    else:
+        keep_rows = np.zeros(0, dtype=np.int64)
+
+    # Resume from a checkpoint left by an interrupted sync against the same base bundle
+    checkpoint = IngestCheckpoint(
+        bundle_dir.with_name(bundle_dir.name + ".partial"),
+        base={
+            "model_name": model_name,
+            "dim": dim,
+            "bundle_created_at": old.header.get("created_at") if old else None,
+            "start_id": int(old.header.get("next_id", 0)) if old else 0,
+        },
+        dim=dim,
+    )
+    to_parse_hashes = {path.name: current[path.name] for path in to_parse}
+    resumed_rows = checkpoint.valid_rows(to_parse_hashes)
+    if len(resumed_rows) and index is not None:
+        index.add_with_ids(np.asarray(checkpoint.embeddings()[resumed_rows]), checkpoint.ids_for_rows(resumed_rows))
+    done = {name for name, entry in checkpoint.files.items() if to_parse_hashes.get(name) == entry["sha256"]}
+    report.resumed = len(done)
+    pending = [path for path in to_parse if path.name not in done]
+
+    # Stream: parse (in parallel) -> encode in bounded chunks -> append to index + checkpoint
+    def flush(chunk: List[Tuple[str, str, List[Dict[str, Any]]]]) -> None:
+        texts = [text_of(record) for _, _, records in chunk for record in records]
+        embeddings = encoder.encode_batch(texts) if texts else np.zeros((0, dim), dtype=np.float32)
+        new_ids = checkpoint.append(chunk, embeddings)
+        if len(new_ids) and index is not None:
+            index.add_with_ids(embeddings, new_ids)
+
+    chunk: List[Tuple[str, str, List[Dict[str, Any]]]] = []
+    chunk_size = 0
+    for i, parsed in enumerate(iter_parsed(pending, current, parse_file, workers), 1):
+        progress("ingesting files", len(done) + i, len(to_parse))
+        chunk.append(parsed)
+        chunk_size += len(parsed[2])
+        if chunk_size >= INGEST_CHUNK_RECORDS:
+            flush(chunk)
+            chunk, chunk_size = [], 0
+    if chunk:
+        flush(chunk)
+
+    # Assemble the new bundle: surviving old rows followed by checkpointed rows
+    new_rows = checkpoint.valid_rows(to_parse_hashes)
+    manifest_files = {
+        name: old_files[name] for name in current
+        if name in old_files and old_files[name]["sha256"] == current[name]
+    }
+    for name in to_parse_hashes:
+        entry = checkpoint.files[name]
+        manifest_files[name] = {"sha256": entry["sha256"], "ids": entry["ids"]}
+
+    def records() -> Iterator[Any]:
+        if old is not None:
+            for row in keep_rows:
+                yield old.records.raw(row)
+        yield from checkpoint.raw_records(new_rows)
+
+    old_part = take_rows(old.embeddings, keep_rows) if old is not None else np.zeros((0, dim), dtype=np.float32)
+    new_part = take_rows(checkpoint.embeddings(), new_rows) if len(new_rows) else np.zeros((0, dim), dtype=np.float32)
+    ids = np.concatenate([
+        np.asarray(old.ids)[keep_rows] if old is not None else np.zeros(0, dtype=np.int64),
+        checkpoint.ids_for_rows(new_rows),
+    ])
+    report.records_added = len(new_rows)
+    report.total_records = len(ids)
+
+    if index is None:
+        progress("building index")
+        index = build_index(index_config, [old_part, new_part], ids)
+
+    progress("writing bundle")
+    IndexBundle.write(
+        bundle_dir, [old_part, new_part], ids, records(), index, model_name, corpus_hash,
+        manifest={"files": manifest_files},
+        extra={"next_id": checkpoint.next_id, "index_spec": index_config.spec},
+    )
+    checkpoint.discard()
+    report.seconds = time.perf_counter() - started
+    bundle = IndexBundle.load(bundle_dir, model_name=model_name)
+    set_search_params(bundle.index, index_config)
+    return bundle, report
+
+
+def take_rows(matrix: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Select rows, keeping a zero-copy (memory-mapped) view when they are one contiguous run."""
+    if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+        return matrix[int(rows[0]):int(rows[-1]) + 1]
+    return matrix[rows]
+
@@ -0,0 +1,16 @@
+# Gunicorn configuration for multi-worker deployments:
+#   cd backend && gunicorn -c gunicorn.conf.py main:app
+#
+# The embedding model is loaded once in the master and inherited by forked
+# workers, so its weights are shared copy-on-write instead of loaded per worker.
+import os
+
+bind = f"{os.getenv('BACKEND_HOST', '0.0.0.0')}:{os.getenv('BACKEND_PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+
+def on_starting(server):
+    import model_registry
+    model_registry.preload()
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import faiss
+import numpy as np
+
+# Bump whenever the on-disk layout or the meaning of stored vectors changes;
+# bundles with a different version are rebuilt instead of loaded.
+BUNDLE_VERSION = 6
+
+HEADER_FILE = "header.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_FILE = "index.faiss"
+IDS_FILE = "ids.npy"
+MANIFEST_FILE = "manifest.json"
+RECORDS_FILE = "records.bin"
+OFFSETS_FILE = "records.offsets.npy"
+
+
+class BundleMismatchError(Exception):
+    """Raised when a bundle is missing, from another version, or built for a different model/corpus."""
+
+
+def corpus_fingerprint(files: Iterable[Path]) -> str:
+    """Cheap corpus hash from file names, sizes and modification times."""
+    digest = hashlib.sha256()
+    for path in sorted(Path(p) for p in files):
+        stat = path.stat()
+        digest.update(f"{path.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class StringTable:
+    """
+    Read-only table of JSON records stored back to back in one file, addressed
+    through an int64 offsets array. Both files are memory-mapped, so opening is
+    O(1) and records are decoded only when accessed.
+    """
+
+    def __init__(self, data_path: Path, offsets_path: Path):
+        self._offsets = np.load(offsets_path, mmap_mode="r")
+        self._file = open(data_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._data: Union[mmap.mmap, bytes] = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        )
+
+    def __len__(self) -> int:
+        return max(len(self._offsets) - 1, 0)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("record index out of range")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return json.loads(self._data[start:end])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def raw(self, i: int) -> bytes:
+        """Encoded bytes of record i, for copying records between tables without decoding."""
+        return bytes(self._data[int(self._offsets[i]):int(self._offsets[i + 1])])
+
+    @staticmethod
+    def write(data_path: Path, offsets_path: Path, records: Iterable[Union[Dict[str, Any], bytes]]) -> int:
+        offsets = [0]
+        with open(data_path, "wb") as f:
+            for record in records:
+                if isinstance(record, bytes):
+                    blob = record
+                else:
+                    blob = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                f.write(blob)
+                offsets.append(offsets[-1] + len(blob))
+        np.save(offsets_path, np.asarray(offsets, dtype=np.int64))
+        return len(offsets) - 1
+
+
+class IndexBundle:
+    """
+    Versioned on-disk index: float32 embeddings (.npy, opened with mmap_mode),
+    the ID-mapped FAISS index, the vector id of each row, and record metadata as
+    a StringTable. A JSON header records the model name, dimension and corpus
+    hash the bundle was built from; the manifest maps each source file to its
+    content hash and the id range of the records it produced.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        header: Dict[str, Any],
+        embeddings: np.ndarray,
+        ids: np.ndarray,
+        records: StringTable,
+        index,
+        manifest: Dict[str, Any],
+    ):
+        self.path = path
+        self.header = header
+        self.embeddings = embeddings
+        self.ids = ids
+        self.records = records
+        self.index = index
+        self.manifest = manifest
+
+    @classmethod
+    def load(
+        cls,
+        path: Union[str, Path],
+        model_name: Optional[str] = None,
+        corpus_hash: Optional[str] = None,
+        writable: bool = False,
+        index_spec: Optional[str] = None,
+    ) -> "IndexBundle":
+        path = Path(path)
+        header_path = path / HEADER_FILE
+        if not header_path.exists():
+            raise BundleMismatchError(f"No index bundle at {path}")
+
+        with open(header_path, "r", encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("version") != BUNDLE_VERSION:
+            raise BundleMismatchError(f"Bundle version {header.get('version')} != {BUNDLE_VERSION}")
+        if model_name is not None and header.get("model_name") != model_name:
+            raise BundleMismatchError(f"Bundle built with {header.get('model_name')}, expected {model_name}")
+        if corpus_hash is not None and header.get("corpus_hash") != corpus_hash:
+            raise BundleMismatchError("Corpus has changed since the bundle was built")
+        if index_spec is not None and header.get("index_spec") != index_spec:
+            raise BundleMismatchError(f"Index built as {header.get('index_spec')}, configured {index_spec}")
+
+        embeddings = np.load(path / EMBEDDINGS_FILE, mmap_mode="r")
+        if embeddings.dtype != np.float32 or embeddings.ndim != 2:
+            raise BundleMismatchError("Bundle embeddings are not a 2-D float32 array")
+        if embeddings.shape != (header["count"], header["dim"]):
+            raise BundleMismatchError(
+                f"Embeddings shape {embeddings.shape} does not match header ({header['count']}, {header['dim']})"
+            )
+
+        ids = np.load(path / IDS_FILE, mmap_mode="r")
+        records = StringTable(path / RECORDS_FILE, path / OFFSETS_FILE)
+        if len(records) != header["count"] or len(ids) != header["count"]:
+            raise BundleMismatchError("Record count does not match header")
+
+        with open(path / MANIFEST_FILE, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        # Writable loads (incremental updates) need an in-memory index
+        index = faiss.read_index(str(path / INDEX_FILE)) if writable else read_index(path / INDEX_FILE)
+        return cls(path, header, embeddings, ids, records, index, manifest)
+
+    @staticmethod
+    def write(
+        path: Union[str, Path],
+        embeddings: Union[np.ndarray, Sequence[np.ndarray]],
+        ids: np.ndarray,
+        records: Iterable[Union[Dict[str, Any], bytes]],
+        index,
+        model_name: str,
+        corpus_hash: str,
+        manifest: Dict[str, Any],
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Write a bundle atomically: build it in a sibling temp dir, then swap it into place.
+
+        `embeddings` may be a list of row blocks (e.g. memory-mapped slices) and
+        `records` any iterable, so large bundles are streamed to disk rather than
+        concatenated in memory first.
+        """
+        path = Path(path)
+        parts = list(embeddings) if isinstance(embeddings, (list, tuple)) else [embeddings]
+        count = sum(len(part) for part in parts)
+        dim = int(parts[0].shape[1]) if parts else 0
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+
+        write_embeddings(tmp_path / EMBEDDINGS_FILE, parts, count, dim)
+        np.save(tmp_path / IDS_FILE, np.asarray(ids, dtype=np.int64))
+        with open(tmp_path / MANIFEST_FILE, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        written = StringTable.write(tmp_path / RECORDS_FILE, tmp_path / OFFSETS_FILE, records)
+        if written != count:
+            raise ValueError(f"Bundle has {written} records but {count} embeddings")
+        faiss.write_index(index, str(tmp_path / INDEX_FILE))
+
+        header = {
+            "version": BUNDLE_VERSION,
+            "model_name": model_name,
+            "dim": dim,
+            "count": count,
+            "dtype": "float32",
+            "corpus_hash": corpus_hash,
+            "created_at": time.time(),
+        }
+        if extra:
+            header.update(extra)
+        with open(tmp_path / HEADER_FILE, "w", encoding="utf-8") as f:
+            json.dump(header, f, indent=2)
+
+        old_path = path.with_name(path.name + ".old")
+        shutil.rmtree(old_path, ignore_errors=True)
+        if path.exists():
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def write_embeddings(path: Path, parts: Sequence[np.ndarray], count: int, dim: int) -> None:
+    """Stream row blocks into a single float32 .npy without materialising the full matrix."""
+    if count == 0:
+        np.save(path, np.zeros((0, dim), dtype=np.float32))
+        return
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(count, dim))
+    row = 0
+    for part in parts:
+        out[row:row + len(part)] = part
+        row += len(part)
+    out.flush()
+    del out
+
+
+def rows_for_ids(ids: np.ndarray, hit_ids: np.ndarray) -> np.ndarray:
+    """Map FAISS result ids to row positions (ids are stored ascending); -1 where absent."""
+    hit_ids = np.asarray(hit_ids, dtype=np.int64)
+    if len(ids) == 0:
+        return np.full(hit_ids.shape, -1, dtype=np.int64)
+    pos = np.searchsorted(ids, hit_ids)
+    clipped = np.minimum(pos, len(ids) - 1)
+    found = (hit_ids >= 0) & (pos < len(ids)) & (ids[clipped] == hit_ids)
+    return np.where(found, clipped, -1)
+
+
+def read_index(path: Path):
+    """Read a FAISS index, memory-mapping it where the index type supports it."""
+    try:
+        return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except Exception:
+        return faiss.read_index(str(path))
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+FAISS index construction for the RAG systems, plus a recall/latency benchmark.
+
+Supported index types: flat (exact), ivf_flat, hnsw and ivf_pq. Every index is
+wrapped in IDMap2 so incremental re-indexing can address vectors by stable id.
+Configure per corpus with environment variables, e.g. for the cases corpus:
+
+    CASES_INDEX_TYPE=hnsw CASES_INDEX_EF_SEARCH=128
+    CASES_INDEX_TYPE=ivf_flat CASES_INDEX_NLIST=1024 CASES_INDEX_NPROBE=16
+
+Benchmark recall@k and latency of each type against the flat index, on the
+embeddings stored in an index bundle:
+
+    python index_factory.py --bundle cases_index --k 10
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+
+# Below these sizes IVF/PQ training is unreliable, so we fall back to flat
+MIN_POINTS_PER_CENTROID = 39
+MIN_PQ_TRAINING_POINTS = 256 * MIN_POINTS_PER_CENTROID
+# Training is sampled above this many vectors
+MAX_TRAINING_POINTS = 100_000
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+@dataclass
+class IndexConfig:
+    """Index type and build/search parameters; None means choose automatically."""
+    kind: str = "flat"
+    metric: str = "ip"  # "ip" (inner product) or "l2"
+    nlist: Optional[int] = None
+    pq_m: Optional[int] = None
+    hnsw_m: int = 32
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+    def __post_init__(self):
+        if self.kind not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {self.kind!r}; expected one of {INDEX_TYPES}")
+
+    @classmethod
+    def from_env(cls, prefix: str, metric: str = "ip") -> "IndexConfig":
+        """Read {prefix}_INDEX_TYPE, _NLIST, _PQ_M, _HNSW_M, _NPROBE and _EF_SEARCH."""
+        return cls(
+            kind=os.getenv(f"{prefix}_INDEX_TYPE", "flat"),
+            metric=metric,
+            nlist=_env_int(f"{prefix}_INDEX_NLIST"),
+            pq_m=_env_int(f"{prefix}_INDEX_PQ_M"),
+            hnsw_m=_env_int(f"{prefix}_INDEX_HNSW_M") or 32,
+            nprobe=_env_int(f"{prefix}_INDEX_NPROBE"),
+            ef_search=_env_int(f"{prefix}_INDEX_EF_SEARCH"),
+        )
+
+    @property
+    def spec(self) -> str:
+        """Identity of the built structure (query-time knobs excluded); a change forces an index rebuild."""
+        return f"{self.kind}:{self.metric}:nlist={self.nlist or 'auto'}:pq_m={self.pq_m or 'auto'}:hnsw_m={self.hnsw_m}"
+
+    @property
+    def faiss_metric(self) -> int:
+        return faiss.METRIC_INNER_PRODUCT if self.metric == "ip" else faiss.METRIC_L2
+
+
+def factory_string(config: IndexConfig, dim: int, n_vectors: int) -> str:
+    """FAISS index_factory description for this config and corpus size."""
+    kind = config.kind
+    nlist = config.nlist or max(1, min(int(4 * math.sqrt(max(n_vectors, 1))), n_vectors // MIN_POINTS_PER_CENTROID))
+
+    if kind in ("ivf_flat", "ivf_pq") and n_vectors < nlist * MIN_POINTS_PER_CENTROID:
+        print(f"Only {n_vectors} vectors; too few to train {kind} with nlist={nlist}, using flat")
+        kind = "flat"
+    if kind == "ivf_pq" and n_vectors < MIN_PQ_TRAINING_POINTS:
+        print(f"Only {n_vectors} vectors; too few to train PQ codebooks, using ivf_flat")
+        kind = "ivf_flat"
+
+    if kind == "flat":
+        return "IDMap2,Flat"
+    if kind == "hnsw":
+        return f"IDMap2,HNSW{config.hnsw_m}"
+    if kind == "ivf_flat":
+        return f"IDMap2,IVF{nlist},Flat"
+    pq_m = config.pq_m or next(m for m in (dim // 8, dim // 4, dim // 2, dim) if m and dim % m == 0)
+    return f"IDMap2,IVF{nlist},PQ{pq_m}"
+
+
+def build_index(
+    config: IndexConfig,
+    embeddings: Union[np.ndarray, Sequence[np.ndarray]],
+    ids: np.ndarray,
+    block_size: int = 65536,
+):
+    """
+    Create, train (if needed) and fill an ID-mapped index.
+
+    `embeddings` may be a list of row blocks (e.g. memory-mapped slices of a
+    bundle); vectors are added block by block and only the training sample is
+    ever copied into one array.
+    """
+    parts = list(embeddings) if isinstance(embeddings, (list, tuple)) else [embeddings]
+    n_vectors = sum(len(part) for part in parts)
+    dim = int(parts[0].shape[1])
+    ids = np.asarray(ids, dtype=np.int64)
+    index = faiss.index_factory(dim, factory_string(config, dim, n_vectors), config.faiss_metric)
+
+    if not index.is_trained:
+        rows = np.arange(n_vectors)
+        if n_vectors > MAX_TRAINING_POINTS:
+            rows = np.sort(np.random.default_rng(0).choice(n_vectors, MAX_TRAINING_POINTS, replace=False))
+        bounds = np.cumsum([0] + [len(part) for part in parts])
+        sample = np.concatenate([
+            np.asarray(part[rows[(rows >= lo) & (rows < hi)] - lo], dtype=np.float32)
+            for part, lo, hi in zip(parts, bounds[:-1], bounds[1:])
+        ])
+        index.train(sample)
+
+    offset = 0
+    for part in parts:
+        for start in range(0, len(part), block_size):
+            block = np.ascontiguousarray(part[start:start + block_size], dtype=np.float32)
+            index.add_with_ids(block, ids[offset + start:offset + start + len(block)])
+        offset += len(part)
+    set_search_params(index, config)
+    return index
+
+
+def set_search_params(index, config: IndexConfig) -> None:
+    """Apply query-time knobs (nprobe for IVF, efSearch for HNSW) where the index supports them."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and config.nprobe:
+        ivf.nprobe = min(config.nprobe, ivf.nlist)
+    inner = _inner_index(index)
+    if hasattr(inner, "hnsw") and config.ef_search:
+        inner.hnsw.efSearch = config.ef_search
+
+
+def supports_removal(index) -> bool:
+    """HNSW graphs cannot delete vectors; everything else we build can."""
+    return not hasattr(_inner_index(index), "hnsw")
+
+
+def _inner_index(index):
+    """The index wrapped by IDMap2, with its concrete SWIG type (read_index returns a bare Index)."""
+    index = faiss.downcast_index(index)
+    return faiss.downcast_index(index.index) if hasattr(index, "index") else index
+
+
+def benchmark(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    metric: str = "ip",
+    nprobes=(1, 2, 4, 8, 16, 32, 64),
+    ef_searches=(16, 32, 64, 128, 256),
+) -> List[Dict[str, Any]]:
+    """
+    recall@k and per-query latency of each index type against exact (flat) search.
+
+    Returns one row per (index type, query-time setting) so the operating point
+    can be picked from data.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    ids = np.arange(len(embeddings), dtype=np.int64)
+    k = min(k, len(embeddings))
+
+    def timed_search(index):
+        started = time.perf_counter()
+        _, found = index.search(queries, k)
+        return found, (time.perf_counter() - started) * 1000.0 / len(queries)
+
+    results = []
+    exact = build_index(IndexConfig("flat", metric), embeddings, ids)
+    truth, flat_ms = timed_search(exact)
+    results.append({"index": "flat", "param": None, "recall": 1.0, "ms_per_query": flat_ms, "build_s": 0.0})
+
+    for kind, knob, values in (("ivf_flat", "nprobe", nprobes), ("hnsw", "ef_search", ef_searches), ("ivf_pq", "nprobe", nprobes)):
+        config = IndexConfig(kind, metric)
+        started = time.perf_counter()
+        index = build_index(config, embeddings, ids)
+        build_s = time.perf_counter() - started
+        for value in values:
+            setattr(config, knob, value)
+            set_search_params(index, config)
+            found, ms = timed_search(index)
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            results.append({"index": kind, "param": f"{knob}={value}", "recall": float(recall), "ms_per_query": ms, "build_s": build_s})
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ANN index types against exact search")
+    parser.add_argument("--bundle", required=True, help="index bundle directory, e.g. cases_index")
+    parser.add_argument("--queries", type=int, default=200, help="number of sampled query vectors")
+    parser.add_argument("--noise", type=float, default=0.05, help="gaussian noise added to sampled queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--metric", choices=["ip", "l2"], default="ip")
+    args = parser.parse_args(argv)
+
+    from index_bundle import IndexBundle
+    embeddings = np.asarray(IndexBundle.load(args.bundle).embeddings)
+    if len(embeddings) == 0:
+        print("Bundle is empty")
+        return 1
+
+    # Queries: perturbed corpus vectors, so neighbours exist but are not trivially the source row
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(embeddings), min(args.queries, len(embeddings)), replace=False)
+    queries = embeddings[rows] + rng.normal(0, args.noise, (len(rows), embeddings.shape[1])).astype(np.float32)
+
+    print(f"{len(embeddings)} vectors, {len(queries)} queries, recall@{args.k}")
+    print(f"{'index':10} {'param':16} {'recall':>8} {'ms/query':>10} {'build s':>9}")
+    for row in benchmark(embeddings, queries, k=args.k, metric=args.metric):
+        print(f"{row['index']:10} {row['param'] or '-':16} {row['recall']:8.3f} {row['ms_per_query']:10.3f} {row['build_s']:9.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+class IndexNotReadyError(Exception):
+    """Raised when a request needs an index that is still loading (or failed to load)."""
+
+
+ProgressCallback = Callable[[str, int, int], None]
+
+
+class IndexHandle:
+    """
+    Loads a RAG system in a background thread and tracks its readiness.
+
+    `factory` receives a progress callback `(stage, done, total)` and returns the
+    constructed system. Requests await `wait()`, which returns the system once it
+    is ready or raises IndexNotReadyError after the timeout.
+    """
+
+    def __init__(self, name: str, factory: Callable[[ProgressCallback], Any]):
+        self.name = name
+        self.factory = factory
+        self.system: Any = None
+        self.status = "pending"  # pending | loading | ready | failed
+        self.error: Optional[str] = None
+        self.stage: Optional[str] = None
+        self.done = 0
+        self.total = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def report(self, stage: str, done: int = 0, total: int = 0) -> None:
+        """Progress callback handed to the RAG system; called from the loader thread."""
+        self.stage = stage
+        self.done = done
+        self.total = total
+
+    def start(self) -> asyncio.Task:
+        """Start loading in the background if it has not started yet."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.load())
+        return self._task
+
+    async def load(self) -> None:
+        self.status = "loading"
+        self.started_at = time.time()
+        try:
+            self.system = await asyncio.to_thread(self.factory, self.report)
+            self.status = "ready"
+            self.stage = "ready"
+        except Exception as e:
+            print(f"Error loading {self.name} index: {e}")
+            self.status = "failed"
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+            self._ready.set()
+
+    async def wait(self, timeout: float) -> Any:
+        """Return the loaded system, waiting up to `timeout` seconds for it to become ready."""
+        if self.status == "ready":
+            return self.system
+        if self.status == "pending":
+            self.start()
+        if self.status != "failed" and timeout > 0:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._ready.wait()), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self.status == "ready":
+            return self.system
+        if self.status == "failed":
+            raise IndexNotReadyError(f"The {self.name} index failed to load: {self.error}")
+        raise IndexNotReadyError(f"The {self.name} index is still loading ({self.describe_progress()})")
+
+    def describe_progress(self) -> str:
+        if self.total:
+            return f"{self.stage}: {self.done}/{self.total}"
+        return self.stage or self.status
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.time()) - self.started_at, 2)
+        return {
+            "status": self.status,
+            "ready": self.status == "ready",
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "progress": round(self.done / self.total, 3) if self.total else None,
+            "elapsed_seconds": elapsed,
+            "error": self.error,
+        }
@@ -0,0 +1,186 @@
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Hybrid retrieval: BM25 runs alongside dense search and the two rankings are
+# merged with reciprocal-rank fusion
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1").lower() not in ("0", "false", "no")
+RRF_K = int(os.getenv("RRF_K", 60))
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+# Each ranking contributes up to HYBRID_DEPTH * k candidates to the fusion
+HYBRID_DEPTH = int(os.getenv("HYBRID_DEPTH", 3))
+
+# Keeps rule numbers such as "7.5" or "3.1a" and citations like "arb/05/12" as single terms
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[./][a-z0-9]+)*")
+MAX_TERM_LENGTH = 32
+
+STAMP_FILE = "bm25.json"
+ARRAYS = ("terms", "indptr", "doc_rows", "tf", "doc_len")
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if len(t) <= MAX_TERM_LENGTH]
+
+
+class BM25Index:
+    """
+    BM25 over a bundle's records with array-backed postings.
+
+    The vocabulary is a sorted string array (terms are found with searchsorted)
+    and postings are CSR-style: `indptr[t]:indptr[t + 1]` slices `doc_rows` and
+    `tf` for term t. Everything is a NumPy array saved next to the bundle and
+    memory-mapped on load, and a query is scored with a handful of vectorized
+    operations over the postings of its terms.
+    """
+
+    def __init__(self, terms: np.ndarray, indptr: np.ndarray, doc_rows: np.ndarray, tf: np.ndarray, doc_len: np.ndarray):
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_rows = doc_rows
+        self.tf = tf
+        self.doc_len = doc_len
+        self.n_docs = len(doc_len)
+        self.avg_len = float(doc_len.mean()) if self.n_docs else 0.0
+        df = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "BM25Index":
+        term_ids: Dict[str, int] = {}
+        rows: List[int] = []
+        tids: List[int] = []
+        counts: List[int] = []
+        doc_len: List[int] = []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len.append(len(tokens))
+            tf: Dict[int, int] = {}
+            for token in tokens:
+                tid = term_ids.setdefault(token, len(term_ids))
+                tf[tid] = tf.get(tid, 0) + 1
+            rows.extend([row] * len(tf))
+            tids.extend(tf.keys())
+            counts.extend(tf.values())
+
+        # Renumber terms in sorted order so the vocabulary can be binary-searched
+        vocab = np.array(sorted(term_ids), dtype=f"<U{MAX_TERM_LENGTH}")
+        remap = np.empty(len(term_ids), dtype=np.int64)
+        remap[[term_ids[t] for t in vocab.tolist()]] = np.arange(len(vocab))
+        tids_arr = remap[np.asarray(tids, dtype=np.int64)] if tids else np.zeros(0, dtype=np.int64)
+        order = np.lexsort((np.asarray(rows, dtype=np.int64), tids_arr))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tids_arr, minlength=len(vocab)), out=indptr[1:])
+        return cls(
+            vocab,
+            indptr,
+            np.asarray(rows, dtype=np.int32)[order],
+            np.asarray(counts, dtype=np.float32)[order],
+            np.asarray(doc_len, dtype=np.float32),
+        )
+
+    def save(self, path: Path, stamp: Dict) -> None:
+        """Write the arrays, then the stamp file last so a partial write is never mistaken for a complete one."""
+        for name in ARRAYS:
+            tmp = path / f"bm25.{name}.tmp.npy"
+            np.save(tmp, getattr(self, name))
+            os.replace(tmp, path / f"bm25.{name}.npy")
+        tmp = path / (STAMP_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(stamp, f)
+        os.replace(tmp, path / STAMP_FILE)
+
+    @classmethod
+    def load(cls, path: Path, stamp: Dict) -> Optional["BM25Index"]:
+        try:
+            with open(path / STAMP_FILE, "r", encoding="utf-8") as f:
+                if json.load(f) != stamp:
+                    return None
+            return cls(*(np.load(path / f"bm25.{name}.npy", mmap_mode="r") for name in ARRAYS))
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load_or_build(cls, path: Path, stamp: Dict, texts: Callable[[], Iterable[str]]) -> "BM25Index":
+        """Open the lexical index saved with a bundle, (re)building it if missing or from another build."""
+        index = cls.load(path, stamp)
+        if index is not None:
+            return index
+        started = time.perf_counter()
+        index = cls.build(texts())
+        try:
+            index.save(path, stamp)
+        except OSError as e:
+            print(f"Could not save BM25 index to {path}: {e}")
+        print(f"Built BM25 index over {index.n_docs} records, {len(index.terms)} terms in {time.perf_counter() - started:.2f}s")
+        return index
+
+    def term_ids(self, query: str) -> np.ndarray:
+        terms = np.unique(np.asarray(tokenize(query), dtype=f"<U{MAX_TERM_LENGTH}"))
+        if not len(terms) or not len(self.terms):
+            return np.zeros(0, dtype=np.int64)
+        pos = np.searchsorted(self.terms, terms)
+        pos = np.minimum(pos, len(self.terms) - 1)
+        return pos[self.terms[pos] == terms]
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (rows, BM25 scores), best first."""
+        tids = self.term_ids(query)
+        if not len(tids) or not self.n_docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        slices = [slice(int(self.indptr[t]), int(self.indptr[t + 1])) for t in tids]
+        rows = np.concatenate([self.doc_rows[s] for s in slices]).astype(np.int64)
+        tf = np.concatenate([self.tf[s] for s in slices])
+        idf = np.repeat(self.idf[tids], [s.stop - s.start for s in slices])
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_len[rows] / max(self.avg_len, 1e-9))
+        contrib = idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+
+        hit_rows, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=contrib).astype(np.float32)
+        top = np.argsort(-scores, kind="stable")[:k]
+        return hit_rows[top], scores[top]
+
+
+def reciprocal_rank_fusion(rankings: List[np.ndarray], k: int = RRF_K) -> Tuple[np.ndarray, np.ndarray]:
+    """Fuse ranked row lists: score(row) = sum over lists of 1 / (k + rank). Returns (rows, scores), best first."""
+    rankings = [np.asarray(r, dtype=np.int64) for r in rankings if len(r)]
+    if not rankings:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    rows = np.concatenate(rankings)
+    contrib = np.concatenate([1.0 / (k + np.arange(1, len(r) + 1)) for r in rankings])
+    fused_rows, inverse = np.unique(rows, return_inverse=True)
+    scores = np.bincount(inverse, weights=contrib)
+    order = np.argsort(-scores, kind="stable")
+    return fused_rows[order], scores[order]
+
+
+def hybrid_rank(
+    dense_rows: np.ndarray,
+    dense_scores: np.ndarray,
+    lexical: Optional[BM25Index],
+    query: str,
+    limit: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuse a dense ranking (rows, best first) with BM25 results for the same query.
+
+    Returns up to `limit` (rows, ranking scores); without a lexical index the
+    dense ranking is passed through unchanged.
+    """
+    valid = dense_rows >= 0
+    dense_rows, dense_scores = dense_rows[valid], dense_scores[valid]
+    if lexical is None:
+        return dense_rows[:limit], dense_scores[:limit]
+    lexical_rows, _ = lexical.search(query, len(dense_rows) or limit)
+    rows, scores = reciprocal_rank_fusion([dense_rows, lexical_rows])
+    return rows[:limit], scores[:limit]
+
+
+def bundle_stamp(bundle) -> Dict:
+    """Identifies the bundle build a saved lexical index belongs to."""
+    return {"bundle_created_at": bundle.header.get("created_at"), "count": bundle.header.get("count")}
@@ -0,0 +1,367 @@
+import asyncio
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from context_packer import count_tokens
+from llm_providers import LLMProvider, TransientProviderError, get_provider
+
+# Concurrent completions per model; further calls queue
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+# Client-side rate limits per model (0 disables); completions are charged
+# prompt tokens plus LLM_EXPECTED_COMPLETION_TOKENS against the TPM budget
+LLM_RPM = float(os.getenv("LLM_RPM", 0))
+LLM_TPM = float(os.getenv("LLM_TPM", 0))
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", 500))
+# Per-attempt timeout and retries with exponential backoff and full jitter
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", 8))
+# Consecutive failed calls that open a model's circuit, and how long it stays open
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", 5))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+# USD per 1K prompt/completion tokens for the cost counters; LLM_PRICES
+# ("model=input/output,...") adds or overrides models. Unlisted models cost nothing.
+DEFAULT_LLM_PRICES = "gpt-3.5-turbo=0.0005/0.0015,gpt-4o-mini=0.00015/0.0006,gpt-4o=0.0025/0.01,gpt-4-turbo=0.01/0.03"
+
+
+def parse_prices(spec: str) -> Dict[str, Tuple[float, float]]:
+    prices = {}
+    for item in spec.split(","):
+        model, _, price = item.strip().partition("=")
+        if model:
+            prompt, _, completion = price.partition("/")
+            prices[model] = (float(prompt), float(completion or prompt))
+    return prices
+
+
+LLM_PRICES = {**parse_prices(DEFAULT_LLM_PRICES), **parse_prices(os.getenv("LLM_PRICES", ""))}
+
+# Absolute (monotonic) deadline of the request being served; LLM calls never outlive it
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class LLMUnavailableError(Exception):
+    """Raised when a model's circuit is open or its deadline cannot be met (HTTP 503)."""
+
+
+class LLMDeadlineExceeded(LLMUnavailableError):
+    """Raised when the request deadline passes before a completion is obtained (HTTP 504)."""
+
+
+class LLMThrottled(LLMDeadlineExceeded):
+    """Raised when the deadline passes while a call waits on the local rate limits or concurrency cap."""
+
+
+def set_request_deadline(seconds: float):
+    """Bound every LLM call made in the current context to `seconds` from now; returns a reset token."""
+    return request_deadline.set(time.monotonic() + seconds)
+
+
+def message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(count_tokens(message["content"]) for message in messages)
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (TransientProviderError, asyncio.TimeoutError)):
+        return True
+    # OpenAI SDK errors, matched by shape so other providers need not import it
+    if type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and (status in (408, 409, 429) or status >= 500)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after")) if response is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+async def close_stream(chunks: AsyncIterator[str]) -> None:
+    """Close a provider stream (and its HTTP response) that may not have been read to the end."""
+    aclose = getattr(chunks, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding up to one minute's budget."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float, deadline: Optional[float] = None) -> float:
+        """Take `amount` (capped at capacity), waiting for refill; returns seconds waited."""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        # The lock keeps waiters first-come first-served
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                wait = (amount - self.tokens) / self.rate
+                if deadline is not None and now + wait > deadline:
+                    raise LLMThrottled("Rate limit wait would exceed the request deadline")
+                await asyncio.sleep(wait)
+                waited += wait
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failed calls and rejects calls for
+    `cooldown` seconds; then lets a single trial call through (half-open),
+    closing again on its success.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.cooldown else "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Let another call be the half-open trial when this one ended without an outcome (e.g. cancelled)."""
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self.opened += 1
+
+
+class ModelLane:
+    """Concurrency cap, rate limits, circuit breaker and counters for one model."""
+
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self.requests = TokenBucket(LLM_RPM) if LLM_RPM > 0 else None
+        self.tokens = TokenBucket(LLM_TPM) if LLM_TPM > 0 else None
+        self.breaker = CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_COOLDOWN)
+        self.in_flight = 0
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.rate_limited_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+
+    def record_usage(self, model: str, prompt_tokens: int, completion_tokens: int) -> None:
+        """Count the tokens (and their cost) of a completed call."""
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        prompt_price, completion_price = LLM_PRICES.get(model, (0.0, 0.0))
+        self.cost_usd += (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "rate_limited_seconds": round(self.rate_limited_seconds, 3),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "circuit": self.breaker.state,
+            "circuit_opened": self.breaker.opened,
+        }
+
+
+class LLMGateway:
+    """
+    The one entry point every chat completion goes through, in front of the
+    provider selected by LLM_PROVIDER.
+
+    Per model: a semaphore caps concurrent calls, token buckets keep to the
+    configured RPM/TPM, retryable errors (connection errors, timeouts, 408,
+    409, 429, 5xx) are retried with exponential backoff and full jitter
+    (honouring Retry-After), each attempt is bounded by LLM_TIMEOUT and the
+    request deadline, and a circuit breaker fails fast while the model is down.
+    """
+
+    def __init__(self, provider: Optional[LLMProvider] = None):
+        self.provider = provider or get_provider()
+        self._lanes: Dict[str, ModelLane] = {}
+
+    def lane(self, model: str) -> ModelLane:
+        if model not in self._lanes:
+            self._lanes[model] = ModelLane()
+        return self._lanes[model]
+
+    async def complete(self, model: str, messages: List[Dict[str, str]], **kwargs) -> str:
+        """Text of one chat completion."""
+        async def attempt(timeout: float) -> str:
+            return await asyncio.wait_for(self.provider.complete(model, messages, **kwargs), timeout)
+
+        completion = await self._call(model, messages, attempt)
+        self.lane(model).record_usage(model, message_tokens(messages), count_tokens(completion or ""))
+        return completion
+
+    async def stream(self, model: str, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        """
+        Chunks of a streamed chat completion. Opening the stream is retried like
+        `complete`; once chunks have been yielded a failure is raised as is.
+        """
+        lane = self.lane(model)
+
+        async def attempt(timeout: float):
+            # Opening a stream succeeds once its first chunk arrives
+            chunks = self.provider.stream(model, messages, **kwargs).__aiter__()
+            try:
+                first = await asyncio.wait_for(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                first = None
+            except BaseException:
+                # Timed out or cancelled: free the provider's connection now, not at GC
+                await close_stream(chunks)
+                raise
+            return first, chunks
+
+        # Rate limits first, then a concurrency slot that stays held while the stream is read
+        first, chunks = await self._call(model, messages, attempt, hold=True)
+        parts = [first] if first is not None else []
+        try:
+            if first is None:
+                return
+            yield first
+            async for delta in chunks:
+                parts.append(delta)
+                yield delta
+        finally:
+            await close_stream(chunks)
+            lane.in_flight -= 1
+            lane.semaphore.release()
+            # An abandoned stream is billed for what was generated so far
+            lane.record_usage(model, message_tokens(messages), count_tokens("".join(parts)))
+
+    async def _call(self, model: str, messages: List[Dict[str, str]], attempt, hold: bool = False) -> Any:
+        """
+        One call through the breaker, rate limits and concurrency cap, with retries.
+        With `hold`, returns still holding the concurrency slot (counted in flight);
+        the caller must decrement `in_flight` and release the semaphore.
+        """
+        lane = self.lane(model)
+        lane.calls += 1
+        if not lane.breaker.allow():
+            lane.rejected += 1
+            raise LLMUnavailableError(f"LLM circuit for {model} is open; try again shortly")
+        deadline = request_deadline.get()
+        try:
+            if lane.requests is not None:
+                lane.rate_limited_seconds += await lane.requests.acquire(1, deadline)
+            if lane.tokens is not None:
+                tokens = message_tokens(messages) + LLM_EXPECTED_COMPLETION_TOKENS
+                lane.rate_limited_seconds += await lane.tokens.acquire(tokens, deadline)
+            await lane.semaphore.acquire()
+            lane.in_flight += 1
+            try:
+                result = await self._attempts(lane, deadline, attempt)
+            except BaseException:
+                hold = False
+                raise
+            finally:
+                if not hold:
+                    lane.in_flight -= 1
+                    lane.semaphore.release()
+        except Exception as e:
+            lane.failures += 1
+            if isinstance(e, LLMThrottled):
+                # Never reached the model; local throttling says nothing about its health
+                lane.breaker.release_trial()
+            elif isinstance(e, LLMDeadlineExceeded) or is_retryable(e):
+                lane.breaker.record_failure()
+            else:
+                # The model answered (e.g. a 400); it is not down
+                lane.breaker.record_success()
+            raise
+        except BaseException:
+            # Cancelled (client disconnect, deadline): says nothing about the model
+            lane.breaker.release_trial()
+            raise
+        lane.breaker.record_success()
+        return result
+
+    async def _attempts(self, lane: ModelLane, deadline: Optional[float], attempt) -> Any:
+        for retry in range(LLM_MAX_RETRIES + 1):
+            timeout = LLM_TIMEOUT
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    if retry == 0:
+                        raise LLMThrottled("Request deadline passed while queued for the LLM")
+                    raise LLMDeadlineExceeded("Request deadline passed before the LLM answered")
+            lane.attempts += 1
+            try:
+                return await attempt(timeout)
+            except Exception as e:
+                if not is_retryable(e) or retry == LLM_MAX_RETRIES:
+                    if isinstance(e, asyncio.TimeoutError) and deadline is not None and time.monotonic() >= deadline:
+                        raise LLMDeadlineExceeded("Request deadline passed before the LLM answered") from e
+                    raise
+                delay = retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** retry))
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise LLMDeadlineExceeded("Request deadline leaves no time to retry the LLM call") from e
+                lane.retries += 1
+                print(f"LLM call failed ({type(e).__name__}: {e}); retry {retry + 1}/{LLM_MAX_RETRIES} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        """Close the provider's connection pool (bound to the running event loop)."""
+        await self.provider.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider.name,
+            "max_concurrency": LLM_MAX_CONCURRENCY,
+            "rpm": LLM_RPM,
+            "tpm": LLM_TPM,
+            "models": {model: lane.stats() for model, lane in self._lanes.items()},
+        }
+
+
+gateway = LLMGateway()
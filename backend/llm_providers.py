@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+# "openai" (hosted API), "local" (any OpenAI-compatible server, e.g. vLLM,
+# llama.cpp or Ollama) or "stub" (deterministic offline responses)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL") or None
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "http://localhost:11434/v1")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 64))
+
+# Stub provider: time to first token is drawn from LLM_STUB_LATENCY, then
+# tokens arrive at LLM_STUB_TOKENS_PER_SEC. Both are seeded per prompt, so a
+# run is reproducible.
+LLM_STUB_LATENCY = os.getenv("LLM_STUB_LATENCY", "lognormal:0.5,0.4")
+LLM_STUB_TOKENS_PER_SEC = float(os.getenv("LLM_STUB_TOKENS_PER_SEC", 50))
+LLM_STUB_ANSWER_TOKENS = int(os.getenv("LLM_STUB_ANSWER_TOKENS", 200))
+LLM_STUB_ERROR_RATE = float(os.getenv("LLM_STUB_ERROR_RATE", 0))
+LLM_STUB_SEED = int(os.getenv("LLM_STUB_SEED", 0))
+
+
+class TransientProviderError(Exception):
+    """A provider failure worth retrying (the stub raises these at LLM_STUB_ERROR_RATE)."""
+
+
+class LLMProvider(ABC):
+    """A chat-completion backend: the text of a completion, whole or streamed in chunks."""
+
+    name = "base"
+
+    @abstractmethod
+    async def complete(self, model: str, messages: List[Dict[str, str]], **kwargs) -> str:
+        """Text of one chat completion."""
+
+    @abstractmethod
+    def stream(self, model: str, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        """Chunks of a chat completion as they are generated."""
+
+    async def aclose(self) -> None:
+        """Release pooled connections; call from the event loop that used the provider."""
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI's API, or any server speaking its chat-completions protocol at `base_url`."""
+
+    name = "openai"
+
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None, name: str = "openai"):
+        import httpx
+        import openai
+
+        self.name = name
+        self.base_url = base_url
+        # Retries are the gateway's job
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key or os.environ.get("OPENAI_API_KEY"),
+            base_url=base_url,
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+            ),
+        )
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+    async def complete(self, model: str, messages: List[Dict[str, str]], **kwargs) -> str:
+        response = await self.client.chat.completions.create(model=model, messages=messages, **kwargs)
+        return response.choices[0].message.content
+
+    async def stream(self, model: str, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(model=model, messages=messages, stream=True, **kwargs)
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            await stream.close()
+
+
+def parse_distribution(spec: str) -> Callable[[random.Random], float]:
+    """
+    Sampler of seconds from a spec: "fixed:S", "uniform:A,B", "normal:MEAN,SD",
+    "lognormal:MEDIAN,SIGMA" or "exponential:MEAN". Samples are never negative.
+    """
+    kind, _, args = spec.partition(":")
+    params = [float(p) for p in args.split(",") if p.strip()]
+    samplers = {
+        "fixed": (1, lambda rng, s: s),
+        "uniform": (2, lambda rng, a, b: rng.uniform(a, b)),
+        "normal": (2, lambda rng, mean, sd: rng.gauss(mean, sd)),
+        "lognormal": (2, lambda rng, median, sigma: rng.lognormvariate(math.log(median), sigma)),
+        "exponential": (1, lambda rng, mean: rng.expovariate(1.0 / mean)),
+    }
+    if kind not in samplers or len(params) != samplers[kind][0]:
+        raise ValueError(f"Invalid latency distribution '{spec}'")
+    sample = samplers[kind][1]
+    return lambda rng: max(0.0, sample(rng, *params))
+
+
+_CITATION_RE = re.compile(r"\b(?:CPR\s+\d+(?:\.\d+[A-Z]*)?|Practice Direction\s+\d+[A-Z]*|[A-Z][\w&.-]+ v\. [A-Z][\w&.-]+)")
+_FILLER = (
+    "The court applies the overriding objective to deal with cases justly and at proportionate cost. "
+    "Each step must be taken within the time limits set by the rules or by the court. "
+    "Where a party fails to comply, the court may make orders for relief or sanctions. "
+)
+
+
+def stub_response(prompt: str, answer_tokens: int = LLM_STUB_ANSWER_TOKENS) -> str:
+    """
+    Deterministic, well-formed output for each prompt the backend sends:
+    visualization JSON/Mermaid, case analyses, and otherwise an answer of
+    about `answer_tokens` words citing the rules and cases in the prompt.
+    """
+    lowered = prompt.lower()
+    citations = list(dict.fromkeys(_CITATION_RE.findall(prompt)))[:5] or ["CPR 1.1"]
+    steps = [
+        {"id": str(i + 1), "title": f"Comply with {c}", "description": f"Take the steps required by {c}."}
+        for i, c in enumerate(citations)
+    ]
+    timeline = [dict(step, date=f"2024-01-{1 + 7 * i:02d}", status="pending", daysFromStart=7 * i) for i, step in enumerate(steps)]
+    progress = [dict(step, status="not-started", priority="high", ruleCitation=c) for step, c in zip(steps, citations)]
+    flowchart = "graph TD\n" + "\n".join(f"    S{i}[Step {i + 1}] --> S{i + 1}[Step {i + 2}];" for i in range(len(steps)))
+
+    if "produce a flowchart, a timeline and a progress tracker" in lowered:
+        return json.dumps({"flowchart": flowchart, "timeline": timeline, "progress": progress})
+    if "mermaid flowchart" in lowered:
+        return flowchart
+    if "create a timeline" in lowered:
+        return json.dumps(timeline)
+    if "progress tracker" in lowered:
+        return json.dumps(progress)
+    if '"supportive", "opposing", or "neutral"' in lowered:
+        return json.dumps({"classification": "Neutral", "justification": "The case addresses related issues without deciding this point."})
+    if '"global_summary"' in lowered:
+        return json.dumps({
+            "global_summary": "The tribunal resolved the dispute on the evidence before it.",
+            "claimant_arguments": "The claimant argued that the measures breached the treaty.",
+            "respondent_arguments": "The respondent argued that the measures were lawful regulation.",
+            "tribunal_reasoning": "The tribunal weighed the treaty standard against the evidence.",
+        })
+
+    answer = "Under " + ", ".join(f"**{c}**" for c in citations) + ", the position is as follows. "
+    words = (answer + _FILLER * (1 + answer_tokens // 40)).split()
+    return " ".join(words[:max(answer_tokens, len(answer.split()))])
+
+
+class StubProvider(LLMProvider):
+    """
+    Offline provider for load tests and evaluation. Output comes from
+    `responder(prompt)` (falling back to stub_response) and timing from the
+    latency distribution and token rate; both depend only on the seed and the
+    prompt, so runs are reproducible. A seeded `error_rate` fraction of calls
+    (in call order, so retries can succeed) fail with a TransientProviderError
+    before the first token.
+    """
+
+    name = "stub"
+
+    def __init__(
+        self,
+        latency: str = LLM_STUB_LATENCY,
+        tokens_per_sec: float = LLM_STUB_TOKENS_PER_SEC,
+        error_rate: float = LLM_STUB_ERROR_RATE,
+        seed: int = LLM_STUB_SEED,
+        responder: Optional[Callable[[str], Optional[str]]] = None,
+    ):
+        self.latency = latency
+        self.sample_latency = parse_distribution(latency)
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.seed = seed
+        self.responder = responder
+        self._errors = random.Random(seed)
+
+    def _plan(self, model: str, messages: List[Dict[str, str]]):
+        prompt = messages[-1]["content"]
+        digest = hashlib.sha256(f"{self.seed}\n{model}\n{prompt}".encode("utf-8")).digest()
+        rng = random.Random(int.from_bytes(digest[:8], "big"))
+        text = (self.responder(prompt) if self.responder else None) or stub_response(prompt)
+        return text, self.sample_latency(rng), self.error_rate > 0 and self._errors.random() < self.error_rate
+
+    async def complete(self, model: str, messages: List[Dict[str, str]], **kwargs) -> str:
+        text, first_token, fail = self._plan(model, messages)
+        await asyncio.sleep(first_token)
+        if fail:
+            raise TransientProviderError("Stub provider injected failure")
+        if self.tokens_per_sec > 0:
+            await asyncio.sleep(len(text.split()) / self.tokens_per_sec)
+        return text
+
+    async def stream(self, model: str, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[str]:
+        text, first_token, fail = self._plan(model, messages)
+        await asyncio.sleep(first_token)
+        if fail:
+            raise TransientProviderError("Stub provider injected failure")
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            if i and self.tokens_per_sec > 0:
+                await asyncio.sleep(1.0 / self.tokens_per_sec)
+            yield word if i == len(words) - 1 else word + " "
+
+
+def get_provider(name: Optional[str] = None) -> LLMProvider:
+    """The provider selected by LLM_PROVIDER (or `name`)."""
+    name = name or LLM_PROVIDER
+    if name == "openai":
+        return OpenAIProvider(base_url=LLM_BASE_URL)
+    if name == "local":
+        return OpenAIProvider(
+            base_url=LLM_BASE_URL or LOCAL_LLM_BASE_URL, api_key=os.environ.get("OPENAI_API_KEY") or "local", name="local"
+        )
+    if name == "stub":
+        return StubProvider()
+    raise ValueError(f"Unknown LLM_PROVIDER '{name}' (expected openai, local or stub)")
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Load generator for the JusticeGPS API.
+
+Drives a weighted mix of /api/query (per mode), /api/query/stream,
+/api/legal-breakdown and /api/rewrite-strategy traffic, either closed-loop
+(a fixed number of concurrent clients) or open-loop (arrivals at a target
+QPS, timed from their scheduled start so a slow server cannot hide queueing).
+By default the app runs in-process with the stub LLM provider; --url targets
+a running uvicorn/gunicorn server instead (start it with LLM_PROVIDER=stub).
+
+Reports p50/p95/p99 latency, throughput and error rate per endpoint, and per
+pipeline stage from the server's Server-Timing headers. Against --url, streams
+also record the client-observed time to first token (client_first_token);
+in-process responses are buffered, so there only the server's llm_first_token
+stage is reported. Results can be saved
+as JSON and compared with an earlier run:
+
+    python load_test.py --closed --concurrency 16 --requests 500 --output base.json
+    python load_test.py --open --qps 20 --duration 60 --compare base.json
+    python load_test.py --url http://localhost:8000 --mix "query:civil_procedure=3,rewrite-strategy=1"
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from stage_timer import parse_server_timing
+
+DEFAULT_MIX = "query:civil_procedure=6,query:arbitration_strategy=2,stream:civil_procedure=1,legal-breakdown=1,rewrite-strategy=1"
+
+QUESTIONS = {
+    "civil_procedure": [
+        "What is the deadline for serving a claim form under CPR 7.5?",
+        "How do I apply for summary judgment under CPR 24?",
+        "What are the requirements for service of documents under CPR 6?",
+        "How do I make an application for interim relief?",
+        "What is the procedure for disclosure under CPR 31?",
+        "Can I extend the time for filing a defence?",
+        "What happens if a party fails to comply with a court order?",
+        "How are costs assessed on the standard basis?",
+    ],
+    "arbitration_strategy": [
+        "What are the key weaknesses in Kronos's environmental counterclaim strategy?",
+        "How can we strengthen our jurisdictional arguments against environmental counterclaims?",
+        "What precedent supports our position on environmental liability?",
+        "What procedural strategies should we consider for the counterclaim?",
+        "How do we address the burden of proof for environmental damages?",
+    ],
+}
+
+CASE_NAMES = [
+    "Burlington v. Ecuador",
+    "Perenco v. Ecuador",
+    "MetalTech v. Uzbekistan",
+    "Urbaser v. Argentina",
+    "Paushok v. Mongolia",
+]
+
+STRATEGIES = [
+    ("Argue that the tribunal lacks jurisdiction over the environmental counterclaim.",
+     "Investor-state arbitration; the respondent state has filed an environmental counterclaim."),
+    ("Challenge the quantum of environmental damages claimed by the respondent.",
+     "The respondent relies on a single expert report estimating remediation costs."),
+]
+
+# A run regresses when a latency percentile or stage p95 grows, or throughput
+# falls, by more than --threshold, or the error rate rises by this much
+ERROR_RATE_TOLERANCE = 0.01
+
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    """ "name=weight,..." -> [(name, weight)]; names are query:MODE, stream:MODE, legal-breakdown, rewrite-strategy."""
+    mix = []
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition("=")
+        kind, _, mode = name.partition(":")
+        if kind in ("query", "stream"):
+            if mode not in QUESTIONS:
+                raise ValueError(f"Unknown mode in '{name}' (expected one of {', '.join(QUESTIONS)})")
+        elif name not in ("legal-breakdown", "rewrite-strategy"):
+            raise ValueError(f"Unknown scenario '{name}'")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def build_request(scenario: str, rng: random.Random, use_cache: bool) -> Tuple[str, Dict[str, Any], Dict[str, str]]:
+    """(path, JSON body, headers) of one request for a scenario."""
+    headers = {} if use_cache else {"X-Cache-Bypass": "1"}
+    kind, _, mode = scenario.partition(":")
+    if kind == "query":
+        return "/api/query", {"query": rng.choice(QUESTIONS[mode]), "mode": mode}, headers
+    if kind == "stream":
+        return "/api/query/stream", {"query": rng.choice(QUESTIONS[mode]), "mode": mode}, headers
+    if scenario == "legal-breakdown":
+        return "/api/legal-breakdown", {"case_name": rng.choice(CASE_NAMES)}, headers
+    strategy, context = rng.choice(STRATEGIES)
+    return "/api/rewrite-strategy", {"strategy": strategy, "context": context}, headers
+
+
+class Recorder:
+    """Per-scenario latencies, statuses and stage timings of a run."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.stages: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+        self.dropped = 0
+
+    def record(self, scenario: str, latency_ms: float, status: str, ok: bool, stages: Dict[str, float]) -> None:
+        self.latencies[scenario].append(latency_ms)
+        self.statuses[scenario][status] += 1
+        if not ok:
+            self.errors[scenario] += 1
+        for name, ms in stages.items():
+            self.stages[scenario][name].append(ms)
+
+
+async def send(
+    client,
+    scenario: str,
+    rng: random.Random,
+    use_cache: bool,
+    recorder: Optional[Recorder],
+    started: Optional[float] = None,
+    client_ttft: bool = False,
+) -> None:
+    """
+    Issue one request and record it; `started` backdates the latency to a scheduled arrival.
+    `client_ttft` records the client-observed first token of streams as the client_first_token
+    stage (only meaningful over a real connection: the in-process transport buffers bodies).
+    """
+    path, body, headers = build_request(scenario, rng, use_cache)
+    started = time.perf_counter() if started is None else started
+    stages: Dict[str, float] = {}
+    try:
+        if scenario.startswith("stream:"):
+            ok, status = False, "incomplete"
+            async with client.stream("POST", path, json=body, headers=headers) as response:
+                status = str(response.status_code)
+                stages.update(parse_server_timing(response.headers.get("server-timing", "")))
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[7:]
+                        if client_ttft and event == "token" and "client_first_token" not in stages:
+                            stages["client_first_token"] = (time.perf_counter() - started) * 1000.0
+                    elif line.startswith("data: ") and event in ("done", "error"):
+                        if event == "done":
+                            stages.update(json.loads(line[6:]).get("timings", {}))
+                            ok = response.status_code == 200
+                        else:
+                            status = "stream_error"
+        else:
+            response = await client.post(path, json=body, headers=headers)
+            status = str(response.status_code)
+            ok = response.status_code == 200
+            stages.update(parse_server_timing(response.headers.get("server-timing", "")))
+    except Exception as e:
+        ok, status = False, type(e).__name__
+    if recorder is not None:
+        recorder.record(scenario, (time.perf_counter() - started) * 1000.0, status, ok, stages)
+
+
+async def closed_loop(client, mix, args, recorder: Recorder) -> None:
+    """`concurrency` clients, each sending its next request as soon as the last one finishes."""
+    names, weights = zip(*mix)
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    remaining = [args.requests]
+
+    async def worker(worker_id: int) -> None:
+        rng = random.Random(args.seed * 1000 + worker_id)
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if deadline is None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            await send(client, rng.choices(names, weights)[0], rng, args.use_cache, recorder, client_ttft=bool(args.url))
+
+    await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+
+
+async def open_loop(client, mix, args, recorder: Recorder) -> None:
+    """Arrivals at `qps` (Poisson or evenly spaced) for `duration`, regardless of how fast the server answers."""
+    names, weights = zip(*mix)
+    rng = random.Random(args.seed)
+    tasks = set()
+    start = time.perf_counter()
+    scheduled = start
+    while True:
+        scheduled += rng.expovariate(args.qps) if args.arrivals == "poisson" else 1.0 / args.qps
+        if scheduled - start >= args.duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= args.max_outstanding:
+            # The client, not the server, is the bottleneck; count it rather than queueing unboundedly
+            recorder.dropped += 1
+            continue
+        request_rng = random.Random(rng.random())
+        task = asyncio.create_task(send(
+            client, rng.choices(names, weights)[0], request_rng, args.use_cache, recorder,
+            started=scheduled, client_ttft=bool(args.url),
+        ))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 2),
+        "p95": round(float(p95), 2),
+        "p99": round(float(p99), 2),
+        "mean": round(float(np.mean(values)), 2),
+        "max": round(float(np.max(values)), 2),
+    }
+
+
+def summarize(recorder: Recorder, elapsed: float) -> Dict[str, Any]:
+    endpoints = {}
+    for scenario, latencies in sorted(recorder.latencies.items()):
+        endpoints[scenario] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[scenario],
+            "error_rate": round(recorder.errors[scenario] / len(latencies), 4),
+            "statuses": dict(recorder.statuses[scenario]),
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "latency_ms": percentiles(latencies),
+            "stages": {
+                name: dict(percentiles(values), count=len(values))
+                for name, values in sorted(recorder.stages[scenario].items())
+            },
+        }
+    everything = [ms for latencies in recorder.latencies.values() for ms in latencies]
+    errors = sum(recorder.errors.values())
+    summary = {
+        "requests": len(everything),
+        "errors": errors,
+        "error_rate": round(errors / len(everything), 4) if everything else 0.0,
+        "dropped": recorder.dropped,
+        "duration_s": round(elapsed, 2),
+        "throughput_rps": round(len(everything) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": percentiles(everything) if everything else {},
+    }
+    return {"summary": summary, "endpoints": endpoints}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    summary = results["summary"]
+    print(f"\n{summary['requests']} requests in {summary['duration_s']}s: {summary['throughput_rps']} req/s, "
+          f"error rate {summary['error_rate']:.2%}, {summary['dropped']} dropped")
+    print(f"\n{'endpoint':34} {'reqs':>6} {'rps':>7} {'err':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for scenario, row in results["endpoints"].items():
+        lat = row["latency_ms"]
+        print(f"{scenario:34} {row['requests']:6d} {row['throughput_rps']:7.2f} {row['error_rate']:7.2%} "
+              f"{lat['p50']:9.1f} {lat['p95']:9.1f} {lat['p99']:9.1f}")
+        for name, stage in row["stages"].items():
+            print(f"  {name:32} {stage['count']:6d} {'':7} {'':7} {stage['p50']:9.1f} {stage['p95']:9.1f} {stage['p99']:9.1f}")
+        if len(row["statuses"]) > 1 or "200" not in row["statuses"]:
+            print(f"  statuses: {row['statuses']}")
+    if results["meta"]["target"] == "in-process" and any(s.startswith("stream:") for s in results["endpoints"]):
+        print("\nIn-process responses arrive whole, so stream time to first token is the server's llm_first_token stage")
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Print the change against a baseline run; returns the regressions found."""
+    regressions = []
+
+    def check(label: str, new: float, old: float, higher_is_worse: bool = True) -> str:
+        if not old:
+            return f"{new:9.1f}"
+        change = (new - old) / old
+        if (change > threshold) if higher_is_worse else (change < -threshold):
+            regressions.append(f"{label}: {old:.1f} -> {new:.1f} ({change:+.0%})")
+            return f"{change:+8.0%}!"
+        return f"{change:+9.0%}"
+
+    print(f"\nAgainst baseline {baseline.get('meta', {}).get('commit') or '(unknown commit)'} "
+          f"from {baseline.get('meta', {}).get('timestamp', '?')} (threshold {threshold:.0%}):")
+    print(f"{'endpoint':34} {'rps':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'err':>9}")
+    for scenario, row in results["endpoints"].items():
+        old = baseline.get("endpoints", {}).get(scenario)
+        if old is None:
+            print(f"{scenario:34} (not in baseline)")
+            continue
+        cells = [check(f"{scenario} throughput", row["throughput_rps"], old["throughput_rps"], higher_is_worse=False)]
+        for p in ("p50", "p95", "p99"):
+            cells.append(check(f"{scenario} {p}", row["latency_ms"][p], old["latency_ms"][p]))
+        error_change = row["error_rate"] - old["error_rate"]
+        if error_change > ERROR_RATE_TOLERANCE:
+            regressions.append(f"{scenario} error rate: {old['error_rate']:.2%} -> {row['error_rate']:.2%}")
+        cells.append(f"{error_change:+9.2%}")
+        print(f"{scenario:34} " + " ".join(cells))
+        for name, stage in row["stages"].items():
+            old_stage = old.get("stages", {}).get(name)
+            if old_stage is not None:
+                print(f"  {name:32} {'':9} {'':9} {check(f'{scenario} stage {name} p95', stage['p95'], old_stage['p95'])}")
+    return regressions
+
+
+async def wait_until_ready(client, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            response = await client.get("/ready")
+            if response.status_code == 200:
+                return
+        except Exception:
+            pass
+        if time.perf_counter() >= deadline:
+            print(f"Warning: indexes not ready after {timeout:.0f}s; requests may fail with 503")
+            return
+        await asyncio.sleep(0.5)
+
+
+async def run(args, mix) -> Dict[str, Any]:
+    import httpx
+
+    connections = args.concurrency if args.closed else args.max_outstanding
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout)
+        provider = None
+    else:
+        # Configure the in-process server before its modules read the environment
+        os.environ.setdefault("LLM_PROVIDER", "stub")
+        os.environ.setdefault("LLM_CACHE", "0")
+        import main as api
+
+        await api.start_index_loading()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://load-test", timeout=args.timeout)
+        provider = api.gateway.provider.name
+
+    async with client:
+        await wait_until_ready(client, args.ready_timeout)
+        names = [name for name, _ in mix]
+        warmup_rng = random.Random(args.seed - 1)
+        for i in range(args.warmup):
+            await send(client, names[i % len(names)], warmup_rng, args.use_cache, None)
+
+        recorder = Recorder()
+        started = time.perf_counter()
+        await (closed_loop if args.closed else open_loop)(client, mix, args, recorder)
+        elapsed = time.perf_counter() - started
+
+        if not args.url:
+            await api.shutdown_retrieval_executor()
+
+    results = summarize(recorder, elapsed)
+    results["meta"] = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "target": args.url or "in-process",
+        "llm_provider": provider,
+        "loop": "closed" if args.closed else "open",
+        "concurrency": args.concurrency if args.closed else None,
+        "qps": None if args.closed else args.qps,
+        "arrivals": None if args.closed else args.arrivals,
+        "mix": dict(mix),
+        "use_cache": args.use_cache,
+        "seed": args.seed,
+    }
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the JusticeGPS API")
+    loop = parser.add_mutually_exclusive_group()
+    loop.add_argument("--closed", action="store_true", default=True, help="fixed number of concurrent clients (default)")
+    loop.add_argument("--open", dest="closed", action="store_false", help="arrivals at a fixed rate")
+    parser.add_argument("--url", help="base URL of a running server (default: run the app in-process)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted scenarios, e.g. 'query:civil_procedure=3,rewrite-strategy=1'")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed loop: concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="closed loop: total requests (unless --duration)")
+    parser.add_argument("--qps", type=float, default=10, help="open loop: arrival rate")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson", help="open loop: inter-arrival times")
+    parser.add_argument("--max-outstanding", type=int, default=1000, help="open loop: in-flight cap; arrivals beyond it are dropped")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run (required for --open)")
+    parser.add_argument("--warmup", type=int, default=5, help="unrecorded requests sent first")
+    parser.add_argument("--use-cache", action="store_true", help="let queries hit the response cache (default: bypass it)")
+    parser.add_argument("--timeout", type=float, default=180, help="per-request client timeout in seconds")
+    parser.add_argument("--ready-timeout", type=float, default=120, help="seconds to wait for /ready")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change that counts as a regression")
+    args = parser.parse_args(argv)
+    if not args.closed and args.duration <= 0:
+        parser.error("--open needs --duration")
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = asyncio.run(run(args, mix))
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,34 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, MutableMapping
 import json
 import asyncio
 import re
 from datetime import datetime
 import os
+import time
+import numpy as np
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
 
 from rag_cpr import CPRRAGSystem
 from rag_cases import ArbitrationRAGSystem
+from retrieval_executor import retrieval_executor, RetrievalOverloadedError
+import model_registry
+from index_loader import IndexHandle, IndexNotReadyError
+from response_cache import response_cache, source_signature, BYPASS_HEADER
+from completion_cache import completion_cache
+from llm_gateway import gateway, set_request_deadline, request_deadline, LLMUnavailableError, LLMDeadlineExceeded, LLM_BREAKER_COOLDOWN
+from artifact_store import artifact_store
+import visualizations
+from visualizations import VISUALIZATION_MODE, FIELDS as VISUALIZATION_FIELDS, generate_visualization, generate_combined
+import single_flight
+import stage_timer
+from stage_timer import stage
+import metrics
+import tracing
+from context_packer import CONTEXT_CANDIDATES, CONTEXT_TOKEN_BUDGET, PackedContext, pack_context, cpr_header, case_header, truncate_to_tokens
 from prompt_templates import (
     get_prompt_template,
     refine_answer, 
@@ -20,16 +36,13 @@ from prompt_templates import (
     get_arbitration_strategy_prompt, 
     extract_citations, 
     validate_answer_quality,
-    get_flowchart_prompt,
-    get_timeline_prompt,
-    get_progress_tracker_prompt,
     get_argument_strength_prompt,
     get_precedent_analysis_prompt,
     get_strategy_rewrite_prompt,
     get_case_support_prompt,
     get_legal_breakdown_prompt,
 )
-from utils import generate_structured_data, call_llm
+from utils import generate_structured_data, call_llm, stream_llm
 
 app = FastAPI(title="JusticeGPS", version="1.0.0")
 
@@ -45,12 +58,31 @@ app.add_middleware(
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize OpenAI client
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# RAG systems load in the background so the server binds immediately.
+# INDEX_LOADING=eager restores the old behaviour of loading before serving.
+INDEX_LOADING = os.getenv("INDEX_LOADING", "background")
+# How long /api/query waits for its mode's index before answering 503
+INDEX_READY_TIMEOUT = float(os.getenv("INDEX_READY_TIMEOUT", 10))
+# Overall budget per request; LLM calls (including retries) are cut off at this deadline
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 120))
+# Answer first and generate visualizations in the background (fetched from /api/artifacts/{id})
+DEFER_VISUALIZATIONS = os.getenv("DEFER_VISUALIZATIONS", "0").lower() not in ("0", "false", "no")
+# Longest /api/artifacts/{id}?wait= long-poll
+ARTIFACT_MAX_WAIT = float(os.getenv("ARTIFACT_MAX_WAIT", 30))
+
+cpr_index = IndexHandle(
+    "civil_procedure",
+    lambda report: CPRRAGSystem(data_dir="sample_data/cpr", progress_callback=report),
+)
+cases_index = IndexHandle(
+    "arbitration_strategy",
+    lambda report: ArbitrationRAGSystem(cases_dir="jus_mundi_hackathon_data/cases", progress_callback=report),
+)
+index_handles = {handle.name: handle for handle in (cpr_index, cases_index)}
 
-# Initialize RAG systems with correct paths
-cpr_rag = CPRRAGSystem(data_dir="sample_data/cpr")
-arbitration_rag = ArbitrationRAGSystem(cases_dir="jus_mundi_hackathon_data/cases")
+def mode_label(mode: str) -> str:
+    """Metrics label of a client-supplied mode, bounded to the known modes."""
+    return mode if mode in index_handles else "other"
 
 class QueryRequest(BaseModel):
     query: str
@@ -58,6 +90,8 @@ class QueryRequest(BaseModel):
     session_id: Optional[str] = None
     voice_input: Optional[bool] = False
     conversation_history: Optional[List[Dict[str, str]]] = None
+    # Return before visualizations are generated; defaults to DEFER_VISUALIZATIONS
+    defer_visualizations: Optional[bool] = None
 
 class QueryResponse(BaseModel):
     answer: str
@@ -71,6 +105,8 @@ class QueryResponse(BaseModel):
     radarMetrics: Optional[Dict[str, Any]] = None
     precedents: Optional[List[Dict[str, Any]]] = None
     formUrl: Optional[str] = None
+    context: Optional[Dict[str, Any]] = None
+    artifacts: Optional[Dict[str, str]] = None
 
 class RewriteRequest(BaseModel):
     strategy: str
@@ -79,102 +115,433 @@ class RewriteRequest(BaseModel):
 class LegalBreakdownRequest(BaseModel):
     case_name: str
 
+@app.on_event("startup")
+async def start_tracing():
+    tracing.init_tracing()
+
+@app.on_event("startup")
+async def start_index_loading():
+    if INDEX_LOADING == "eager":
+        await asyncio.gather(*(handle.load() for handle in index_handles.values()))
+    else:
+        for handle in index_handles.values():
+            handle.start()
+
+@app.on_event("shutdown")
+async def shutdown_retrieval_executor():
+    retrieval_executor.shutdown()
+
+@app.on_event("shutdown")
+async def close_llm_gateway():
+    await gateway.aclose()
+
+@app.on_event("shutdown")
+async def stop_tracing():
+    tracing.shutdown_tracing()
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """
+    Bound the request's LLM calls by REQUEST_DEADLINE, report its stage timings
+    in Server-Timing, and record its HTTP metrics (and span, when tracing).
+    """
+    deadline_token = set_request_deadline(REQUEST_DEADLINE)
+    timings_token = stage_timer.start_request()
+    metrics.http_in_flight.inc()
+    started = time.perf_counter()
+    status = "500"
+    try:
+        with tracing.request_span(request.method, request.url.path) as span:
+            response = await call_next(request)
+            status = str(response.status_code)
+            if span is not None:
+                span.set_attribute("http.status_code", response.status_code)
+        # Streamed responses only report the stages run before their first byte
+        timings = stage_timer.timings()
+        if timings:
+            response.headers["Server-Timing"] = stage_timer.server_timing_header(timings)
+        return response
+    finally:
+        # Label by route template, not the raw path, to keep label cardinality bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.http_request_seconds.observe(time.perf_counter() - started, request.method, route)
+        metrics.http_requests.inc(request.method, route, status)
+        metrics.http_in_flight.dec()
+        stage_timer.end_request(timings_token)
+        request_deadline.reset(deadline_token)
+
+# /metrics: each component's own counters, read at scrape time
+metrics.registry.register_stats(
+    "response_cache", response_cache.stats,
+    counters=("hits", "disk_hits", "misses", "stores", "evictions", "expirations", "bypassed"), gauges=("entries", "hit_rate"),
+)
+metrics.registry.register_stats(
+    "llm_cache", completion_cache.stats,
+    counters=("hits", "disk_hits", "misses", "stores", "evictions"), gauges=("entries", "hit_rate"),
+)
+metrics.registry.register_stats(
+    "llm", lambda: gateway.stats()["models"],
+    counters=("calls", "attempts", "retries", "failures", "rejected", "prompt_tokens", "completion_tokens", "cost_usd", "circuit_opened"),
+    gauges=("in_flight", "rate_limited_seconds"), label="model",
+)
+metrics.registry.register_stats(
+    "single_flight", single_flight.stats,
+    counters=("calls", "executions", "coalesced"), gauges=("in_flight", "coalesced_ratio"), label="group",
+)
+metrics.registry.register_stats(
+    "retrieval", retrieval_executor.stats, counters=("completed", "rejected"), gauges=("in_flight", "workers"),
+)
+metrics.registry.register_stats(
+    "encoder", lambda: model_registry.stats()["encoders"],
+    counters=("batches", "items", "rejected"), gauges=("pending", "mean_batch_size"), label="encoder",
+)
+metrics.registry.register_stats(
+    "artifacts", artifact_store.stats, counters=("submitted", "reused", "expired", "evictions"), gauges=("entries",),
+)
+metrics.registry.register_stats(
+    "index", lambda: {name: handle.snapshot() for name, handle in index_handles.items()}, gauges=("ready",), label="index",
+)
+
+def llm_circuits():
+    models = gateway.stats()["models"]
+    yield (
+        "justicegps_llm_circuit_open", "gauge", "Whether the model's circuit breaker is rejecting calls",
+        [({"model": model}, 1.0 if lane["circuit"] == "open" else 0.0) for model, lane in models.items()],
+    )
+
+metrics.registry.add_collector(llm_circuits)
+
 @app.get("/")
 async def root():
     return {"message": "JusticeGPS API - AI Assistant for Legal Analysis"}
 
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving, whether or not indexes are loaded."""
+    return {
+        "status": "ok",
+        "indexes": {name: handle.status for name, handle in index_handles.items()},
+    }
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 only once every index is loaded, with per-index progress."""
+    indexes = {name: handle.snapshot() for name, handle in index_handles.items()}
+    all_ready = all(index["ready"] for index in indexes.values())
+    return JSONResponse(
+        status_code=200 if all_ready else 503,
+        content={"ready": all_ready, "indexes": indexes},
+    )
+
+def index_unavailable(e: IndexNotReadyError) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+def llm_unavailable(e: LLMUnavailableError) -> HTTPException:
+    if isinstance(e, LLMDeadlineExceeded):
+        return HTTPException(status_code=504, detail=str(e))
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(LLM_BREAKER_COOLDOWN))})
+
+def cache_bypassed(http_request: Request) -> bool:
+    return http_request.headers.get(BYPASS_HEADER, "0").lower() not in ("0", "false", "")
+
+async def retrieve_context(request: QueryRequest) -> Tuple[np.ndarray, PackedContext, str]:
+    """Embed the query, retrieve candidates for its mode and pack them into the answer prompt."""
+    # Retrieval and context packing run on the bounded retrieval executor; the event loop only awaits them
+    if request.mode == "civil_procedure":
+        cpr_rag = await cpr_index.wait(INDEX_READY_TIMEOUT)
+        with stage("encode"):
+            query_emb = await cpr_rag.encoder.encode_async(request.query)
+        with stage("search"):
+            candidates = await cpr_rag.get_relevant_rules(request.query, k=CONTEXT_CANDIDATES, query_emb=query_emb)
+        with stage("pack"):
+            packed = await retrieval_executor.run(pack_context, candidates, request.query, header_of=cpr_header)
+        prompt = get_civil_procedure_prompt(packed.text, request.query, request.conversation_history)
+    else:  # arbitration_strategy
+        arbitration_rag = await cases_index.wait(INDEX_READY_TIMEOUT)
+        with stage("encode"):
+            query_emb = await arbitration_rag.encoder.encode_async(request.query)
+        with stage("search"):
+            candidates = await arbitration_rag.get_relevant_cases(request.query, k=CONTEXT_CANDIDATES, query_emb=query_emb)
+        with stage("pack"):
+            packed = await retrieval_executor.run(
+                pack_context, candidates, request.query, header_of=case_header, label_of=lambda case: case.get('case_name', '')
+            )
+        prompt = get_arbitration_strategy_prompt(packed.text, request.query)
+    return query_emb, packed, prompt
+
+def open_response_cache(request: QueryRequest, http_request: Request, headers: MutableMapping[str, str]) -> bool:
+    """Whether this query may use the response cache; sets X-Cache to BYPASS when the client opted out."""
+    # Follow-ups with history are never cached
+    use_cache = response_cache.enabled and not request.conversation_history
+    if use_cache and cache_bypassed(http_request):
+        response_cache.record_bypass()
+        use_cache = False
+        headers["X-Cache"] = "BYPASS"
+    return use_cache
+
+def process_sources(relevant_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Defensive fix: ensure every source is a dict and has a 'url' key
+    processed_sources = []
+    for source in relevant_docs:
+        if not isinstance(source, dict):
+            source = {}
+        if 'url' not in source:
+            source['url'] = ''
+        processed_source = {
+            'rule_number': source.get('rule_number', ''),
+            'heading': source.get('heading', ''),
+            'part': source.get('part', ''),
+            'part_title': source.get('part_title', ''),
+            'excerpt': source.get('excerpt', ''),
+            'score': source.get('score', 0.0),
+            'full_text': source.get('full_text', ''),
+            'url': source.get('url', ''),
+            'case_name': source.get('case_name', ''),
+            'status': source.get('status', ''),
+            'support': source.get('support', {
+                'classification': 'Unknown',
+                'justification': 'No analysis available'
+            }),
+            'summary': source.get('summary', ''),
+            'context_tokens': source.get('context_tokens', 0)
+        }
+        processed_sources.append(processed_source)
+    return processed_sources
+
+def answer_details(request: QueryRequest, relevant_docs: List[Dict[str, Any]], llm_answer: str) -> Dict[str, Any]:
+    """Response fields derived from the finished answer, apart from the LLM-generated visualizations."""
+    return {
+        "answer": llm_answer,
+        "reasoning_chain": generate_reasoning_chain(request.query, relevant_docs, llm_answer),
+        "citations": extract_citations(llm_answer),
+        "quality_metrics": validate_answer_quality(llm_answer, request.query, request.mode),
+        "radarMetrics": None,
+        "precedents": [],
+        "formUrl": None,
+    }
+
+def visualization_jobs(mode: str, llm_answer: str) -> Dict[str, str]:
+    """
+    Start (or reuse) the structured-data jobs for an answer in the artifact store;
+    returns artifact ids keyed by response field (civil procedure only).
+    With VISUALIZATION_MODE=combined the three jobs share one completion.
+    """
+    if mode != "civil_procedure":
+        return {}
+    if VISUALIZATION_MODE == "combined":
+        combined = artifact_store.submit("visualizations", llm_answer, lambda: generate_combined(llm_answer))
+
+        async def pick(field: str) -> Any:
+            document = await artifact_store.result(combined)
+            if document is None:
+                # The combined artifact expired before this field was read
+                return await generate_visualization(field, llm_answer)
+            return document[field]
+
+        job = lambda field: (lambda: pick(field))
+    else:
+        job = lambda field: (lambda: generate_visualization(field, llm_answer))
+    return {field: artifact_store.submit(kind, llm_answer, job(field)) for field, (kind, *_) in VISUALIZATION_FIELDS.items()}
+
+async def attach_visualizations(result: Dict[str, Any], mode: str, defer: bool) -> Dict[str, Any]:
+    """Add artifact ids to a response and, unless deferred, wait for the visualizations themselves."""
+    jobs = visualization_jobs(mode, result["answer"])
+    result["artifacts"] = jobs
+    if jobs and not defer:
+        values = await asyncio.gather(*(artifact_store.result(artifact) for artifact in jobs.values()))
+        result.update(zip(jobs, values))
+    return result
+
 @app.post("/api/query", response_model=QueryResponse)
-async def query(request: QueryRequest):
+async def query(request: QueryRequest, http_request: Request, response: Response):
+    stage_timer.set_label("mode", mode_label(request.mode))
     try:
-        if request.mode == "civil_procedure":
-            # Synchronous path for CPR
-            relevant_docs = cpr_rag.get_relevant_rules(request.query)
-            prompt = get_civil_procedure_prompt(relevant_docs, request.query, request.conversation_history)
-        else:  # arbitration_strategy
-            # Asynchronous path for Arbitration
-            relevant_docs = await arbitration_rag.get_relevant_cases(request.query)
-            prompt = get_arbitration_strategy_prompt(relevant_docs, request.query)
+        query_emb, packed, prompt = await retrieve_context(request)
+        # Only sources that made it into the prompt are reported and scored
+        relevant_docs = packed.sources
+        session_id = request.session_id or f"session_{datetime.now().timestamp()}"
+
+        defer = DEFER_VISUALIZATIONS if request.defer_visualizations is None else request.defer_visualizations
+
+        # Semantic response cache: a paraphrase of a recent query over the same sources
+        # reuses its answer; its visualizations come back from the artifact store
+        use_cache = open_response_cache(request, http_request, response.headers)
+        cache_sources = source_signature(relevant_docs)
+        if use_cache:
+            with stage("cache"):
+                cached = await asyncio.to_thread(response_cache.lookup, request.mode, cache_sources, query_emb)
+            if cached is not None:
+                response.headers["X-Cache"] = "HIT"
+                return await attach_visualizations(dict(cached, session_id=session_id), request.mode, defer)
+            response.headers["X-Cache"] = "MISS"
 
         # Common logic for answer generation
-        llm_answer = await call_llm(prompt)
-
-        # Initialize structured data
-        flowchart_data, timeline_data, progress_data, strength_data, precedent_data, form_url = None, [], [], None, [], None
-
-        if request.mode == "civil_procedure":
-            # For civil procedure, generate structured data based on the answer
-            flowchart_prompt = get_flowchart_prompt(llm_answer)
-            timeline_prompt = get_timeline_prompt(llm_answer)
-            progress_prompt = get_progress_tracker_prompt(llm_answer)
-            
-            flowchart_task = asyncio.create_task(generate_structured_data(flowchart_prompt, is_json=False))
-            timeline_task = asyncio.create_task(generate_structured_data(timeline_prompt, is_json=True))
-            progress_task = asyncio.create_task(generate_structured_data(progress_prompt, is_json=True))
-            
-            flowchart_data = await flowchart_task
-            timeline_data = await timeline_task
-            progress_data = await progress_task
-        else:
-            flowchart_data = None
-            timeline_data = []
-            progress_data = []
-
-        # Calculate confidence and generate reasoning chain
-        confidence = calculate_confidence(relevant_docs, request.query)
-        reasoning_chain = generate_reasoning_chain(request.query, relevant_docs, llm_answer)
-        
-        # Extract citations
-        citations = extract_citations(llm_answer)
-        
-        # Validate answer quality
-        quality_metrics = validate_answer_quality(llm_answer, request.query, request.mode)
-
-        # Defensive fix: ensure every source is a dict and has a 'url' key
-        processed_sources = []
-        for source in relevant_docs:
-            if not isinstance(source, dict):
-                source = {}
-            if 'url' not in source:
-                source['url'] = ''
-            processed_source = {
-                'rule_number': source.get('rule_number', ''),
-                'heading': source.get('heading', ''),
-                'part': source.get('part', ''),
-                'part_title': source.get('part_title', ''),
-                'excerpt': source.get('excerpt', ''),
-                'score': source.get('score', 0.0),
-                'full_text': source.get('full_text', ''),
-                'url': source.get('url', ''),
-                'case_name': source.get('case_name', ''),
-                'status': source.get('status', ''),
-                'support': source.get('support', {
-                    'classification': 'Unknown',
-                    'justification': 'No analysis available'
-                }),
-                'summary': source.get('summary', '')
+        with stage("llm"):
+            llm_answer = await call_llm(prompt)
+
+        with stage("confidence"):
+            confidence = calculate_confidence(relevant_docs, request.query)
+        with stage("postprocess"):
+            result = {
+                **answer_details(request, relevant_docs, llm_answer),
+                "confidence": confidence,
+                "flowchart": None,
+                "sources": process_sources(relevant_docs),
+                "session_id": session_id,
+                "timelineEvents": [],
+                "progressSteps": [],
+                "context": packed.summary()
             }
-            processed_sources.append(processed_source)
-
-        return {
-            "answer": llm_answer,
-            "confidence": confidence,
-            "reasoning_chain": reasoning_chain,
-            "flowchart": flowchart_data,
-            "citations": citations,
-            "quality_metrics": quality_metrics,
-            "sources": processed_sources,
-            "session_id": request.session_id or f"session_{datetime.now().timestamp()}",
-            "timelineEvents": timeline_data,
-            "progressSteps": progress_data,
-            "radarMetrics": strength_data,
-            "precedents": precedent_data,
-            "formUrl": form_url
-        }
+        # For civil procedure, generate structured data based on the answer
+        with stage("structured"):
+            await attach_visualizations(result, request.mode, defer)
+        if use_cache:
+            with stage("cache"):
+                await asyncio.to_thread(response_cache.store, request.mode, cache_sources, query_emb, result)
+        return result
         
+    except IndexNotReadyError as e:
+        raise index_unavailable(e)
+    except RetrievalOverloadedError as e:
+        print(f"Shedding query under retrieval backpressure: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except LLMUnavailableError as e:
+        raise llm_unavailable(e)
     except Exception as e:
         print(f"Error processing query: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/query/stream")
+async def query_stream(request: QueryRequest, http_request: Request):
+    """
+    Server-sent events variant of /api/query. Events, in order:
+    `sources` (sources, confidence, context, session_id), `token` ({"text"})
+    for each answer chunk as the model produces it, `answer` (the full answer
+    with citations, reasoning chain, quality metrics and artifact ids), then `flowchart`,
+    `timelineEvents` and `progressSteps` as each finishes, and finally `done`.
+    A failure after the stream has started is sent as an `error` event.
+    """
+    stage_timer.set_label("mode", mode_label(request.mode))
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    try:
+        query_emb, packed, prompt = await retrieve_context(request)
+    except IndexNotReadyError as e:
+        raise index_unavailable(e)
+    except RetrievalOverloadedError as e:
+        print(f"Shedding query under retrieval backpressure: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        print(f"Error processing query: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    relevant_docs = packed.sources
+    session_id = request.session_id or f"session_{datetime.now().timestamp()}"
+
+    use_cache = open_response_cache(request, http_request, headers)
+    cache_sources = source_signature(relevant_docs)
+    cached = None
+    if use_cache:
+        with stage("cache"):
+            cached = await asyncio.to_thread(response_cache.lookup, request.mode, cache_sources, query_emb)
+        headers["X-Cache"] = "HIT" if cached is not None else "MISS"
+
+    async def events():
+        waiters: Dict[asyncio.Future, str] = {}
+        try:
+            if cached is not None:
+                result = dict(cached, session_id=session_id)
+                yield sse_event("sources", {key: result[key] for key in ("sources", "confidence", "context", "session_id")})
+                yield sse_event("token", {"text": result["answer"]})
+                llm_answer = result["answer"]
+            else:
+                with stage("confidence"):
+                    confidence = calculate_confidence(relevant_docs, request.query)
+                result = {
+                    "confidence": confidence,
+                    "sources": process_sources(relevant_docs),
+                    "session_id": session_id,
+                    "context": packed.summary(),
+                }
+                yield sse_event("sources", result)
+
+                parts = []
+                started = time.perf_counter()
+                async for delta in stream_llm(prompt):
+                    if not parts:
+                        stage_timer.record("llm_first_token", (time.perf_counter() - started) * 1000.0)
+                    parts.append(delta)
+                    yield sse_event("token", {"text": delta})
+                stage_timer.record("llm", (time.perf_counter() - started) * 1000.0)
+                llm_answer = "".join(parts).strip()
+                result.update(flowchart=None, timelineEvents=[], progressSteps=[])
+
+            details = answer_details(request, relevant_docs, llm_answer)
+            jobs = visualization_jobs(request.mode, llm_answer)
+            result.update(details, artifacts=jobs)
+            yield sse_event("answer", dict(details, artifacts=jobs))
+
+            # Push each visualization as soon as its job finishes
+            waiters = {asyncio.ensure_future(artifact_store.result(artifact)): field for field, artifact in jobs.items()}
+            pending = set(waiters)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for waiter in done:
+                    field = waiters[waiter]
+                    result[field] = waiter.result()
+                    yield sse_event(field, {field: result[field]})
+
+            if use_cache and cached is None:
+                await asyncio.to_thread(response_cache.store, request.mode, cache_sources, query_emb, result)
+            # Stages run while streaming cannot go in the Server-Timing header
+            yield sse_event("done", {"session_id": session_id, "timings": stage_timer.timings()})
+        except Exception as e:
+            print(f"Error streaming query: {e}")
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            # Only the waits are cancelled; the jobs finish in the artifact store for later views
+            for waiter in waiters:
+                waiter.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+@app.get("/api/artifacts/{artifact_id}")
+async def get_artifact(artifact_id: str, wait: float = 0):
+    """
+    A deferred visualization by the id returned in `artifacts`: 200 once ready
+    (or failed), 202 while it is still being generated. `wait` long-polls up
+    to that many seconds (capped at ARTIFACT_MAX_WAIT) for a pending one.
+    """
+    artifact = artifact_store.get(artifact_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Artifact not found or expired")
+    if artifact["status"] == "pending" and wait > 0:
+        try:
+            await asyncio.wait_for(artifact_store.result(artifact_id), timeout=min(wait, ARTIFACT_MAX_WAIT))
+        except Exception:
+            pass
+        artifact = artifact_store.get(artifact_id) or artifact
+    return JSONResponse(status_code=202 if artifact["status"] == "pending" else 200, content=artifact)
+
+@app.get("/api/stats")
+async def get_stats():
+    return {
+        "retrieval_executor": retrieval_executor.stats(),
+        "embedding_models": model_registry.stats(),
+        "response_cache": response_cache.stats(),
+        "llm_cache": completion_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "llm_gateway": gateway.stats(),
+        "artifacts": artifact_store.stats(),
+        "visualizations": dict(visualizations.stats, mode=VISUALIZATION_MODE),
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of request, stage, LLM, cache and queue metrics."""
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/api/modes")
 async def get_modes():
     return {
@@ -194,24 +561,36 @@ async def get_modes():
 
 @app.post("/api/rewrite-strategy")
 async def rewrite_strategy(request: RewriteRequest):
+    stage_timer.set_label("mode", "rewrite_strategy")
     try:
         prompt = get_strategy_rewrite_prompt(request.strategy, request.context)
-        rewritten_strategy = await call_llm(prompt)
+        with stage("llm"):
+            rewritten_strategy = await call_llm(prompt)
         return {"rewritten_strategy": rewritten_strategy}
+    except LLMUnavailableError as e:
+        raise llm_unavailable(e)
     except Exception as e:
         print(f"Error rewriting strategy: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/legal-breakdown")
 async def legal_breakdown(request: LegalBreakdownRequest):
+    stage_timer.set_label("mode", "legal_breakdown")
     try:
-        case_data = arbitration_rag.get_case_by_name(request.case_name)
+        arbitration_rag = await cases_index.wait(INDEX_READY_TIMEOUT)
+        with stage("lookup"):
+            case_data = arbitration_rag.get_case_by_name(request.case_name)
         if not case_data:
             raise HTTPException(status_code=404, detail="Case not found")
 
-        prompt = get_legal_breakdown_prompt(case_data['full_text'])
-        breakdown = await generate_structured_data(prompt, is_json=True)
+        prompt = get_legal_breakdown_prompt(truncate_to_tokens(case_data['full_text'], CONTEXT_TOKEN_BUDGET))
+        with stage("structured"):
+            breakdown = await generate_structured_data(prompt, is_json=True)
         return breakdown
+    except IndexNotReadyError as e:
+        raise index_unavailable(e)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error generating legal breakdown: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -244,7 +623,8 @@ async def get_sample_questions(mode: str):
 def calculate_confidence(sources: List[Dict[str, Any]], query: str) -> float:
     """
     Calculate a confidence score based on the relevance and number of sources.
-    The score from FAISS is a distance (lower is better), so we invert it.
+    Source scores are calibrated cosine similarities in [0, 1] (see scoring.py),
+    on the same scale for CPR rules and arbitration cases.
     """
     if not sources:
         return 0.3  # Low confidence if no sources are found
@@ -256,8 +636,7 @@ def calculate_confidence(sources: List[Dict[str, Any]], query: str) -> float:
     # Normalize source count score (maxes out at 5 sources)
     source_count_score = min(len(sources) / 5.0, 1.0)
 
-    # Average relevance score from sources (score is 1 - distance)
-    # This assumes 'score' is available and is a similarity measure [0, 1]
+    # Average relevance score from sources
     relevance_scores = [s.get('score', 0.0) for s in sources]
     average_relevance = sum(relevance_scores) / len(relevance_scores) if relevance_scores else 0.0
 
@@ -0,0 +1,205 @@
+import bisect
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import stage_timer
+
+METRICS_PREFIX = "justicegps"
+# Upper bounds (seconds) of the request and stage latency histogram buckets
+LATENCY_BUCKETS = tuple(
+    float(bound) for bound in os.getenv("METRICS_LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60").split(",")
+)
+
+# (label values, value) pairs of one metric family
+Samples = List[Tuple[Dict[str, str], float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_sample(name: str, labels: Dict[str, str], value: float) -> str:
+    if labels:
+        name += "{" + ",".join(f'{key}="{_escape(str(val))}"' for key, val in labels.items()) + "}"
+    if isinstance(value, float):
+        text = "+Inf" if value == float("inf") else "-Inf" if value == float("-inf") else "NaN" if value != value else repr(value)
+        return f"{name} {text}"
+    return f"{name} {value}"
+
+
+def _format_family(name: str, kind: str, help_text: str, lines: Iterable[str]) -> List[str]:
+    help_text = help_text.replace("\\", "\\\\").replace("\n", "\\n")
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", *lines]
+
+
+class Metric:
+    """A metric family; values are keyed by the tuple of label values, in `label_names` order."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _labels(self, values: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.label_names, values))
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        super().__init__(name, help_text, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return _format_family(self.name, self.kind, self.help, (_format_sample(self.name, self._labels(k), v) for k, v in values))
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *label_values: str, value: float) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+    def dec(self, *label_values: str, amount: float = 1.0) -> None:
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket (the last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = [(k, list(s[0]), s[1], s[2]) for k, s in self._series.items()]
+        lines = []
+        for label_values, counts, total, count in series:
+            labels = self._labels(label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(_format_sample(f"{self.name}_bucket", dict(labels, le=le), cumulative))
+            lines.append(_format_sample(f"{self.name}_sum", labels, total))
+            lines.append(_format_sample(f"{self.name}_count", labels, count))
+        return _format_family(self.name, self.kind, self.help, lines)
+
+
+class Registry:
+    """
+    Metrics in the Prometheus text exposition format (version 0.0.4).
+
+    Hot-path metrics (latency histograms, request counters) are updated as
+    requests run. Everything else is read at scrape time by collectors from
+    the counters each component already keeps for /api/stats, so it costs
+    nothing between scrapes.
+    """
+
+    def __init__(self, prefix: str = METRICS_PREFIX):
+        self.prefix = prefix
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Samples]]]] = []
+
+    def _add(self, metric: Metric) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(f"{self.prefix}_{name}", help_text, label_names))
+
+    def gauge(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(f"{self.prefix}_{name}", help_text, label_names))
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(f"{self.prefix}_{name}", help_text, label_names, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Samples]]]) -> None:
+        """Register a callable yielding (name, kind, help, samples) families at scrape time."""
+        self._collectors.append(collector)
+
+    def register_stats(
+        self,
+        subsystem: str,
+        stats: Callable[[], Dict[str, Any]],
+        counters: Sequence[str] = (),
+        gauges: Sequence[str] = (),
+        label: Optional[str] = None,
+    ) -> None:
+        """
+        Export fields of a component's stats() dict: `counters` as <subsystem>_<field>_total,
+        `gauges` as <subsystem>_<field>. With `label`, stats() returns {label value: stats dict}.
+        """
+        def collect():
+            snapshot = stats()
+            rows = snapshot.items() if label else [(None, snapshot)]
+            for fields, kind, suffix in ((counters, "counter", "_total"), (gauges, "gauge", "")):
+                for field in fields:
+                    samples = [
+                        ({label: key} if label else {}, float(row[field]))
+                        for key, row in rows
+                        if isinstance(row.get(field), (int, float))
+                    ]
+                    if samples:
+                        yield f"{self.prefix}_{subsystem}_{field}{suffix}", kind, f"{subsystem} {field.replace('_', ' ')}", samples
+
+        self.add_collector(collect)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.extend(_format_family(name, kind, help_text, (_format_sample(name, labels, value) for labels, value in samples)))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter("http_requests_total", "HTTP requests served", ("method", "route", "status"))
+http_request_seconds = registry.histogram("http_request_duration_seconds", "Time to the response headers of HTTP requests", ("method", "route"))
+http_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests being served")
+stage_seconds = registry.histogram(
+    "stage_duration_seconds", "Time spent per request in each pipeline stage", ("mode", "stage")
+)
+
+
+def observe_stage(stage: str, ms: float, labels: Dict[str, str]) -> None:
+    stage_seconds.observe(ms / 1000.0, labels.get("mode", "none"), stage)
+
+
+stage_timer.add_observer(observe_stage)
@@ -0,0 +1,104 @@
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from sentence_transformers import SentenceTransformer
+
+from batching_encoder import BatchingEncoder
+
+DEFAULT_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+DEFAULT_DEVICE = os.getenv("EMBEDDING_DEVICE") or None
+DEFAULT_QUANTIZATION = os.getenv("EMBEDDING_QUANTIZATION") or None
+
+SUPPORTED_QUANTIZATIONS = (None, "fp16", "int8")
+
+ModelKey = Tuple[str, Optional[str], Optional[str]]
+
+_lock = threading.Lock()
+_key_locks: Dict[ModelKey, threading.Lock] = {}
+_models: Dict[ModelKey, SentenceTransformer] = {}
+_encoders: Dict[ModelKey, BatchingEncoder] = {}
+
+
+def _make_key(name: Optional[str], device: Optional[str], quantization: Optional[str]) -> ModelKey:
+    quantization = quantization or DEFAULT_QUANTIZATION
+    if quantization not in SUPPORTED_QUANTIZATIONS:
+        raise ValueError(f"Unsupported quantization: {quantization}")
+    return (name or DEFAULT_MODEL_NAME, device or DEFAULT_DEVICE, quantization)
+
+
+def _load(key: ModelKey) -> SentenceTransformer:
+    name, device, quantization = key
+    print(f"Loading embedding model {name} (device={device or 'auto'}, quantization={quantization or 'none'})...")
+    model = SentenceTransformer(name, device=device)
+    model.eval()
+    if quantization == "fp16":
+        model.half()
+    elif quantization == "int8":
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def get_model(
+    name: Optional[str] = None,
+    device: Optional[str] = None,
+    quantization: Optional[str] = None,
+) -> SentenceTransformer:
+    """Return the process-wide SentenceTransformer for (name, device, quantization), loading it once."""
+    key = _make_key(name, device, quantization)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    # One lock per key so loading one model never blocks lookups of another
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        model = _models.get(key)
+        if model is None:
+            model = _load(key)
+            _models[key] = model
+    return model
+
+
+def get_encoder(
+    name: Optional[str] = None,
+    device: Optional[str] = None,
+    quantization: Optional[str] = None,
+) -> BatchingEncoder:
+    """Return the shared micro-batching encoder wrapping the registry model for this key."""
+    key = _make_key(name, device, quantization)
+    encoder = _encoders.get(key)
+    if encoder is not None:
+        return encoder
+
+    model = get_model(*key)
+    with _lock:
+        encoder = _encoders.get(key)
+        if encoder is None:
+            encoder = BatchingEncoder(model)
+            _encoders[key] = encoder
+    return encoder
+
+
+def preload(
+    name: Optional[str] = None,
+    device: Optional[str] = None,
+    quantization: Optional[str] = None,
+) -> SentenceTransformer:
+    """
+    Load a model eagerly, e.g. in a gunicorn master before workers fork.
+
+    Forked workers then share the weight pages copy-on-write. Only load here:
+    running inference before the fork starts torch's thread pools, which do not
+    survive fork. The batching thread is started lazily in each worker.
+    """
+    return get_model(name, device, quantization)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "models": ["/".join(str(part) for part in key) for key in _models],
+        "encoders": {"/".join(str(part) for part in key): enc.stats() for key, enc in _encoders.items()},
+    }
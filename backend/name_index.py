@@ -0,0 +1,101 @@
+import bisect
+import re
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Minimum trigram similarity (Jaccard) for a fuzzy name match
+FUZZY_THRESHOLD = 0.3
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+_VERSUS_RE = re.compile(r"\b(?:vs?|versus)\b")
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, strip punctuation and unify "v." / "vs." / "versus", collapse whitespace."""
+    name = _PUNCT_RE.sub(" ", name.lower())
+    name = _VERSUS_RE.sub("v", name)
+    return _SPACE_RE.sub(" ", name).strip()
+
+
+def trigrams(text: str) -> List[str]:
+    padded = f"  {text} "
+    return sorted({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+class NameIndex:
+    """
+    Lookup of items (e.g. cases) by name without scanning the corpus.
+
+    `find` tries, in order: exact name, normalized name, normalized prefix,
+    substring containment (candidates from intersecting trigram postings, then
+    verified), and finally the best trigram-similarity match above
+    FUZZY_THRESHOLD. Ties resolve to the earliest item, as a scan would.
+    """
+
+    def __init__(self, names: Sequence[str], values: Sequence[int]):
+        self.values = list(values)
+        self.names = [normalize_name(name) for name in names]
+        self.exact: Dict[str, int] = {}
+        self.normalized: Dict[str, int] = {}
+        for i, name in enumerate(names):
+            self.exact.setdefault(name.lower(), i)
+            self.normalized.setdefault(self.names[i], i)
+        self.sorted_names = sorted((name, i) for i, name in enumerate(self.names))
+
+        postings: Dict[str, List[int]] = {}
+        for i, name in enumerate(self.names):
+            for gram in trigrams(name):
+                postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.asarray(items, dtype=np.int32) for gram, items in postings.items()}
+        self.gram_counts = np.asarray([len(trigrams(name)) for name in self.names], dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def find(self, query: str) -> Optional[int]:
+        i = self._find(query)
+        return None if i is None else self.values[i]
+
+    def _find(self, query: str) -> Optional[int]:
+        if query.lower() in self.exact:
+            return self.exact[query.lower()]
+        normalized = normalize_name(query)
+        if not normalized:
+            return None
+        if normalized in self.normalized:
+            return self.normalized[normalized]
+
+        # Prefix: first entry >= query in sorted order; earliest item among matches
+        start = bisect.bisect_left(self.sorted_names, (normalized, -1))
+        prefixed = []
+        for name, i in self.sorted_names[start:start + 64]:
+            if not name.startswith(normalized):
+                break
+            prefixed.append(i)
+        if prefixed:
+            return min(prefixed)
+
+        # Substring: a name containing the query contains all its inner trigrams
+        inner = sorted({normalized[i:i + 3] for i in range(len(normalized) - 2)})
+        if inner and all(gram in self.postings for gram in inner):
+            lists = sorted((self.postings[gram] for gram in inner), key=len)
+            candidates = lists[0]
+            for items in lists[1:]:
+                candidates = np.intersect1d(candidates, items, assume_unique=True)
+                if not len(candidates):
+                    break
+            for i in candidates:
+                if normalized in self.names[i]:
+                    return int(i)
+
+        # Fuzzy: highest trigram Jaccard similarity
+        grams = [gram for gram in trigrams(normalized) if gram in self.postings]
+        if not grams:
+            return None
+        hits = np.concatenate([self.postings[gram] for gram in grams])
+        items, shared = np.unique(hits, return_counts=True)
+        similarity = shared / (self.gram_counts[items] + len(trigrams(normalized)) - shared)
+        best = int(np.argmax(similarity))
+        return int(items[best]) if similarity[best] >= FUZZY_THRESHOLD else None
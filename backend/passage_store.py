@@ -0,0 +1,107 @@
+import os
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from index_bundle import StringTable, rows_for_ids
+
+# Passage size and overlap (characters) when chunking decisions and opinions;
+# ~1000 characters is about what MiniLM sees before truncating at 256 tokens
+CASE_PASSAGE_CHARS = int(os.getenv("CASE_PASSAGE_CHARS", 1000))
+CASE_PASSAGE_OVERLAP = int(os.getenv("CASE_PASSAGE_OVERLAP", 200))
+
+
+def chunk_text(text: str, size: int = CASE_PASSAGE_CHARS, overlap: int = CASE_PASSAGE_OVERLAP) -> List[Tuple[int, str]]:
+    """
+    Split text into overlapping (offset, passage) windows of about `size` characters.
+
+    Windows end on whitespace where possible, and each one starts `overlap`
+    characters before the previous one ended, so a sentence cut at one boundary
+    appears whole in one of the two passages.
+    """
+    if not text:
+        return []
+    overlap = min(overlap, size // 2)
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            # Back off to the last whitespace in the second half of the window
+            window_break = max(text.rfind(" ", start + size // 2, end), text.rfind("\n", start + size // 2, end))
+            if window_break > start:
+                end = window_break
+        chunks.append((start, text[start:end]))
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+class PassageStore:
+    """
+    Case-level view over a bundle whose records are passages.
+
+    Each case file produces a contiguous run of records: a head record holding
+    the case metadata and a summary card, followed by its passages, each tagged
+    with `case_offset` (position within the run), decision/opinion numbers and
+    character offset. Only the head row of each case is held in memory (one
+    int64 per case); passages stay in the memory-mapped StringTable and are
+    decoded on demand, so memory does not grow with the passage count.
+    """
+
+    def __init__(self, records: StringTable, ids: np.ndarray, manifest: Dict[str, Any]):
+        self.records = records
+        first_ids = [entry["ids"][0] for entry in manifest.get("files", {}).values() if entry["ids"][1] > entry["ids"][0]]
+        heads = rows_for_ids(ids, np.asarray(first_ids, dtype=np.int64))
+        self.heads = np.sort(heads[heads >= 0])
+
+    def __len__(self) -> int:
+        return len(self.heads)
+
+    def __bool__(self) -> bool:
+        return len(self.heads) > 0
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        return self.case(int(self.heads[i]))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for head in self.heads:
+            yield self.case(int(head))
+
+    @property
+    def passage_count(self) -> int:
+        return len(self.records)
+
+    def case(self, head_row: int, with_full_text: bool = False) -> Dict[str, Any]:
+        """Case metadata from its head record, optionally with the full text rebuilt from its passages."""
+        case = self.records[head_row]
+        if with_full_text:
+            case['full_text'] = self.full_text(head_row, case)
+        return case
+
+    def passages(self, head_row: int, head: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        head = head or self.records[head_row]
+        for row in range(head_row + 1, head_row + head['run_length']):
+            yield self.records[row]
+
+    def full_text(self, head_row: int, head: Optional[Dict[str, Any]] = None) -> str:
+        """Reassemble the case text in extract_full_text's layout, merging overlapping passages."""
+        head = head or self.records[head_row]
+        parts = [head['preamble']]
+        content = None
+        for passage in self.passages(head_row, head):
+            if passage['offset'] == 0:
+                if content is not None:
+                    parts.append(f"Content: {content}\n\n")
+                parts.append(passage['section'])
+                content = passage['text']
+            else:
+                content += passage['text'][len(content) - passage['offset']:]
+        if content is not None:
+            parts.append(f"Content: {content}\n\n")
+        return "".join(parts)
+
+    def head_rows(self, rows: np.ndarray, records: List[Dict[str, Any]]) -> np.ndarray:
+        """Head row of the case each (row, record) hit belongs to."""
+        return rows - np.fromiter((record['case_offset'] for record in records), dtype=np.int64, count=len(records))
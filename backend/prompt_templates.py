@@ -169,6 +169,32 @@ Based on the following legal explanation, create a progress tracker with actiona
 ]
 """
 
+def get_visualizations_prompt(legal_text: str) -> str:
+    """Generate a prompt for the flowchart, timeline and progress tracker of a legal text in one JSON document."""
+    return f"""
+Based on the following legal explanation, produce a flowchart, a timeline and a progress tracker.
+
+**Legal Text:**
+{legal_text}
+
+**Instructions:**
+1. `flowchart` (string): Mermaid `graph TD` code visualizing the process, starting with `graph TD`. Use concise node descriptions, diamond shapes for decision points, and simple labels without parentheses `()` or other special characters (e.g. "CPR 7-5" instead of "CPR 7.5(1)").
+2. `timeline` (array): key events with dates or deadlines, assuming the process starts today. Each object has `id` (string), `title` (string), `date` (string, "YYYY-MM-DD"), `description` (string), `status` ('completed', 'pending', or 'overdue'), and `daysFromStart` (number).
+3. `progress` (array): actionable steps. Each object has `id` (string), `title` (string), `description` (string), `status` ('not-started', 'in-progress', 'completed', 'blocked'), and `priority` ('high', 'medium', 'low'), and optionally `deadline` (string, "YYYY-MM-DD"), `ruleCitation` (string) and `formLink` (string).
+4. The output should be ONLY one raw JSON object, starting with `{{` and ending with `}}`.
+
+**Example JSON structure:**
+{{
+  "flowchart": "graph TD\\n    A[Start] --> B{{Decision}};\\n    B -->|Yes| C[End];",
+  "timeline": [
+    {{"id": "1", "title": "Event 1", "date": "2024-01-01", "description": "Description of event 1.", "status": "completed", "daysFromStart": 0}}
+  ],
+  "progress": [
+    {{"id": "1", "title": "Step 1", "description": "Description of step 1.", "status": "not-started", "priority": "high", "ruleCitation": "CPR 7.5"}}
+  ]
+}}
+"""
+
 async def refine_answer(initial_answer: str, query: str, mode: str) -> str:
     """Self-refinement loop to improve answer quality"""
     refinement_prompt = f"""You are a legal expert reviewing and refining an AI-generated response.
@@ -1,106 +1,127 @@
 import os
 import json
+import time
 import re
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
-import pickle
 from prompt_templates import get_case_support_prompt
 from utils import generate_structured_data
+from retrieval_executor import retrieval_executor
+from single_flight import SingleFlight
+import stage_timer
+from model_registry import get_model, get_encoder, DEFAULT_MODEL_NAME
+from index_bundle import IndexBundle, BundleMismatchError, corpus_fingerprint, rows_for_ids
+from corpus_index import sync_bundle, ReindexReport
+from index_factory import IndexConfig, set_search_params
+from scoring import calibrate_scores
+from passage_store import PassageStore, chunk_text
+from lexical_index import HYBRID_RETRIEVAL, BM25Index, bundle_stamp, hybrid_rank
+from name_index import NameIndex
 import asyncio
 
+# Processes used to parse case JSON files during (re-)indexing
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+# Passages retrieved per requested case before pooling hits back to cases,
+# and how passage scores pool into a case ranking ("max" or "sum")
+CASE_PASSAGE_FANOUT = int(os.getenv("CASE_PASSAGE_FANOUT", 8))
+CASE_POOLING = os.getenv("CASE_POOLING", "max")
+# Concurrent identical case searches share one executor job
+case_flights = SingleFlight("case_retrieval")
+
 class ArbitrationRAGSystem:
-    def __init__(self, cases_dir: str = "jus_mundi_hackathon_data/cases", index_file: str = "cases_index.faiss"):
+    def __init__(
+        self,
+        cases_dir: str = "jus_mundi_hackathon_data/cases",
+        index_dir: str = "cases_index",
+        model_name: Optional[str] = None,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
+        auto_load: bool = True,
+    ):
         self.cases_dir = Path(cases_dir)
-        self.index_file = Path(index_file)
+        self.index_dir = Path(index_dir)
+        self.model_name = model_name or DEFAULT_MODEL_NAME
         self.cases_data = []
         self.embeddings = None
+        self.ids = None
         self.index = None
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+        self.lexical = None
+        self.case_names = NameIndex([], [])
+        # Index type/parameters from CASES_INDEX_* (see index_factory.py)
+        self.index_config = IndexConfig.from_env("CASES", metric="ip")
+        self.report_progress = progress_callback or (lambda stage, done=0, total=0: None)
+        # Model and batching encoder are shared process-wide via the registry
+        self.report_progress("loading model")
+        self.model = get_model(model_name)
+        self.encoder = get_encoder(model_name)
         
-        # Load or build index
-        if self.index_file.exists() and Path("cases_data_new.pkl").exists():
-            self.load_index()
-        else:
-            # Clean up old index files if they exist
-            if self.index_file.exists():
-                self.index_file.unlink()
-            if Path("cases_index.pkl").exists():
-                Path("cases_index.pkl").unlink()
-            if Path("cases_data_new.pkl").exists():
-                Path("cases_data_new.pkl").unlink()
-            self.build_index_from_files()
+        if auto_load:
+            self.load_or_update_index()
+
+    def corpus_files(self) -> List[Path]:
+        if not self.cases_dir.is_dir():
+            return []
+        return sorted(self.cases_dir.glob('*.json'))
+
+    def load_or_update_index(self):
+        """Load the index bundle, re-indexing changed case files if it is missing or stale"""
+        corpus_hash = corpus_fingerprint(self.corpus_files())
+        try:
+            self.report_progress("loading index")
+            self.load_index(corpus_hash)
+        except BundleMismatchError as e:
+            print(f"Updating cases index: {e}")
+            report = self.reindex(corpus_hash)
+            print(f"Cases index {report.summary()}")
     
-    def load_index(self):
-        """Load existing FAISS index and case data"""
+    def load_index(self, corpus_hash: Optional[str] = None):
+        """Memory-map the index bundle; raises BundleMismatchError if missing or stale"""
         print("Loading existing cases index...")
-        
-        # Load case data
-        with open("cases_data_new.pkl", "rb") as f:
-            self.cases_data = pickle.load(f)
-        
-        # Load FAISS index
-        self.index = faiss.read_index(str(self.index_file))
-        
-        # Load embeddings
-        self.embeddings = np.array([case['embedding'] for case in self.cases_data])
-        
-        print(f"Loaded {len(self.cases_data)} cases from index")
+        self.use_bundle(IndexBundle.load(
+            self.index_dir, model_name=self.model_name, corpus_hash=corpus_hash, index_spec=self.index_config.spec
+        ))
+        print(f"Loaded {len(self.cases_data)} cases ({self.cases_data.passage_count} passages) from index")
+
+    def use_bundle(self, bundle: IndexBundle):
+        set_search_params(bundle.index, self.index_config)
+        self.index = bundle.index
+        self.embeddings = bundle.embeddings
+        self.ids = bundle.ids
+        self.cases_data = PassageStore(bundle.records, bundle.ids, bundle.manifest)
+        # Case name -> head row, for legal-breakdown lookups
+        self.case_names = NameIndex([case['case_name'] for case in self.cases_data], self.cases_data.heads.tolist())
+        if HYBRID_RETRIEVAL:
+            self.report_progress("loading lexical index")
+            self.lexical = BM25Index.load_or_build(
+                bundle.path, bundle_stamp(bundle), lambda: (passage_embedding_text(record) for record in bundle.records)
+            )
     
-    def build_index_from_files(self):
-        """Build FAISS index from a directory of JSON case files"""
-        print(f"Building cases index from directory: {self.cases_dir}...")
-        
-        if not self.cases_dir.exists() or not self.cases_dir.is_dir():
+    def reindex(self, corpus_hash: Optional[str] = None, full: bool = False) -> ReindexReport:
+        """Re-parse and re-embed only added/changed case files and update the index bundle in place"""
+        if not self.cases_dir.is_dir():
             print(f"Cases directory not found at {self.cases_dir}")
-            self.cases_data = []
-            return
+        print(f"Indexing cases from directory: {self.cases_dir}...")
+        files = self.corpus_files()
+        bundle, report = sync_bundle(
+            self.index_dir,
+            files,
+            parse_file=parse_case_file,
+            text_of=passage_embedding_text,
+            encoder=self.encoder,
+            model_name=self.model_name,
+            corpus_hash=corpus_hash or corpus_fingerprint(files),
+            index_config=self.index_config,
+            full=full,
+            workers=INGEST_WORKERS,
+            progress=self.report_progress,
+        )
+        self.use_bundle(bundle)
+        print(f"Index saved with {len(self.cases_data)} cases ({self.cases_data.passage_count} passages)")
+        return report
 
-        raw_cases = []
-        for json_file in self.cases_dir.glob('*.json'):
-            try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    raw_cases.append(json.load(f))
-            except Exception as e:
-                print(f"Error reading or parsing {json_file}: {e}")
-
-        print(f"Found {len(raw_cases)} cases in the directory.")
-
-        for case_data in raw_cases:
-            case_info = self.extract_case_info(case_data)
-            if case_info:
-                self.cases_data.append(case_info)
-                    
-        print(f"Successfully processed {len(self.cases_data)} cases")
-        
-        if not self.cases_data:
-            print("No cases loaded, creating empty index")
-            return
-        
-        # Create embeddings
-        texts = [case['markdown_text'] for case in self.cases_data]
-        embeddings = self.model.encode(texts, show_progress_bar=True)
-        
-        # Store embeddings in case data
-        for i, case in enumerate(self.cases_data):
-            case['embedding'] = embeddings[i]
-        
-        # Create FAISS index
-        dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-        self.index.add(embeddings.astype('float32'))
-        
-        # Save index and data
-        faiss.write_index(self.index, str(self.index_file))
-        # Use a new pickle file to avoid conflicts with old data structure
-        with open("cases_data_new.pkl", "wb") as f:
-            pickle.dump(self.cases_data, f)
-        
-        print(f"Index built and saved with {len(self.cases_data)} cases")
-    
-    def extract_case_info(self, case_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    @classmethod
+    def extract_case_info(cls, case_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Extract relevant information from case JSON data"""
         try:
             # Extract basic case information
@@ -110,44 +131,75 @@ class ArbitrationRAGSystem:
             institution = case_data.get('Institution', 'Unknown Institution')
             
             # Determine if case is supportive or adverse based on status
-            supportive = self.determine_supportive_status(status)
+            supportive = cls.determine_supportive_status(status)
             
             # Extract full text content from decisions
-            full_text = self.extract_full_text(case_data)
+            full_text = cls.extract_full_text(case_data)
             
             # Create summary from first 200 characters
             summary = full_text[:200] + "..." if len(full_text) > 200 else full_text
             
-            # Create markdown text for search
-            markdown_text = f"""
-# {case_name}
-
-**Citation:** {citation}
-**Status:** {status}
-**Institution:** {institution}
-
-## Summary
-{summary}
-
-## Full Content
-{full_text}
-"""
-            
             return {
                 'case_name': case_name,
                 'citation': citation,
                 'summary': summary,
                 'supportive': supportive,
-                'markdown_text': markdown_text,
                 'full_text': full_text,
                 'status': status,
-                'institution': institution,
-                'embedding': None  # Will be set later
+                'institution': institution
             }
             
         except Exception as e:
             print(f"Error extracting case info: {e}")
             return None
+
+    @classmethod
+    def extract_case_passages(cls, case_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Split a case into a head record (metadata and summary card) followed by
+        overlapping passages of each decision and opinion, in document order.
+        """
+        case_info = cls.extract_case_info(case_data)
+        if not case_info:
+            return []
+        case_name = case_info['case_name']
+        head = {
+            'case_offset': 0,
+            'case_name': case_name,
+            'citation': case_info['citation'],
+            'status': case_info['status'],
+            'institution': case_info['institution'],
+            'supportive': case_info['supportive'],
+            'summary': case_info['summary'],
+            'preamble': case_info['full_text'][:case_info['full_text'].find('\n\n') + 2],
+            'text': f"{case_name}\nCitation: {case_info['citation']}\nStatus: {case_info['status']}\n"
+                    f"Institution: {case_info['institution']}\n\n{case_info['summary']}",
+        }
+        records = [head]
+
+        # Sections mirror extract_full_text: each decision, then its opinions
+        sections = []
+        for d, decision in enumerate(case_data.get('Decisions', [])):
+            sections.append((d, -1, decision))
+            for o, opinion in enumerate(decision.get('Opinions', [])):
+                sections.append((d, o, opinion))
+        for d, o, part in sections:
+            label = 'Decision' if o < 0 else 'Opinion'
+            section = f"{label}: {part.get('Title', '')}\nType: {part.get('Type', '')}\nDate: {part.get('Date', '')}\n"
+            for offset, text in chunk_text(part.get('Content', '') or ''):
+                passage = {
+                    'case_offset': len(records),
+                    'case_name': case_name,
+                    'decision': d,
+                    'opinion': o,
+                    'offset': offset,
+                    'text': text,
+                }
+                if offset == 0:
+                    passage['section'] = section
+                records.append(passage)
+        head['run_length'] = len(records)
+        return records
     
     async def get_case_support_analysis(self, case_text: str, user_query: str) -> Dict[str, Any]:
         """
@@ -172,7 +224,8 @@ class ArbitrationRAGSystem:
             print(f"Error getting case support analysis from LLM: {e}")
             return {"classification": "Unknown", "justification": "Error during AI analysis."}
 
-    def determine_supportive_status(self, status: str) -> bool:
+    @staticmethod
+    def determine_supportive_status(status: str) -> bool:
         """
         [DEPRECATED] Determine if case is supportive or adverse based on status.
         This will be replaced by LLM-based analysis.
@@ -202,8 +255,9 @@ class ArbitrationRAGSystem:
         # Default to neutral if unclear
         return None
     
-    def extract_full_text(self, case_data: Dict[str, Any]) -> str:
-        """Extract full text content from case decisions with aggressive token limiting"""
+    @staticmethod
+    def extract_full_text(case_data: Dict[str, Any]) -> str:
+        """Extract full text content from case decisions (prompt size is handled by the context packer)"""
         full_text = ""
         
         # Add case title and basic info
@@ -212,65 +266,78 @@ class ArbitrationRAGSystem:
         full_text += f"Status: {case_data.get('Status', '')}\n"
         full_text += f"Institution: {case_data.get('Institution', '')}\n\n"
         
-        # Extract content from decisions with very aggressive length limiting
+        # Extract content from decisions
         decisions = case_data.get('Decisions', [])
         for decision in decisions:
             full_text += f"Decision: {decision.get('Title', '')}\n"
             full_text += f"Type: {decision.get('Type', '')}\n"
             full_text += f"Date: {decision.get('Date', '')}\n"
+            full_text += f"Content: {decision.get('Content', '')}\n\n"
             
-            # Very aggressive limit on decision content
-            decision_content = decision.get('Content', '')
-            if len(decision_content) > 1000:  # Limit to ~1000 characters per decision
-                decision_content = decision_content[:1000] + "... [Content truncated]"
-            full_text += f"Content: {decision_content}\n\n"
-            
-            # Extract content from opinions with very aggressive limiting
+            # Extract content from opinions
             opinions = decision.get('Opinions', [])
             for opinion in opinions:
                 full_text += f"Opinion: {opinion.get('Title', '')}\n"
                 full_text += f"Type: {opinion.get('Type', '')}\n"
                 full_text += f"Date: {opinion.get('Date', '')}\n"
-                
-                # Very aggressive limit on opinion content
-                opinion_content = opinion.get('Content', '')
-                if len(opinion_content) > 500:  # Limit to ~500 characters per opinion
-                    opinion_content = opinion_content[:500] + "... [Content truncated]"
-                full_text += f"Content: {opinion_content}\n\n"
-        
-        # Very aggressive final safety check - limit total length
-        if len(full_text) > 3000:  # Limit total case text to ~3000 characters
-            full_text = full_text[:3000] + "... [Case content truncated]"
+                full_text += f"Content: {opinion.get('Content', '')}\n\n"
         
         return full_text
     
-    async def get_relevant_cases(self, query: str, k: int = 2) -> List[Dict[str, Any]]:
-        """Get relevant cases for a query without LLM analysis to prevent token overflow"""
-        if not self.cases_data or not self.index:
+    async def get_relevant_cases(self, query: str, k: int = 10, query_emb: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """Get candidate cases for a query without LLM analysis; the context packer fits them to the prompt"""
+        if not self.cases_data or self.index is None:
+            return []
+        if query_emb is None:
+            query_emb = await self.encoder.encode_async(query)
+        # Identical concurrent queries share one search; each caller gets its own result dicts
+        results = await case_flights.do(
+            (id(self), query, k), lambda: retrieval_executor.run(self._search_cases, query, k, query_emb)
+        )
+        return [dict(result) for result in results]
+
+    def _search_cases(self, query: str, k: int = 10, query_emb: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """Search the index for a query (blocking; run off the event loop)"""
+        if not self.cases_data or self.index is None:
             return []
         
-        # Very aggressive limit to prevent token overflow
-        k = min(k, 2)  # Maximum 2 cases to stay within token limits
+        if query_emb is None:
+            query_emb = self.encoder.encode(query)
+        n_passages = min(k * CASE_PASSAGE_FANOUT, self.index.ntotal)
+        similarities, hit_ids = self.index.search(query_emb.reshape(1, -1), n_passages)
         
-        query_embedding = self.model.encode([query])
-        distances, indices = self.index.search(query_embedding.astype('float32'), k)
+        # Fuse dense and BM25 passage rankings, then pool passages back to cases:
+        # rank by max (or sum) passage ranking score, report the calibrated
+        # cosine similarity of each case's best passage
+        rows, rank_scores = hybrid_rank(rows_for_ids(self.ids, hit_ids[0]), similarities[0], self.lexical, query, n_passages)
+        similarities = np.asarray(self.embeddings[rows]) @ query_emb
+        passages = [self.cases_data.records[row] for row in rows]
+        heads, owner = np.unique(self.cases_data.head_rows(rows, passages), return_inverse=True)
+        best = np.full(len(heads), -np.inf, dtype=np.float32)
+        np.maximum.at(best, owner, similarities)
+        pooled = np.full(len(heads), -np.inf if CASE_POOLING != "sum" else 0.0)
+        (np.add if CASE_POOLING == "sum" else np.maximum).at(pooled, owner, rank_scores)
+        order = np.argsort(-pooled, kind="stable")[:k]
         
         # Convert numpy arrays to Python lists to avoid serialization issues
-        distances = distances.tolist()
-        indices = indices.tolist()
+        scores = calibrate_scores(best[order]).tolist()
+        indices = [heads[order].tolist()]
+        matched = []
+        for case_index in order:
+            members = np.flatnonzero(owner == case_index)
+            matched.append([passages[j] for j in members[np.argsort(rows[members])]])
         
+        excerpt_started = time.perf_counter()
         results = []
 
-        # Gather cases without LLM analysis to prevent token overflow
+        # Gather cases without per-case LLM analysis
         for i, idx in enumerate(indices[0]):
             if idx != -1:
-                case = self.cases_data[idx].copy()
-                case.pop('embedding', None)
-                
-                # Normalize the score
-                max_possible_score = float(np.dot(query_embedding[0], query_embedding[0]))
-                raw_score = float(distances[0][i])
-                case['score'] = min(1.0, raw_score / max_possible_score) if max_possible_score > 0 else 0.0
+                case = self.cases_data.case(idx)
+                case['score'] = scores[i]
+                # The matched passages, in document order, stand in for the case text
+                case['matched_passages'] = len(matched[i])
+                case['full_text'] = "\n\n".join(passage['text'] for passage in matched[i])
                 
                 case['excerpt'] = self.extract_excerpt(case['full_text'], query)
                 
@@ -299,6 +366,7 @@ class ArbitrationRAGSystem:
                 }
                 
                 results.append(case)
+        stage_timer.record("excerpt", (time.perf_counter() - excerpt_started) * 1000.0)
 
         return results
 
@@ -311,15 +379,33 @@ class ArbitrationRAGSystem:
         return excerpt
     
     def get_case_by_name(self, case_name: str) -> Optional[Dict[str, Any]]:
-        """Get case by name"""
-        for case in self.cases_data:
-            if case_name.lower() in case['case_name'].lower():
-                return case
-        return None
+        """Get case by exact, normalized, prefix, substring or fuzzy name match, with its full text"""
+        head = self.case_names.find(case_name)
+        if head is None:
+            return None
+        return self.cases_data.case(head, with_full_text=True)
     
     def search_cases(self, query: str, k: int = 10) -> List[Dict[str, Any]]:
         """Search cases with more detailed results"""
-        return self.get_relevant_cases(query, k)
+        return self._search_cases(query, k)
 
     def get_all_cases(self):
-        return self.cases_data 
\ No newline at end of file
+        return self.cases_data 
+
+
+def parse_case_file(json_file: Path) -> List[Dict[str, Any]]:
+    """Read one Jus Mundi case JSON file into its head and passage records (module-level so the ingestion pool can pickle it)"""
+    try:
+        with open(json_file, 'r', encoding='utf-8') as f:
+            case_data = json.load(f)
+    except Exception as e:
+        print(f"Error reading or parsing {json_file}: {e}")
+        return []
+    return ArbitrationRAGSystem.extract_case_passages(case_data)
+
+
+def passage_embedding_text(record: Dict[str, Any]) -> str:
+    """Text embedded for a head or passage record; passages carry their case name (and section header, if first)"""
+    if record['case_offset'] == 0:
+        return record['text']
+    return f"{record['case_name']}\n{record.get('section', '')}{record['text']}"
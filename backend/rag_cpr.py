@@ -1,13 +1,58 @@
-import os
-import json
+import bisect
+import time
 import re
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Callable
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
-import pickle
 from langchain.text_splitter import MarkdownTextSplitter
+from retrieval_executor import retrieval_executor
+from single_flight import SingleFlight
+import stage_timer
+from model_registry import get_model, get_encoder, DEFAULT_MODEL_NAME
+from index_bundle import IndexBundle, BundleMismatchError, corpus_fingerprint, rows_for_ids
+from corpus_index import sync_bundle, ReindexReport
+from index_factory import IndexConfig, set_search_params
+from scoring import calibrate_scores
+from lexical_index import HYBRID_RETRIEVAL, HYBRID_DEPTH, BM25Index, bundle_stamp, hybrid_rank
+
+# Markdown headings and inline bold rule numbers (**7.5**), scanned in one pass
+MARKER_RE = re.compile(r'^(?P<hashes>#{1,6})[ \t]+(?P<title>[^\n]*)$|\*\*(?P<bold>\d+\.\d+[A-Z]*)\*\*', re.M)
+# "Rule 7.5 - Service of claim form" (title optional)
+RULE_HEADING_RE = re.compile(r'Rule\s+(\d+\.\d+[A-Z]*)\b(?:\s*[–-]\s*(.+))?', re.I)
+# Numbered practice direction paragraph at the start of a line ("1.1 Rule 7.5(1) provides ...")
+PARAGRAPH_NUMBER_RE = re.compile(r'^(\d+\.\d+[A-Z]*)\s', re.M)
+# "# CPR Part 7 - Title" / "# Practice Direction 7A - Title"
+H1_TITLE_RE = re.compile(r'^#[ \t]+(?:CPR\s+)?(?:Part\s+\w+|Practice\s+Direction\s+\w+)\s*[–-]\s*([^\n]+)$', re.M | re.I)
+
+# Concurrent identical rule searches share one executor job
+rule_flights = SingleFlight("cpr_retrieval")
+
+
+def parse_part_filename(name: str) -> Optional[Tuple[str, str]]:
+    """(part number, title) from a CPR filename; the title is empty for short names like part07.md or pd07a.md"""
+    match = re.match(r'(\d+)\s+Part\s+(\d+)\s*[–-]\s*(.+)\.md', name)
+    if match:
+        return match.group(2), match.group(3)
+    # Try alternative format for practice directions
+    match = re.match(r'(\d+)\s+Practice\s+Direction\s+(\d+[A-Z]*)\s*[–-]\s*(.+)\.md', name)
+    if match:
+        return f"PD{match.group(2)}", match.group(3)
+    match = re.fullmatch(r'part(\d+)\.md', name, re.I)
+    if match:
+        return str(int(match.group(1))), ""
+    match = re.fullmatch(r'pd(\d+)([a-z]*)\.md', name, re.I)
+    if match:
+        return f"PD{int(match.group(1))}{match.group(2).upper()}", ""
+    return None
+
+
+def title_from_h1(content: str) -> Optional[str]:
+    match = H1_TITLE_RE.search(content)
+    if match:
+        return match.group(1).strip()
+    match = re.search(r'^#[ \t]+([^\n]+)$', content, re.M)
+    return match.group(1).strip() if match else None
+
 
 def get_cpr_url(part: str, rule: str) -> str:
     """Constructs a URL to a specific CPR rule on the justice.gov.uk website."""
@@ -26,103 +71,130 @@ def get_cpr_url(part: str, rule: str) -> str:
     return f"{base_url}/{part_formatted}#{rule_anchor}"
 
 class CPRRAGSystem:
-    def __init__(self, data_dir: str = "cpr_data", index_file: str = "cpr_index.faiss"):
+    def __init__(
+        self,
+        data_dir: str = "cpr_data",
+        index_dir: str = "cpr_index",
+        model_name: Optional[str] = None,
+        progress_callback: Optional[Callable[[str, int, int], None]] = None,
+        auto_load: bool = True,
+    ):
         self.data_dir = Path(data_dir)
-        self.index_file = Path(index_file)
+        self.index_dir = Path(index_dir)
+        self.model_name = model_name or DEFAULT_MODEL_NAME
         self.rules_data = []
         self.embeddings = None
+        self.ids = None
         self.index = None
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+        self.lexical = None
+        self.rules_by_number: Dict[str, int] = {}
+        self.rules_by_part: Dict[str, List[int]] = {}
+        # Index type/parameters from CPR_INDEX_* (see index_factory.py)
+        self.index_config = IndexConfig.from_env("CPR", metric="ip")
+        self.report_progress = progress_callback or (lambda stage, done=0, total=0: None)
+        # Model and batching encoder are shared process-wide via the registry
+        self.report_progress("loading model")
+        self.model = get_model(model_name)
+        self.encoder = get_encoder(model_name)
         self.text_splitter = MarkdownTextSplitter()
-        self.load_and_index_rules()
+        if auto_load:
+            self.load_and_index_rules()
+
+    def corpus_files(self) -> List[Path]:
+        return sorted(self.data_dir.glob("*.md"))
 
     def load_and_index_rules(self):
-        """Load all CPR markdown files and build FAISS index"""
-        if self.index_file.exists():
-            self.load_persisted_index()
-        else:
-            self.build_index_from_files()
-            self.persist_index()
+        """Load the persisted index bundle, re-indexing changed markdown files if it is stale"""
+        corpus_hash = corpus_fingerprint(self.corpus_files())
+        try:
+            self.report_progress("loading index")
+            self.load_persisted_index(corpus_hash)
+        except BundleMismatchError as e:
+            print(f"Updating CPR index: {e}")
+            report = self.reindex(corpus_hash)
+            print(f"CPR index {report.summary()}")
 
-    def build_index_from_files(self):
-        """Build index from markdown files"""
-        self.rules_data = []
-        texts = []
+    def reindex(self, corpus_hash: Optional[str] = None, full: bool = False) -> ReindexReport:
+        """Re-parse and re-embed only added/changed files and update the index bundle in place"""
+        files = self.corpus_files()
+        bundle, report = sync_bundle(
+            self.index_dir,
+            files,
+            parse_file=self.parse_rule_file,
+            text_of=lambda rule: rule['full_text'],
+            encoder=self.encoder,
+            model_name=self.model_name,
+            corpus_hash=corpus_hash or corpus_fingerprint(files),
+            index_config=self.index_config,
+            full=full,
+            progress=self.report_progress,
+        )
+        self.use_bundle(bundle)
+        return report
+
+    def parse_rule_file(self, file: Path) -> List[Dict[str, Any]]:
+        """Parse one CPR or Practice Direction markdown file into rule records"""
+        with open(file, 'r', encoding='utf-8') as f:
+            content = f.read()
         
-        for file in sorted(self.data_dir.glob("*.md")):
-            if file.name == "cpr_data_links.json":
-                continue
-                
-            with open(file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Extract part number and title from filename
-            filename_match = re.match(r'(\d+)\s+Part\s+(\d+)\s*[–-]\s*(.+)\.md', file.name)
-            if not filename_match:
-                # Try alternative format for practice directions
-                filename_match = re.match(r'(\d+)\s+Practice\s+Direction\s+(\d+[A-Z]*)\s*[–-]\s*(.+)\.md', file.name)
-                if not filename_match:
-                    continue
-                else:
-                    file_num = filename_match.group(1)
-                    part_num = f"PD{filename_match.group(2)}"  # Practice Direction
-                    part_title = filename_match.group(3)
-            else:
-                file_num = filename_match.group(1)
-                part_num = filename_match.group(2)  # Use the actual part number
-                part_title = filename_match.group(3)
-            
-            # Parse markdown content to extract rules
-            rules = self.parse_cpr_markdown(content, part_num, part_title)
-            self.rules_data.extend(rules)
-            
-            # Add full text for embedding
-            for rule in rules:
-                texts.append(rule['full_text'])
+        part = parse_part_filename(file.name)
+        if part is None:
+            return []
+        part_num, part_title = part
+        if not part_title:
+            # Short filenames (part07.md, pd07a.md) carry the title in the H1 instead
+            part_title = title_from_h1(content) or file.stem
         
-        # Build embeddings and FAISS index
-        if texts:
-            self.embeddings = self.model.encode(texts, show_progress_bar=True, convert_to_numpy=True)
-            dim = self.embeddings.shape[1]
-            self.index = faiss.IndexFlatL2(dim)
-            self.index.add(self.embeddings)
+        # Parse markdown content to extract rules
+        return self.parse_cpr_markdown(content, part_num, part_title)
 
     def parse_cpr_markdown(self, content: str, part_num: str, part_title: str) -> List[Dict[str, Any]]:
-        """Parse CPR markdown content to extract individual rules"""
-        rules = []
+        """
+        Parse CPR markdown content to extract individual rules in one pass.
+
+        Rules are marked either inline in bold (`**7.5**`, heading taken from the
+        preceding `###`) or by a heading (`## Rule 7.5 - Service of claim form`).
+        Files with neither, such as practice directions, yield one record per
+        `##` section, numbered by its first numbered paragraph. Headings and rule
+        markers are found by a single regex scan; each rule's text and context
+        are then sliced out by offset.
+        """
+        # (rule_number, heading, start, body_start, level); level 0 = bold marker
+        markers = []
+        headings = []  # (start, level) of every heading, to bound heading-style rules
+        last_heading = None
+        for match in MARKER_RE.finditer(content):
+            if match.group('bold'):
+                number = match.group('bold')
+                markers.append((number, last_heading or f"Rule {number}", match.start(), match.end(), 0))
+                continue
+            level = len(match.group('hashes'))
+            title = match.group('title').strip()
+            headings.append((match.start(), level))
+            rule_heading = RULE_HEADING_RE.match(title)
+            if rule_heading and level > 1:
+                number = rule_heading.group(1)
+                markers.append((number, rule_heading.group(2) or f"Rule {number}", match.start(), match.end(), level))
+            elif level == 3:
+                last_heading = title
         
-        # Look for rule numbers in bold format: **7.5**
-        rule_pattern = r'\*\*(\d+\.\d+)\*\*'
-        rule_matches = list(re.finditer(rule_pattern, content))
+        if not markers:
+            markers = self.section_markers(content)
         
-        for i, match in enumerate(rule_matches):
-            rule_number = match.group(1)
-            
-            # Get the text after the rule number until the next rule or end
-            start_pos = match.end()
-            if i + 1 < len(rule_matches):
-                end_pos = rule_matches[i + 1].start()
-            else:
-                end_pos = len(content)
-            
-            rule_text = content[start_pos:end_pos].strip()
-            
-            # Extract heading from the text before the rule number
-            text_before = content[:match.start()].strip()
-            lines_before = text_before.split('\n')
-            
-            # Look for the last heading (###) before this rule
-            heading = f"Rule {rule_number}"
-            for line in reversed(lines_before):
-                if line.startswith('### '):
-                    heading = line.replace('### ', '').strip()
+        rules = []
+        heading_starts = [start for start, _ in headings]
+        for i, (rule_number, heading, start, body_start, level) in enumerate(markers):
+            # A rule ends at the next rule marker, or at the next heading that closes it
+            end = markers[i + 1][2] if i + 1 < len(markers) else len(content)
+            j = bisect.bisect_right(heading_starts, body_start - 1)
+            while j < len(headings) and headings[j][0] < end:
+                if level == 0 or headings[j][1] <= level:
+                    end = headings[j][0]
                     break
+                j += 1
             
             # Clean up rule text
-            full_text = rule_text.strip()
-            
-            # Extract context (surrounding paragraphs)
-            context = self.extract_context(content, match.group(0) + rule_text, [match.group(0), rule_text])
+            full_text = content[body_start:end].strip()
             
             rule_data = {
                 'part': part_num,
@@ -130,7 +202,7 @@ class CPRRAGSystem:
                 'rule_number': rule_number,
                 'heading': heading,
                 'full_text': full_text,
-                'context': context,
+                'context': self.extract_context(content, start, end),
                 'url': get_cpr_url(part_num, rule_number)
             }
             
@@ -138,16 +210,24 @@ class CPRRAGSystem:
         
         return rules
 
-    def extract_context(self, full_content: str, section: str, lines: List[str]) -> str:
-        """Extract context with surrounding paragraphs"""
-        # Find section position in full content
-        section_start = full_content.find(section)
-        if section_start == -1:
-            return section
-        
+    @staticmethod
+    def section_markers(content: str) -> List[Tuple[str, str, int, int, int]]:
+        """Markers for `##` sections, numbered by their first numbered paragraph (or position)"""
+        sections = [m for m in MARKER_RE.finditer(content) if m.group('hashes') and len(m.group('hashes')) == 2]
+        markers = []
+        for i, match in enumerate(sections):
+            end = sections[i + 1].start() if i + 1 < len(sections) else len(content)
+            paragraph = PARAGRAPH_NUMBER_RE.search(content, match.end(), end)
+            number = paragraph.group(1) if paragraph else str(i + 1)
+            markers.append((number, match.group('title').strip(), match.start(), match.end(), 2))
+        return markers
+
+    @staticmethod
+    def extract_context(full_content: str, start: int, end: int, window: int = 500) -> str:
+        """Extract context with surrounding paragraphs: the section plus one paragraph either side"""
         # Get text before and after the section
-        before_text = full_content[max(0, section_start - 500):section_start]
-        after_text = full_content[section_start + len(section):section_start + len(section) + 500]
+        before_text = full_content[max(0, start - window):start]
+        after_text = full_content[end:end + window]
         
         # Extract last paragraph before and first paragraph after
         before_paragraphs = before_text.split('\n\n')
@@ -157,53 +237,66 @@ class CPRRAGSystem:
         if before_paragraphs and before_paragraphs[-1].strip():
             context_parts.append(before_paragraphs[-1].strip())
         
-        context_parts.append(section.strip())
+        context_parts.append(full_content[start:end].strip())
         
         if after_paragraphs and after_paragraphs[0].strip():
             context_parts.append(after_paragraphs[0].strip())
         
         return '\n\n'.join(context_parts)
 
-    def persist_index(self):
-        """Save index and metadata to disk"""
-        if self.index is not None:
-            faiss.write_index(self.index, str(self.index_file))
-            
-            # Save metadata
-            metadata_file = self.index_file.with_suffix('.pkl')
-            with open(metadata_file, 'wb') as f:
-                pickle.dump({
-                    'rules_data': self.rules_data,
-                    'embeddings': self.embeddings
-                }, f)
+    def load_persisted_index(self, corpus_hash: Optional[str] = None):
+        """Memory-map the index bundle; raises BundleMismatchError if missing or stale"""
+        self.use_bundle(IndexBundle.load(
+            self.index_dir, model_name=self.model_name, corpus_hash=corpus_hash, index_spec=self.index_config.spec
+        ))
 
-    def load_persisted_index(self):
-        """Load index and metadata from disk"""
-        if self.index_file.exists():
-            self.index = faiss.read_index(str(self.index_file))
-            
-            metadata_file = self.index_file.with_suffix('.pkl')
-            if metadata_file.exists():
-                with open(metadata_file, 'rb') as f:
-                    metadata = pickle.load(f)
-                    self.rules_data = metadata['rules_data']
-                    self.embeddings = metadata['embeddings']
+    def use_bundle(self, bundle: IndexBundle):
+        set_search_params(bundle.index, self.index_config)
+        self.index = bundle.index
+        self.embeddings = bundle.embeddings
+        self.ids = bundle.ids
+        self.rules_data = bundle.records
+        # Rule number -> row and part -> rows; the first rule with a given number wins, as a scan would
+        self.rules_by_number, self.rules_by_part = {}, {}
+        for row, rule in enumerate(self.rules_data):
+            self.rules_by_number.setdefault(rule['rule_number'], row)
+            self.rules_by_part.setdefault(rule['part'], []).append(row)
+        if HYBRID_RETRIEVAL:
+            self.report_progress("loading lexical index")
+            self.lexical = BM25Index.load_or_build(
+                bundle.path, bundle_stamp(bundle), lambda: (rule_lexical_text(rule) for rule in bundle.records)
+            )
 
-    def get_relevant_rules(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
-        """Retrieve top-k relevant CPR rules for a query"""
+    async def get_relevant_rules(self, query: str, k: int = 5, query_emb: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """Retrieve top-k relevant CPR rules for a query on the retrieval executor"""
         if self.index is None or not self.rules_data:
             return []
+        if query_emb is None:
+            query_emb = await self.encoder.encode_async(query)
+        # Identical concurrent queries share one search; each caller gets its own result dicts
+        results = await rule_flights.do(
+            (id(self), query, k), lambda: retrieval_executor.run(self._search_rules, query, k, query_emb)
+        )
+        return [dict(result) for result in results]
+
+    def _search_rules(self, query: str, k: int = 5, query_emb: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """Search the index for a query (blocking; run off the event loop)"""
+        if self.index is None or not self.rules_data:
+            return []
+        
+        if query_emb is None:
+            query_emb = self.encoder.encode(query)
+        depth = k * HYBRID_DEPTH if self.lexical is not None else k
+        D, I = self.index.search(query_emb.reshape(1, -1), depth)
         
-        query_emb = self.model.encode([query], convert_to_numpy=True)
-        D, I = self.index.search(query_emb, k)
+        # Fuse dense and BM25 rankings; score every fused hit by its cosine similarity
+        rows, _ = hybrid_rank(rows_for_ids(self.ids, I[0]), D[0], self.lexical, query, k)
+        scores = calibrate_scores(np.asarray(self.embeddings[rows]) @ query_emb)
         
+        excerpt_started = time.perf_counter()
         results = []
-        for idx, dist in zip(I[0], D[0]):
-            if idx >= len(self.rules_data):
-                continue
-            
+        for idx, score in zip(rows.tolist(), scores.tolist()):
             rule = self.rules_data[idx]
-            score = float(np.exp(-dist))  # Convert L2 to similarity-like score
             
             # Create excerpt with context
             excerpt = self.create_excerpt(rule, query)
@@ -214,12 +307,13 @@ class CPRRAGSystem:
                 'part': rule['part'],
                 'part_title': rule['part_title'],
                 'excerpt': excerpt,
-                'score': round(score, 3),
+                'score': score,
                 'full_text': rule['full_text'],
                 'url': rule.get('url', '')
             }
             
             results.append(result)
+        stage_timer.record("excerpt", (time.perf_counter() - excerpt_started) * 1000.0)
         
         return results
 
@@ -266,15 +360,18 @@ class CPRRAGSystem:
 
     def get_rule_by_number(self, rule_number: str) -> Optional[Dict[str, Any]]:
         """Get specific rule by number"""
-        for rule in self.rules_data:
-            if rule['rule_number'] == rule_number:
-                return rule
-        return None
+        row = self.rules_by_number.get(rule_number)
+        return self.rules_data[row] if row is not None else None
 
     def get_rules_by_part(self, part: str) -> List[Dict[str, Any]]:
         """Get all rules from a specific part"""
-        return [rule for rule in self.rules_data if rule['part'] == part]
+        return [self.rules_data[row] for row in self.rules_by_part.get(part, [])]
 
     def search_rules(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
         """Search rules with semantic similarity"""
-        return self.get_relevant_rules(query, k) 
\ No newline at end of file
+        return self._search_rules(query, k)
+
+
+def rule_lexical_text(rule: Dict[str, Any]) -> str:
+    """Text indexed by BM25 for a rule: its number, part and heading as well as the body"""
+    return f"CPR {rule['rule_number']} Part {rule['part']} {rule['heading']}\n{rule['full_text']}"
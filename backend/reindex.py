@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Incrementally re-index the CPR and/or arbitration case corpora.
+
+Only files whose content hash changed since the last build are re-parsed and
+re-embedded; records from changed or removed files are dropped from the FAISS
+index in place. Run from the same directory as the API server so the index
+bundles resolve to the same paths:
+
+    python reindex.py                  # both corpora
+    python reindex.py --corpus cpr --full
+"""
+
+import argparse
+import sys
+
+from rag_cpr import CPRRAGSystem
+from rag_cases import ArbitrationRAGSystem
+
+
+def print_report(name: str, report) -> None:
+    print(f"\n[{name}] {report.summary()}")
+    for label, files in (("added", report.added), ("changed", report.changed), ("removed", report.removed)):
+        for file_name in files:
+            print(f"  {label:8} {file_name}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Incrementally re-index JusticeGPS corpora")
+    parser.add_argument("--corpus", choices=["cpr", "cases", "all"], default="all")
+    parser.add_argument("--cpr-dir", default="sample_data/cpr")
+    parser.add_argument("--cpr-index", default="cpr_index")
+    parser.add_argument("--cases-dir", default="jus_mundi_hackathon_data/cases")
+    parser.add_argument("--cases-index", default="cases_index")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and rebuild from scratch")
+    args = parser.parse_args(argv)
+
+    if args.corpus in ("cpr", "all"):
+        cpr = CPRRAGSystem(data_dir=args.cpr_dir, index_dir=args.cpr_index, auto_load=False)
+        print_report("cpr", cpr.reindex(full=args.full))
+
+    if args.corpus in ("cases", "all"):
+        cases = ArbitrationRAGSystem(cases_dir=args.cases_dir, index_dir=args.cases_index, auto_load=False)
+        print_report("cases", cases.reindex(full=args.full))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Header that skips the cache for one request (any value other than "0"/"false")
+BYPASS_HEADER = "X-Cache-Bypass"
+
+
+def source_signature(sources: List[Dict[str, Any]]) -> str:
+    """Order-insensitive hash of the retrieved source set (rules by part/number, cases by citation/name)."""
+    keys = sorted(
+        f"{s.get('part', '')}|{s.get('rule_number', '')}|{s.get('case_name', '')}"
+        for s in sources
+    )
+    return hashlib.sha1("\n".join(keys).encode("utf-8")).hexdigest()
+
+
+class SemanticResponseCache:
+    """
+    Reuses a full /api/query response when a new query is a near-paraphrase of
+    a cached one: same mode, same retrieved source set, and query embeddings
+    with cosine similarity >= `threshold` (embeddings are unit length, so a dot
+    product). In-process entries are LRU-ordered with a TTL and an entry cap.
+
+    With `path` set, entries are also written to a SQLite file that other
+    workers on the host consult on a local miss, so one worker's answer serves
+    them all.
+    """
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+        disk_max_entries: Optional[int] = None,
+    ):
+        self.enabled = os.getenv("RESPONSE_CACHE", "1").lower() not in ("0", "false", "no")
+        self.threshold = threshold if threshold is not None else float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95))
+        self.max_entries = max_entries or int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+        self.ttl = ttl if ttl is not None else float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+        self.path = path if path is not None else os.getenv("RESPONSE_CACHE_PATH") or None
+        self.disk_max_entries = disk_max_entries or int(os.getenv("RESPONSE_CACHE_DISK_MAX_ENTRIES", 10000))
+
+        # entry id -> (bucket, embedding, response, created_at); buckets index entry ids by (mode, sources)
+        self._entries: "OrderedDict[str, Tuple[Tuple[str, str], np.ndarray, Dict[str, Any], float]]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, str], set] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        # Counters
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bypassed = 0
+
+    # -- in-process tier ---------------------------------------------------
+
+    def lookup(self, mode: str, sources: str, embedding: np.ndarray) -> Optional[Dict[str, Any]]:
+        """Cached response for a near-identical query with the same mode and source set, or None."""
+        bucket = (mode, sources)
+        now = time.time()
+        with self._lock:
+            ids = list(self._buckets.get(bucket, ()))
+            for entry_id in ids:
+                if now - self._entries[entry_id][3] > self.ttl:
+                    self._remove(entry_id)
+                    self.expirations += 1
+            ids = list(self._buckets.get(bucket, ()))
+            if ids:
+                similarities = np.stack([self._entries[i][1] for i in ids]) @ embedding
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(ids[best])
+                    self.hits += 1
+                    return self._entries[ids[best]][2]
+
+        response = self._disk_lookup(mode, sources, embedding, now) if self.path else None
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(uuid.uuid4().hex, bucket, embedding, response, now)
+        return response
+
+    def store(self, mode: str, sources: str, embedding: np.ndarray, response: Dict[str, Any]) -> None:
+        now = time.time()
+        entry_id = uuid.uuid4().hex
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._insert(entry_id, (mode, sources), embedding, response, now)
+            self.stores += 1
+        if self.path:
+            self._disk_store(entry_id, mode, sources, embedding, response, now)
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.bypassed += 1
+
+    def _insert(self, entry_id: str, bucket: Tuple[str, str], embedding: np.ndarray, response: Dict[str, Any], now: float) -> None:
+        self._entries[entry_id] = (bucket, embedding, response, now)
+        self._buckets.setdefault(bucket, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, entry_id: str) -> None:
+        bucket = self._entries.pop(entry_id)[0]
+        ids = self._buckets[bucket]
+        ids.discard(entry_id)
+        if not ids:
+            del self._buckets[bucket]
+
+    # -- shared on-disk tier -----------------------------------------------
+
+    def _db(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets workers read while another writes
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " id TEXT PRIMARY KEY, mode TEXT, sources TEXT, embedding BLOB, response TEXT, created_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_bucket ON responses (mode, sources, created_at)")
+            self._local.conn = conn
+        return conn
+
+    def _disk_lookup(self, mode: str, sources: str, embedding: np.ndarray, now: float) -> Optional[Dict[str, Any]]:
+        try:
+            rows = self._db().execute(
+                "SELECT embedding, response FROM responses WHERE mode = ? AND sources = ? AND created_at > ?",
+                (mode, sources, now - self.ttl),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Response cache disk lookup failed: {e}")
+            return None
+        if not rows:
+            return None
+        similarities = np.stack([np.frombuffer(blob, dtype=np.float32) for blob, _ in rows]) @ embedding
+        best = int(np.argmax(similarities))
+        return json.loads(rows[best][1]) if similarities[best] >= self.threshold else None
+
+    def _disk_store(self, entry_id: str, mode: str, sources: str, embedding: np.ndarray, response: Dict[str, Any], now: float) -> None:
+        try:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                    (entry_id, mode, sources, embedding.tobytes(), json.dumps(response), now),
+                )
+                conn.execute("DELETE FROM responses WHERE created_at <= ?", (now - self.ttl,))
+                conn.execute(
+                    "DELETE FROM responses WHERE id IN (SELECT id FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_max_entries,),
+                )
+        except sqlite3.Error as e:
+            print(f"Response cache disk store failed: {e}")
+
+    # -- reporting -----------------------------------------------------------
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "shared_path": self.path,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "bypassed": self.bypassed,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+
+response_cache = SemanticResponseCache()
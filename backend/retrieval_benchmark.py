@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Retrieval micro-benchmarks over synthetic corpora, with baseline gating.
+
+For each corpus (CPR rules, arbitration cases) and size, generates a
+synthetic corpus and measures:
+
+  build      full re-index time (parse + embed + index) and its peak RSS
+  load       time to load the persisted bundle, and peak RSS while serving
+  query      get_relevant_rules / get_relevant_cases latency per query
+             (embeddings precomputed, so encoding is excluded)
+  batch      throughput of concurrent distinct queries through the retrieval executor
+  micro      parse_cpr_markdown, create_excerpt and extract_full_text per call
+
+Build and serve run in separate child processes so each peak RSS is their own.
+Results are written as JSON; --baseline compares a run with a stored one and
+exits non-zero on any metric worse by more than --threshold:
+
+    python retrieval_benchmark.py --sizes 1000,10000 --output retrieval_baseline.json
+    python retrieval_benchmark.py --sizes 1000,10000 --baseline retrieval_baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+RULES_PER_PART = 50
+
+WORDS = (
+    "claim claimant defendant court order application service extension time limit judgment "
+    "summary default disclosure evidence witness statement costs assessment appeal permission "
+    "injunction interim relief sanction strike out stay proceedings jurisdiction counterclaim "
+    "environmental damage investor state treaty tribunal award annulment expropriation measure "
+    "compensation liability breach obligation standard treatment protection contract notice "
+    "period days months filing defence reply particulars allocation track hearing trial "
+    "settlement offer payment enforcement charging attachment security party parties"
+).split()
+
+PARTIES = (
+    "Burlington Perenco MetalTech Urbaser Paushok Kronos Chevron Occidental Copper Mesa "
+    "Aven Rusoro Gold Reserve Bear Creek Eco Oro Infinito Lone Pine Clayton Bilcon"
+).split()
+STATES = "Ecuador Argentina Uzbekistan Mongolia Peru Colombia Venezuela Canada Guatemala Bolivia".split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def write_cpr_corpus(directory: Path, rules: int, seed: int = 0) -> None:
+    """`rules` rules in CPR markdown, RULES_PER_PART per partNN.md file."""
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    for part in range(1, (rules + RULES_PER_PART - 1) // RULES_PER_PART + 1):
+        lines = [f"# CPR Part {part} - {sentence(rng, 4)[:-1].title()}", ""]
+        for rule in range(1, min(RULES_PER_PART, rules - (part - 1) * RULES_PER_PART) + 1):
+            lines += [f"## Rule {part}.{rule} - {sentence(rng, 3)[:-1]}", ""]
+            for paragraph in range(1, rng.randint(3, 7)):
+                lines += [f"({paragraph}) " + " ".join(sentence(rng, rng.randint(12, 30)) for _ in range(rng.randint(1, 3))), ""]
+        (directory / f"part{part:02d}.md").write_text("\n".join(lines), encoding="utf-8")
+
+
+def write_case_corpus(directory: Path, cases: int, case_chars: int = 2000, seed: int = 0) -> None:
+    """`cases` Jus Mundi-style case JSON files, one decision of about `case_chars` characters each."""
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    for i in range(cases):
+        content = []
+        while sum(len(s) + 1 for s in content) < case_chars:
+            content.append(sentence(rng, rng.randint(12, 30)))
+        case = {
+            "Title": f"{rng.choice(PARTIES)} {i} v. {rng.choice(STATES)}",
+            "CaseNumber": f"ARB/{i // 100:02d}/{i % 100}",
+            "Status": rng.choice(["Concluded - award in favor of state", "Concluded - award in favor of investor", "Pending"]),
+            "Institution": rng.choice(["ICSID", "PCA", "SCC"]),
+            "Decisions": [{"Title": "Award", "Type": "Award", "Date": "2020-01-01", "Content": " ".join(content), "Opinions": []}],
+        }
+        (directory / f"case_{i:06d}.json").write_text(json.dumps(case), encoding="utf-8")
+
+
+def synthetic_queries(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    queries = set()
+    while len(queries) < count:
+        queries.add(" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 8))))
+    return sorted(queries)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def percentiles_ms(seconds: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(np.asarray(seconds) * 1000.0, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+
+def per_call_us(fn, items: List[Any], repeat: int) -> float:
+    """Mean microseconds per call over `items`, best of `repeat` passes (as timeit does)."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            fn(item)
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1e6 / max(1, len(items)), 2)
+
+
+def rag_system(corpus: str, data_dir: Path, index_dir: Path):
+    if corpus == "cpr":
+        from rag_cpr import CPRRAGSystem
+        return CPRRAGSystem(data_dir=str(data_dir), index_dir=str(index_dir), auto_load=False)
+    from rag_cases import ArbitrationRAGSystem
+    return ArbitrationRAGSystem(cases_dir=str(data_dir), index_dir=str(index_dir), auto_load=False)
+
+
+def run_build(corpus: str, data_dir: Path, index_dir: Path) -> Dict[str, Any]:
+    rag = rag_system(corpus, data_dir, index_dir)
+    started = time.perf_counter()
+    rag.reindex(full=True)
+    return {"build_s": round(time.perf_counter() - started, 3), "build_peak_rss_mb": peak_rss_mb()}
+
+
+async def query_latencies(search, queries: List[str], embeddings: np.ndarray, k: int, concurrency: int, repeat: int) -> Dict[str, Any]:
+    # Sequential queries give per-query latency, pooled over the passes
+    latencies = []
+    for _ in range(repeat):
+        for query, query_emb in zip(queries, embeddings):
+            started = time.perf_counter()
+            await search(query, k=k, query_emb=query_emb)
+            latencies.append(time.perf_counter() - started)
+
+    # Concurrent (distinct) queries, capped at the executor's capacity, give throughput
+    gate = asyncio.Semaphore(concurrency)
+
+    async def bounded(query: str, query_emb: np.ndarray):
+        async with gate:
+            return await search(query, k=k, query_emb=query_emb)
+
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded(query, query_emb) for query, query_emb in zip(queries, embeddings)))
+        best = min(best, time.perf_counter() - started)
+    return {"query_ms": percentiles_ms(latencies), "batch_qps": round(len(queries) / best, 1)}
+
+
+def run_serve(corpus: str, data_dir: Path, index_dir: Path, queries: int, k: int, micro_items: int, repeat: int) -> Dict[str, Any]:
+    from retrieval_executor import retrieval_executor
+
+    rag = rag_system(corpus, data_dir, index_dir)
+    load = rag.load_and_index_rules if corpus == "cpr" else rag.load_or_update_index
+    load_s = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        load()
+        load_s = min(load_s, time.perf_counter() - started)
+    result: Dict[str, Any] = {"load_s": round(load_s, 3)}
+
+    texts = synthetic_queries(queries)
+    embeddings = np.stack([rag.encoder.encode(text) for text in texts])
+    search = rag.get_relevant_rules if corpus == "cpr" else rag.get_relevant_cases
+    result.update(asyncio.run(query_latencies(search, texts, embeddings, k, retrieval_executor.capacity, repeat)))
+
+    files = rag.corpus_files()[:micro_items]
+    if corpus == "cpr":
+        from rag_cpr import parse_part_filename
+
+        contents = [(f.read_text(encoding="utf-8"), parse_part_filename(f.name)[0]) for f in files]
+        result["parse_cpr_markdown_us_per_file"] = per_call_us(lambda item: rag.parse_cpr_markdown(item[0], item[1], ""), contents, repeat)
+        rules = [rag.rules_data[i] for i in range(min(micro_items, len(rag.rules_data)))]
+        pairs = [(rule, texts[i % len(texts)]) for i, rule in enumerate(rules)]
+        result["create_excerpt_us"] = per_call_us(lambda pair: rag.create_excerpt(*pair), pairs, repeat)
+    else:
+        cases = [json.loads(f.read_text(encoding="utf-8")) for f in files]
+        result["extract_full_text_us"] = per_call_us(rag.extract_full_text, cases, repeat)
+    result["serve_peak_rss_mb"] = peak_rss_mb()
+    retrieval_executor.shutdown()
+    return result
+
+
+def run_phase(args) -> int:
+    """Child process entry point: one phase for one corpus and size, results to --result-file."""
+    data_dir, index_dir = Path(args.data_dir), Path(args.index_dir)
+    if args.phase == "build":
+        result = run_build(args.corpus, data_dir, index_dir)
+    else:
+        result = run_serve(args.corpus, data_dir, index_dir, args.queries, args.k, args.micro_items, args.repeat)
+    Path(args.result_file).write_text(json.dumps(result), encoding="utf-8")
+    return 0
+
+
+def child(phase: str, corpus: str, data_dir: Path, index_dir: Path, args) -> Dict[str, Any]:
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_file = f.name
+    try:
+        subprocess.run(
+            [
+                sys.executable, __file__, "--phase", phase, "--corpus", corpus,
+                "--data-dir", str(data_dir), "--index-dir", str(index_dir), "--result-file", result_file,
+                "--queries", str(args.queries), "--k", str(args.k), "--micro-items", str(args.micro_items), "--repeat", str(args.repeat),
+            ],
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        )
+        return json.loads(Path(result_file).read_text(encoding="utf-8"))
+    finally:
+        Path(result_file).unlink(missing_ok=True)
+
+
+def flatten(metrics: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in metrics.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Print each metric against the baseline; returns the regressions (throughput falling, anything else rising)."""
+    regressions = []
+    print(f"\nAgainst baseline from {baseline.get('meta', {}).get('timestamp', '?')} (threshold {threshold:.0%}):")
+    print(f"{'benchmark':14} {'metric':34} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, metrics in results["results"].items():
+        old = flatten(baseline.get("results", {}).get(name, {}))
+        for metric, value in flatten(metrics).items():
+            if not old.get(metric):
+                continue
+            change = (value - old[metric]) / old[metric]
+            worse = -change if metric.endswith("_qps") else change
+            flag = "!" if worse > threshold else ""
+            if flag:
+                regressions.append(f"{name} {metric}: {old[metric]} -> {value} ({change:+.0%})")
+            print(f"{name:14} {metric:34} {old[metric]:12.3f} {value:12.3f} {change:+7.0%}{flag}")
+    return regressions
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    for name, metrics in results["results"].items():
+        print(f"\n[{name}]")
+        for metric, value in flatten(metrics).items():
+            print(f"  {metric:34} {value}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark retrieval over synthetic corpora")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated rule/case counts")
+    parser.add_argument("--corpus", choices=["cpr", "cases", "all"], default="all")
+    parser.add_argument("--queries", type=int, default=200, help="distinct queries per benchmark")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--micro-items", type=int, default=500, help="files/rules/cases per micro-benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="passes per measurement (best load/micro time, pooled latencies)")
+    parser.add_argument("--case-chars", type=int, default=2000, help="decision text per synthetic case")
+    parser.add_argument("--workdir", help="where corpora and indexes are built (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative worsening that counts as a regression")
+    # Internal: run one phase in a child process
+    parser.add_argument("--phase", choices=["build", "serve"], help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--index-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.phase:
+        return run_phase(args)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    corpora = ["cpr", "cases"] if args.corpus == "all" else [args.corpus]
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="retrieval_benchmark_")).resolve()
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "queries": args.queries,
+            "k": args.k,
+            "repeat": args.repeat,
+            "case_chars": args.case_chars,
+        },
+        "results": {},
+    }
+    try:
+        for corpus in corpora:
+            for size in sizes:
+                name = f"{corpus}/{size}"
+                data_dir, index_dir = workdir / f"{corpus}_{size}", workdir / f"{corpus}_{size}_index"
+                print(f"[{name}] generating corpus in {data_dir}")
+                if corpus == "cpr":
+                    write_cpr_corpus(data_dir, size)
+                else:
+                    write_case_corpus(data_dir, size, args.case_chars)
+                print(f"[{name}] building index")
+                metrics = child("build", corpus, data_dir, index_dir, args)
+                print(f"[{name}] loading and querying")
+                metrics.update(child("serve", corpus, data_dir, index_dir, args))
+                results["results"][name] = metrics
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s):")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+
+class RetrievalOverloadedError(Exception):
+    """Raised when the retrieval queue is full and the request should be shed (HTTP 503)."""
+
+
+class RetrievalExecutor:
+    """
+    Dedicated thread pool for CPU-bound retrieval work (query encoding, FAISS search).
+
+    Keeps SentenceTransformer.encode and index searches off the event loop so that
+    LLM awaits for other requests are never stalled behind them. The number of
+    running plus queued jobs is capped; once the cap is hit new work is rejected
+    immediately with RetrievalOverloadedError instead of piling up.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue: Optional[int] = None):
+        if max_workers is None:
+            max_workers = int(os.getenv("RETRIEVAL_WORKERS", os.cpu_count() or 4))
+        if max_queue is None:
+            max_queue = int(os.getenv("RETRIEVAL_MAX_QUEUE", max_workers * 8))
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="retrieval")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.max_queue
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the retrieval pool and await its result."""
+        with self._lock:
+            if self._pending >= self.capacity:
+                self.rejected += 1
+                raise RetrievalOverloadedError(
+                    f"Retrieval queue is full ({self._pending} jobs in flight); try again shortly"
+                )
+            self._pending += 1
+
+        try:
+            # Run in a copy of the caller's context, as asyncio.to_thread does, so
+            # stage timings and tracing spans reach the pool thread
+            context = contextvars.copy_context()
+            future = self._executor.submit(context.run, partial(fn, *args, **kwargs))
+        except Exception:
+            self._release(None)
+            raise
+        # Release the slot when the thread finishes, not when the awaiting coroutine
+        # is cancelled, so the depth count reflects work actually occupying the pool.
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+# Process-wide executor shared by all RAG systems
+retrieval_executor = RetrievalExecutor()
@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+
+# Cosine similarities at or below SCORE_FLOOR map to 0 and at or above
+# SCORE_CEILING to 1. MiniLM-style models rarely go below ~0.1 even for
+# unrelated text, and paraphrases sit around 0.8.
+SCORE_FLOOR = float(os.getenv("SCORE_FLOOR", 0.1))
+SCORE_CEILING = float(os.getenv("SCORE_CEILING", 0.8))
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """Return float32 rows scaled to unit length (zero rows are left as zeros)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, np.float32(1e-12))
+
+
+def calibrate_scores(similarities: np.ndarray) -> np.ndarray:
+    """
+    Map raw cosine similarities from the inner-product index to [0, 1] relevance
+    scores, for a whole result array at once. Both RAG systems go through here,
+    so `calculate_confidence` sees comparable scores in either mode.
+    """
+    similarities = np.asarray(similarities, dtype=np.float32)
+    scores = (similarities - SCORE_FLOOR) / (SCORE_CEILING - SCORE_FLOOR)
+    return np.round(np.clip(scores, 0.0, 1.0).astype(np.float64), 3)
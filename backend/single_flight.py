@@ -0,0 +1,60 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for `key` is in flight,
+    further callers with the same key await the same task instead of starting
+    their own, so N simultaneous identical requests cost one upstream call.
+    Nothing is kept once the call finishes (caching is a separate concern).
+
+    The shared task is shielded, so one caller being cancelled (e.g. a client
+    disconnect) does not cancel it for the others.
+    """
+
+    groups: List["SingleFlight"] = []
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        SingleFlight.groups.append(self)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn() (started at most once per key at a time) and return its result."""
+        with self._lock:
+            self.calls += 1
+            task = self._calls.get(key)
+            if task is None:
+                self.executions += 1
+                task = asyncio.ensure_future(fn())
+                self._calls[key] = task
+                task.add_done_callback(lambda _task: self._forget(key, _task))
+            else:
+                self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        with self._lock:
+            if self._calls.get(key) is task:
+                del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "coalesced_ratio": round(self.coalesced / self.calls, 3) if self.calls else 0.0,
+                "in_flight": len(self._calls),
+            }
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """Coalescing counters for every single-flight group in the process."""
+    return {group.name: group.stats() for group in SingleFlight.groups}
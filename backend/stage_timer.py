@@ -0,0 +1,100 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, ContextManager, Dict, Iterator, List, Optional
+
+
+class RequestStages:
+    """Milliseconds per pipeline stage, and labels such as the mode, of one request."""
+
+    __slots__ = ("timings", "labels")
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.labels: Dict[str, str] = {}
+
+
+_current: ContextVar[Optional[RequestStages]] = ContextVar("request_stages", default=None)
+
+# Called as observer(stage, ms, labels) for every recorded stage (metrics histograms)
+_observers: List[Callable[[str, float, Dict[str, str]], None]] = []
+# Opens a tracing span around each stage when tracing is enabled; None keeps stage() to two clock reads
+_span_factory: Optional[Callable[[str, Dict[str, str]], ContextManager]] = None
+
+
+def start_request():
+    """Begin collecting stage timings for the current request; returns a reset token."""
+    return _current.set(RequestStages())
+
+
+def end_request(token) -> None:
+    _current.reset(token)
+
+
+def set_label(key: str, value: str) -> None:
+    """Label the current request's stages (e.g. with its mode)."""
+    current = _current.get()
+    if current is not None:
+        current.labels[key] = value
+
+
+def labels() -> Dict[str, str]:
+    current = _current.get()
+    return dict(current.labels) if current is not None else {}
+
+
+def add_observer(observer: Callable[[str, float, Dict[str, str]], None]) -> None:
+    _observers.append(observer)
+
+
+def set_span_factory(factory: Optional[Callable[[str, Dict[str, str]], ContextManager]]) -> None:
+    global _span_factory
+    _span_factory = factory
+
+
+def record(name: str, ms: float) -> None:
+    """Add `ms` to a stage of the current request and report it to the observers."""
+    current = _current.get()
+    stage_labels = current.labels if current is not None else {}
+    if current is not None:
+        current.timings[name] = current.timings.get(name, 0.0) + ms
+    for observer in _observers:
+        observer(name, ms, stage_labels)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time the enclosed block (sync or containing awaits) as one pipeline stage."""
+    started = time.perf_counter()
+    try:
+        if _span_factory is None:
+            yield
+        else:
+            with _span_factory(name, labels()):
+                yield
+    finally:
+        record(name, (time.perf_counter() - started) * 1000.0)
+
+
+def timings() -> Dict[str, float]:
+    current = _current.get()
+    return dict(current.timings) if current is not None else {}
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Format timings as an HTTP Server-Timing header value."""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    timings = {}
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    timings[name] = float(value)
+                except ValueError:
+                    pass
+    return timings
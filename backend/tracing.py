@@ -0,0 +1,64 @@
+import os
+from contextlib import nullcontext
+from typing import ContextManager, Dict
+
+import stage_timer
+
+# Export OpenTelemetry spans (one per request, one per pipeline stage) over
+# OTLP/HTTP to OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318).
+# Needs opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http; when off,
+# stages cost two clock reads and no spans are created.
+OTEL_TRACING = os.getenv("OTEL_TRACING", "0").lower() not in ("0", "false", "no")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "justicegps")
+
+_tracer = None
+_provider = None
+
+
+def init_tracing() -> bool:
+    """Start exporting spans if OTEL_TRACING is set and OpenTelemetry is installed; returns whether it is on."""
+    global _tracer, _provider
+    if not OTEL_TRACING or _tracer is not None:
+        return _tracer is not None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        print(f"OpenTelemetry unavailable ({e}); tracing disabled")
+        return False
+
+    _provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    _provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    _tracer = _provider.get_tracer("justicegps")
+    stage_timer.set_span_factory(stage_span)
+    print(f"Exporting OpenTelemetry spans as service '{OTEL_SERVICE_NAME}'")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """Flush buffered spans."""
+    global _tracer
+    if _provider is not None:
+        stage_timer.set_span_factory(None)
+        _tracer = None
+        _provider.shutdown()
+
+
+def stage_span(name: str, labels: Dict[str, str]) -> ContextManager:
+    return _tracer.start_as_current_span(
+        f"stage {name}", attributes={f"justicegps.{key}": value for key, value in labels.items()}
+    )
+
+
+def request_span(method: str, path: str) -> ContextManager:
+    """Server span for one HTTP request (a no-op context when tracing is off)."""
+    if _tracer is None:
+        return nullcontext()
+    from opentelemetry.trace import SpanKind
+
+    return _tracer.start_as_current_span(
+        f"{method} {path}", kind=SpanKind.SERVER, attributes={"http.method": method, "http.target": path}
+    )
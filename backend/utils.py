@@ -1,29 +1,112 @@
+import asyncio
 import re
 import json
 import os
-from typing import List, Dict, Any, Optional
-from openai import AsyncOpenAI
+from typing import List, Dict, Any, Optional, AsyncIterator
 
-client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+from completion_cache import completion_cache, completion_key
+from single_flight import SingleFlight
+from llm_gateway import gateway
 
-async def call_llm(prompt: str) -> str:
-    """Calls the OpenAI API to get a response."""
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+LLM_TEMPERATURE = 0.2
+SYSTEM_MESSAGE = "You are a helpful legal assistant."
+
+llm_flights = SingleFlight("llm")
+
+async def call_llm(
+    prompt: str,
+    model: str = LLM_MODEL,
+    temperature: float = LLM_TEMPERATURE,
+    system: str = SYSTEM_MESSAGE,
+) -> str:
+    """
+    Calls the LLM through the gateway to get a response, reusing a cached completion for an
+    identical request and sharing one upstream call between identical requests
+    that are in flight at the same time.
+    """
+    key = completion_key(model, temperature, system, prompt)
+    if completion_cache.enabled:
+        cached = await cached_completion(key)
+        if cached is not None:
+            return cached
+    return await llm_flights.do(key, lambda: _complete(key, prompt, model, temperature, system))
+
+async def cached_completion(key: str) -> Optional[str]:
+    """A cached completion: memory hits inline, the SQLite lookup off the event loop."""
+    cached = completion_cache.get_memory(key)
+    if cached is None:
+        cached = await asyncio.to_thread(completion_cache.get_disk, key) if completion_cache.path else completion_cache.get_disk(key)
+    return cached
+
+async def forget_completion(
+    prompt: str,
+    model: str = LLM_MODEL,
+    temperature: float = LLM_TEMPERATURE,
+    system: str = SYSTEM_MESSAGE,
+) -> None:
+    """Drop the cached completion of a call_llm request whose output could not be used."""
+    if completion_cache.enabled:
+        await asyncio.to_thread(completion_cache.discard, completion_key(model, temperature, system, prompt))
+
+async def _complete(key: str, prompt: str, model: str, temperature: float, system: str) -> str:
     try:
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful legal assistant."},
+        completion = await gateway.complete(
+            model,
+            [
+                {"role": "system", "content": system},
                 {"role": "user", "content": prompt},
             ],
-            temperature=0.2,
+            temperature=temperature,
         )
-        return response.choices[0].message.content.strip()
+        completion = completion.strip()
     except Exception as e:
         print(f"Error calling LLM: {e}")
         raise
+    if completion_cache.enabled:
+        await asyncio.to_thread(completion_cache.put, key, completion)
+    return completion
+
+async def stream_llm(
+    prompt: str,
+    model: str = LLM_MODEL,
+    temperature: float = LLM_TEMPERATURE,
+    system: str = SYSTEM_MESSAGE,
+) -> AsyncIterator[str]:
+    """
+    Yields the completion in chunks as the model produces them. A cached
+    completion is yielded whole; a finished stream is added to the cache.
+    """
+    key = completion_key(model, temperature, system, prompt)
+    if completion_cache.enabled:
+        cached = await cached_completion(key)
+        if cached is not None:
+            yield cached
+            return
+    parts = []
+    try:
+        async for delta in gateway.stream(
+            model,
+            [
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=temperature,
+        ):
+            parts.append(delta)
+            yield delta
+    except Exception as e:
+        print(f"Error streaming LLM: {e}")
+        raise
+    if completion_cache.enabled:
+        await asyncio.to_thread(completion_cache.put, key, "".join(parts).strip())
 
 async def generate_structured_data(prompt: str, is_json: bool = True):
-    """Generic function to call LLM and get structured data (JSON or text)."""
+    """
+    Generic function to call LLM and get structured data (JSON or text).
+    A reply that is not valid JSON is dropped from the completion cache.
+    """
+    response_text = None
     try:
         response_text = await call_llm(prompt)
         if is_json:
@@ -50,5 +133,7 @@ async def generate_structured_data(prompt: str, is_json: bool = True):
         return response_text.strip()
     except Exception as e:
         print(f"Error generating structured data: {e}")
+        if response_text is not None:
+            await forget_completion(prompt)
         # Return empty list for JSON or empty string for text on error
         return [] if is_json else "" 
\ No newline at end of file
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, List, Literal, Optional, Union
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from prompt_templates import (
+    get_flowchart_prompt,
+    get_timeline_prompt,
+    get_progress_tracker_prompt,
+    get_visualizations_prompt,
+)
+from utils import generate_structured_data, forget_completion
+
+# "separate": one completion per visualization (three calls, each resending the answer)
+# "combined": one schema-constrained completion for all three, with per-field fallback
+VISUALIZATION_MODE = os.getenv("VISUALIZATION_MODE", "separate")
+
+
+class TimelineEvent(BaseModel):
+    id: Union[str, int]
+    title: str
+    date: str
+    description: str = ""
+    status: Literal["completed", "pending", "overdue"] = "pending"
+    daysFromStart: Union[int, float] = 0
+
+
+class ProgressStep(BaseModel):
+    id: Union[str, int]
+    title: str
+    description: str = ""
+    status: Literal["not-started", "in-progress", "completed", "blocked"] = "not-started"
+    priority: Literal["high", "medium", "low"] = "medium"
+    deadline: Optional[str] = None
+    ruleCitation: Optional[str] = None
+    formLink: Optional[str] = None
+
+
+_MERMAID_FENCE_RE = re.compile(r'```(?:mermaid)?\n(.*?)\n```', re.DOTALL)
+_MERMAID_START_RE = re.compile(r'^(?:graph|flowchart)\s+(?:TD|TB|BT|LR|RL)\b')
+
+# Response field -> (artifact kind, key in the combined document, single-call prompt, is_json)
+FIELDS = {
+    "flowchart": ("flowchart", "flowchart", get_flowchart_prompt, False),
+    "timelineEvents": ("timeline", "timeline", get_timeline_prompt, True),
+    "progressSteps": ("progress", "progress", get_progress_tracker_prompt, True),
+}
+
+_LIST_ADAPTERS = {
+    "timelineEvents": TypeAdapter(List[TimelineEvent]),
+    "progressSteps": TypeAdapter(List[ProgressStep]),
+}
+
+# Counters for /api/stats
+stats = {"combined_calls": 0, "fallbacks": {field: 0 for field in FIELDS}}
+
+
+def validate_field(field: str, value: Any) -> Any:
+    """Validate one field of the combined document; raises ValueError (or ValidationError) if unusable."""
+    if field == "flowchart":
+        if not isinstance(value, str):
+            raise ValueError("flowchart is not a string")
+        fenced = _MERMAID_FENCE_RE.search(value)
+        value = (fenced.group(1) if fenced else value).strip()
+        if not _MERMAID_START_RE.match(value):
+            raise ValueError("flowchart is not Mermaid graph code")
+        return value
+    items = _LIST_ADAPTERS[field].validate_python(value)
+    return [item.model_dump(exclude_none=True) for item in items]
+
+
+async def generate_visualization(field: str, legal_text: str) -> Any:
+    """One visualization from its own completion (the "separate" path)."""
+    _, _, prompt, is_json = FIELDS[field]
+    value = await generate_structured_data(prompt(legal_text), is_json=is_json)
+    if field == "flowchart" and not _MERMAID_START_RE.match(value):
+        # Not Mermaid: do not replay it for the same answer
+        await forget_completion(prompt(legal_text))
+    return value
+
+
+async def generate_combined(legal_text: str) -> Dict[str, Any]:
+    """
+    All visualizations from one completion returning a JSON document with
+    `flowchart`, `timeline` and `progress`. Each field is validated on its own;
+    only fields that fail are regenerated with their single-artifact prompt.
+    """
+    stats["combined_calls"] += 1
+    document = await generate_structured_data(get_visualizations_prompt(legal_text), is_json=True)
+    if not isinstance(document, dict):
+        document = {}
+
+    results, failed = {}, []
+    for field, (_, key, _, _) in FIELDS.items():
+        try:
+            results[field] = validate_field(field, document.get(key))
+        except (ValidationError, ValueError) as e:
+            print(f"Combined visualization field '{key}' failed validation, falling back: {str(e).splitlines()[0]}")
+            failed.append(field)
+            stats["fallbacks"][field] += 1
+    if failed:
+        # Regenerate the whole document next time rather than replaying its broken fields
+        await forget_completion(get_visualizations_prompt(legal_text))
+        values = await asyncio.gather(*(generate_visualization(field, legal_text) for field in failed))
+        results.update(zip(failed, values))
+    return results
+
+
+async def benchmark(answers: List[str], runs: int = 1) -> Dict[str, Dict[str, Any]]:
+    """
+    Prompt tokens, completions and wall time of the separate and combined paths
+    over the same answers. Run it with LLM_CACHE=0 so every call reaches the model.
+    """
+    import utils
+    from context_packer import count_tokens
+
+    calls: List[str] = []
+    call_llm = utils.call_llm
+
+    async def counted_call(prompt: str, *args, **kwargs) -> str:
+        calls.append(prompt)
+        return await call_llm(prompt, *args, **kwargs)
+
+    async def separate(text: str) -> Dict[str, Any]:
+        values = await asyncio.gather(*(generate_visualization(field, text) for field in FIELDS))
+        return dict(zip(FIELDS, values))
+
+    results = {}
+    utils.call_llm = counted_call
+    try:
+        for name, path in (("separate", separate), ("combined", generate_combined)):
+            calls.clear()
+            fallbacks_before = sum(stats["fallbacks"].values())
+            latencies = []
+            for _ in range(runs):
+                for text in answers:
+                    started = time.perf_counter()
+                    await path(text)
+                    latencies.append(time.perf_counter() - started)
+            latencies.sort()
+            results[name] = {
+                "completions": len(calls),
+                "prompt_tokens": sum(count_tokens(prompt) for prompt in calls),
+                "mean_s": sum(latencies) / len(latencies),
+                "max_s": latencies[-1],
+                "fallback_fields": sum(stats["fallbacks"].values()) - fallbacks_before if name == "combined" else 0,
+            }
+    finally:
+        utils.call_llm = call_llm
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare separate and combined visualization generation")
+    parser.add_argument("answers", nargs="+", help="text files, each holding one answer to visualize")
+    parser.add_argument("--runs", type=int, default=1, help="passes over the answers per path")
+    args = parser.parse_args(argv)
+
+    answers = []
+    for path in args.answers:
+        with open(path, "r", encoding="utf-8") as f:
+            answers.append(f.read())
+
+    results = asyncio.run(benchmark(answers, args.runs))
+    print(f"{len(answers)} answers x {args.runs} runs")
+    print(f"{'path':10} {'calls':>6} {'prompt tok':>11} {'mean s':>8} {'max s':>8} {'fallbacks':>10}")
+    for name, row in results.items():
+        print(f"{name:10} {row['completions']:6d} {row['prompt_tokens']:11d} {row['mean_s']:8.2f} {row['max_s']:8.2f} {row['fallback_fields']:10d}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
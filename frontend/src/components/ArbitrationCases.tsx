@@ -6,7 +6,6 @@ interface ArbitrationCase {
   citation: string;
   summary: string;
   supportive: boolean | null;
-  markdown_text: string;
   full_text: string;
   score?: number;
   excerpt?: string;
@@ -15,6 +15,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
 from rag_cpr import CPRRAGSystem
 from rag_cases import ArbitrationRAGSystem
 from prompt_templates import get_prompt_template
+from llm_providers import StubProvider
 
 # Ground truth answers for evaluation
 GROUND_TRUTH = {
@@ -104,14 +105,9 @@ arbitration_questions = [
     {"query": "What are the key precedents for environmental counterclaims in investment arbitration?", "ground_truth": "Burlington v. Ecuador established jurisdiction for environmental counterclaims"}
 ]
 
-def call_llm(prompt: str) -> str:
-    """Mock LLM call for evaluation"""
-    print(f"DEBUG: Query prompt: {prompt[:200]}...")  # Debug output
-    
+def canned_answer(prompt: str) -> str:
+    """Reference answers served by the stub provider during offline evaluation"""
     if "cpr" in prompt.lower() or "civil procedure" in prompt.lower():
-        # Simulate API delay
-        time.sleep(0.1)
-        
         if "deadline for serving particulars of claim" in prompt.lower():
             return """Under **CPR 7.5(1)**, a claim form must be served within 4 months after the date of issue (6 months if served out of the jurisdiction). The particulars of claim must be served with the claim form or within 14 days after service of the claim form."""
         
@@ -304,6 +300,28 @@ The tribunal issued an **award in favor of the investor**, finding Kazakhstan li
     else:
         return "I'll analyze your query and provide a comprehensive response based on the relevant legal framework and precedents."
 
+# Offline by default: the stub provider serves the canned answers with a fixed
+# 0.1s latency. With --live the questions go to the configured LLM_PROVIDER.
+LIVE = "--live" in sys.argv
+stub_provider = StubProvider(latency="fixed:0.1", tokens_per_sec=0, error_rate=0, responder=canned_answer)
+# One event loop for the whole run: the live provider's pooled connections are
+# bound to the loop that opened them
+runner = asyncio.Runner()
+
+def call_llm(prompt: str) -> str:
+    """LLM call for evaluation through the provider abstraction"""
+    print(f"DEBUG: Query prompt: {prompt[:200]}...")  # Debug output
+    if LIVE:
+        from utils import call_llm as live_call_llm
+        return runner.run(live_call_llm(prompt))
+    return runner.run(stub_provider.complete("stub", [{"role": "user", "content": prompt}]))
+
+def close_llm():
+    """Close the live provider's connections on the loop that used them"""
+    if LIVE:
+        from llm_gateway import gateway
+        runner.run(gateway.aclose())
+
 def evaluate_answer(answer: str, question: dict) -> dict:
     """Evaluate an answer against ground truth"""
     # Simple evaluation: check if ground truth is mentioned in answer
@@ -372,7 +390,7 @@ Question: {q['query']}
 Answer based on the CPR rules:"""
         
         try:
-            # Mock LLM call
+            # LLM call (stub provider unless --live)
             answer = call_llm(prompt)
             evaluation = evaluate_answer(answer, q)
             
@@ -405,7 +423,7 @@ Question: {q['query']}
 Answer based on arbitration case law:"""
         
         try:
-            # Mock LLM call
+            # LLM call (stub provider unless --live)
             answer = call_llm(prompt)
             evaluation = evaluate_answer(answer, q)
             
@@ -438,5 +456,9 @@ Answer based on arbitration case law:"""
         return False
 
 if __name__ == "__main__":
-    success = main()
+    with runner:
+        try:
+            success = main()
+        finally:
+            close_llm()
     sys.exit(0 if success else 1) 
\ No newline at end of file
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Backend modules import each other as top-level modules (as main.py runs them)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "backend"))
+
+# Offline: the module-level LLM gateway uses the stub provider and nothing is cached on disk
+os.environ.setdefault("LLM_PROVIDER", "stub")
+os.environ.setdefault("LLM_CACHE", "0")
@@ -0,0 +1,118 @@
+from pathlib import Path
+
+import pytest
+
+from rag_cpr import CPRRAGSystem, parse_part_filename
+
+SAMPLE_DATA = Path(__file__).resolve().parent.parent / "sample_data"
+
+
+@pytest.fixture(scope="module")
+def parser():
+    # The parsing methods need no model or index, so skip __init__
+    return CPRRAGSystem.__new__(CPRRAGSystem)
+
+
+def parse(parser, path: Path):
+    return {rule["rule_number"]: rule for rule in parser.parse_rule_file(path)}
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("part07.md", ("7", "")),
+    ("PART26.md", ("26", "")),
+    ("pd07a.md", ("PD7A", "")),
+    ("07 Part 7 - How to Start Proceedings.md", ("7", "How to Start Proceedings")),
+    ("07 Practice Direction 7A – How to Start Proceedings.md", ("PD7A", "How to Start Proceedings")),
+    ("notes.md", None),
+])
+def test_parse_part_filename(name, expected):
+    assert parse_part_filename(name) == expected
+
+
+def test_part07_rules(parser):
+    rules = parse(parser, SAMPLE_DATA / "cpr" / "part07.md")
+
+    assert list(rules) == ["7.5", "7.6"]
+    assert rules["7.5"]["heading"] == "Service of claim form"
+    assert rules["7.6"]["heading"] == "Extension of time for serving a claim form"
+    assert all(rule["part"] == "7" for rule in rules.values())
+    # Short filenames take the part title from the H1
+    assert rules["7.5"]["part_title"] == "How to Start Proceedings - The Claim Form"
+    assert rules["7.5"]["url"].endswith("/part07#7-5")
+
+    # A rule's text stops at the next rule heading
+    assert rules["7.5"]["full_text"].startswith("(1) The claimant must complete the step")
+    assert rules["7.5"]["full_text"].endswith("struck out without further order of the court.")
+    assert "Rule 7.6" not in rules["7.5"]["full_text"]
+    assert rules["7.6"]["full_text"].endswith("(b) may be made without notice.")
+
+
+def test_part07_context_boundaries(parser):
+    rules = parse(parser, SAMPLE_DATA / "cpr" / "part07.md")
+
+    # The section itself plus the first paragraph after it (the next rule's heading)
+    context = rules["7.5"]["context"]
+    assert context.startswith("## Rule 7.5 - Service of claim form")
+    assert context.endswith("## Rule 7.6 - Extension of time for serving a claim form")
+    assert rules["7.5"]["full_text"] in context
+    # The last rule has nothing after it
+    assert rules["7.6"]["context"].endswith("(b) may be made without notice.")
+
+
+def test_part26_rules(parser):
+    rules = parse(parser, SAMPLE_DATA / "cpr" / "part26.md")
+
+    assert list(rules) == ["26.3", "26.4"]
+    assert rules["26.3"]["heading"] == "Directions questionnaire"
+    assert rules["26.4"]["heading"] == "Stay to allow for settlement of the case"
+    assert rules["26.3"]["part_title"] == "Case Management - Preliminary Stage"
+    assert "Rule 26.4" not in rules["26.3"]["full_text"]
+    assert rules["26.3"]["context"].endswith("## Rule 26.4 - Stay to allow for settlement of the case")
+
+
+def test_practice_direction_sections(parser):
+    rules = parse(parser, SAMPLE_DATA / "pd" / "pd07a.md")
+
+    # No rule markers: one record per ## section, numbered by its first paragraph
+    assert list(rules) == ["1.1", "2.1", "3.1"]
+    assert [rule["heading"] for rule in rules.values()] == [
+        "Service of claim form",
+        "Methods of service",
+        "Extension of time for service",
+    ]
+    assert all(rule["part"] == "PD7A" for rule in rules.values())
+    assert rules["1.1"]["full_text"].startswith("1.1 Rule 7.5(1) provides")
+    assert "Methods of service" not in rules["1.1"]["full_text"]
+    assert rules["1.1"]["context"].endswith("## Methods of service")
+    assert rules["3.1"]["context"].endswith("has been unable to do so.")
+
+
+def test_bold_rule_markers(parser):
+    content = "\n".join([
+        "# CPR Part 7 - How to Start Proceedings",
+        "",
+        "### Service of claim form",
+        "",
+        "**7.5** The claimant must serve the claim form within four months.",
+        "",
+        "**7.5A** Where the claim form is served out of the jurisdiction, six months.",
+        "",
+        "### Extension of time",
+        "",
+        "**7.6** The claimant may apply for an order extending the period.",
+        "",
+        "## Practice notes",
+        "",
+        "Not part of any rule.",
+    ])
+    rules = {rule["rule_number"]: rule for rule in parser.parse_cpr_markdown(content, "7", "How to Start Proceedings")}
+
+    assert list(rules) == ["7.5", "7.5A", "7.6"]
+    # Bold markers take their heading from the preceding ###
+    assert rules["7.5"]["heading"] == "Service of claim form"
+    assert rules["7.5A"]["heading"] == "Service of claim form"
+    assert rules["7.6"]["heading"] == "Extension of time"
+    assert rules["7.5"]["full_text"] == "The claimant must serve the claim form within four months."
+    # A bold rule ends at the next heading of any level
+    assert rules["7.5A"]["full_text"].endswith("six months.")
+    assert rules["7.6"]["full_text"] == "The claimant may apply for an order extending the period."
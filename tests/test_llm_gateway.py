@@ -0,0 +1,251 @@
+import asyncio
+
+import pytest
+
+import llm_gateway
+from llm_gateway import (
+    LLMDeadlineExceeded,
+    LLMGateway,
+    LLMThrottled,
+    LLMUnavailableError,
+    TokenBucket,
+    set_request_deadline,
+)
+from llm_providers import LLMProvider, StubProvider
+
+MESSAGES = [{"role": "user", "content": "When must a claim form be served?"}]
+
+
+class StatusError(Exception):
+    """An upstream error carrying an HTTP status, like the OpenAI SDK's APIStatusError."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class ScriptedProvider(LLMProvider):
+    """Plays back one outcome per call: an exception to raise, seconds to hang, or the text to return."""
+
+    name = "scripted"
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.closed_streams = 0
+
+    async def _next(self) -> str:
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if isinstance(outcome, float):
+            await asyncio.sleep(outcome)
+            return "late"
+        return outcome
+
+    async def complete(self, model, messages, **kwargs):
+        return await self._next()
+
+    async def stream(self, model, messages, **kwargs):
+        try:
+            text = await self._next()
+            for word in text.split():
+                yield word + " "
+        finally:
+            self.closed_streams += 1
+
+
+@pytest.fixture(autouse=True)
+def fast_gateway(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_MAX_RETRIES", 3)
+    monkeypatch.setattr(llm_gateway, "LLM_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(llm_gateway, "LLM_BACKOFF_MAX", 0.005)
+    monkeypatch.setattr(llm_gateway, "LLM_TIMEOUT", 5.0)
+    monkeypatch.setattr(llm_gateway, "LLM_BREAKER_THRESHOLD", 2)
+    monkeypatch.setattr(llm_gateway, "LLM_BREAKER_COOLDOWN", 0.05)
+    monkeypatch.setattr(llm_gateway, "LLM_RPM", 0)
+    monkeypatch.setattr(llm_gateway, "LLM_TPM", 0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status", [429, 500, 503])
+async def test_retryable_status_is_retried(status):
+    provider = ScriptedProvider(StatusError(status), StatusError(status), "answer")
+    gateway = LLMGateway(provider)
+
+    assert await gateway.complete("m", MESSAGES) == "answer"
+    lane = gateway.lane("m")
+    assert (lane.attempts, lane.retries, lane.failures) == (3, 2, 0)
+    assert lane.breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_client_error_is_not_retried_and_keeps_circuit_closed():
+    provider = ScriptedProvider(StatusError(400), StatusError(400), StatusError(400))
+    gateway = LLMGateway(provider)
+
+    for _ in range(3):
+        with pytest.raises(StatusError):
+            await gateway.complete("m", MESSAGES)
+    assert provider.calls == 3
+    assert gateway.lane("m").breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_after_threshold_and_fails_fast(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_MAX_RETRIES", 0)
+    provider = ScriptedProvider(StatusError(503), StatusError(503))
+    gateway = LLMGateway(provider)
+
+    for _ in range(2):
+        with pytest.raises(StatusError):
+            await gateway.complete("m", MESSAGES)
+    lane = gateway.lane("m")
+    assert lane.breaker.state == "open"
+
+    with pytest.raises(LLMUnavailableError) as error:
+        await gateway.complete("m", MESSAGES)
+    assert not isinstance(error.value, LLMDeadlineExceeded)
+    assert provider.calls == 2
+    assert lane.rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_half_open_trial_closes_circuit_and_admits_one_call(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_MAX_RETRIES", 0)
+    provider = ScriptedProvider(StatusError(503), StatusError(503), 0.05)
+    gateway = LLMGateway(provider)
+    for _ in range(2):
+        with pytest.raises(StatusError):
+            await gateway.complete("m", MESSAGES)
+    await asyncio.sleep(0.06)
+    breaker = gateway.lane("m").breaker
+    assert breaker.state == "half_open"
+
+    trial = asyncio.ensure_future(gateway.complete("m", MESSAGES))
+    await asyncio.sleep(0.01)
+    # Only the trial reaches the model while it is in flight
+    with pytest.raises(LLMUnavailableError):
+        await gateway.complete("m", MESSAGES)
+    assert await trial == "late"
+    assert breaker.state == "closed"
+    assert await gateway.complete("m", MESSAGES) == "ok"
+
+
+@pytest.mark.asyncio
+async def test_failed_half_open_trial_reopens_circuit(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_MAX_RETRIES", 0)
+    gateway = LLMGateway(ScriptedProvider(StatusError(503), StatusError(503), StatusError(503)))
+    for _ in range(2):
+        with pytest.raises(StatusError):
+            await gateway.complete("m", MESSAGES)
+    await asyncio.sleep(0.06)
+
+    with pytest.raises(StatusError):
+        await gateway.complete("m", MESSAGES)
+    breaker = gateway.lane("m").breaker
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_half_open_trial_releases_the_trial(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_MAX_RETRIES", 0)
+    gateway = LLMGateway(ScriptedProvider(StatusError(503), StatusError(503), 10.0, "recovered"))
+    for _ in range(2):
+        with pytest.raises(StatusError):
+            await gateway.complete("m", MESSAGES)
+    await asyncio.sleep(0.06)
+
+    trial = asyncio.ensure_future(gateway.complete("m", MESSAGES))
+    await asyncio.sleep(0.01)
+    trial.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await trial
+
+    breaker = gateway.lane("m").breaker
+    assert breaker.state == "half_open"
+    assert not breaker.trial_in_flight
+    assert await gateway.complete("m", MESSAGES) == "recovered"
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_throttling_does_not_trip_circuit():
+    provider = ScriptedProvider()
+    gateway = LLMGateway(provider)
+    lane = gateway.lane("m")
+    lane.requests = TokenBucket(2)
+    set_request_deadline(0.2)
+
+    results = await asyncio.gather(*(gateway.complete("m", MESSAGES) for _ in range(6)), return_exceptions=True)
+    throttled = [r for r in results if isinstance(r, LLMThrottled)]
+    assert [r for r in results if r == "ok"] == ["ok", "ok"]
+    assert len(throttled) == 4
+    assert provider.calls == 2
+    assert lane.breaker.state == "closed"
+    assert lane.breaker.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_deadline_expiry_stops_a_slow_call():
+    provider = ScriptedProvider(10.0)
+    gateway = LLMGateway(provider)
+    set_request_deadline(0.05)
+
+    with pytest.raises(LLMDeadlineExceeded) as error:
+        await gateway.complete("m", MESSAGES)
+    # The model was reached and did not answer in time: that is an upstream failure
+    assert not isinstance(error.value, LLMThrottled)
+    assert provider.calls == 1
+    assert gateway.lane("m").breaker.failures == 1
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_refuses_waits_past_the_deadline():
+    bucket = TokenBucket(60)
+    assert await bucket.acquire(60) == 0.0
+    waited = await bucket.acquire(1)
+    assert 0.5 < waited < 1.5
+    with pytest.raises(LLMThrottled):
+        await bucket.acquire(30, deadline=llm_gateway.time.monotonic() + 1)
+
+
+@pytest.mark.asyncio
+async def test_abandoned_stream_is_closed_and_releases_its_slot():
+    provider = ScriptedProvider("one two three four")
+    gateway = LLMGateway(provider)
+    lane = gateway.lane("m")
+
+    chunks = gateway.stream("m", MESSAGES)
+    assert await chunks.__anext__() == "one "
+    assert lane.in_flight == 1
+    await chunks.aclose()
+
+    assert provider.closed_streams == 1
+    assert lane.in_flight == 0
+    assert lane.semaphore._value == llm_gateway.LLM_MAX_CONCURRENCY
+
+
+@pytest.mark.asyncio
+async def test_timed_out_stream_opens_are_closed(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_MAX_RETRIES", 1)
+    monkeypatch.setattr(llm_gateway, "LLM_TIMEOUT", 0.02)
+    provider = ScriptedProvider(10.0, 10.0)
+    gateway = LLMGateway(provider)
+
+    with pytest.raises(asyncio.TimeoutError):
+        async for _ in gateway.stream("m", MESSAGES):
+            pass
+    assert provider.closed_streams == 2
+    assert gateway.lane("m").in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_stub_provider_streams_through_the_gateway():
+    gateway = LLMGateway(StubProvider(latency="fixed:0", tokens_per_sec=0, error_rate=0))
+
+    text = "".join([chunk async for chunk in gateway.stream("m", MESSAGES)])
+    assert text == await gateway.complete("m", MESSAGES)
+    assert gateway.lane("m").completion_tokens > 0